@@ -0,0 +1,207 @@
+"""
+Times each stage of the Python pipeline on synthetic data.
+
+Every stage runs on 10k, 100k and 1M synthetic trees (see
+`benchmarks/synthetic.py`). Wall and CPU time are the fastest of
+`--repeats` plain runs, and peak memory comes from one more run under
+tracemalloc. The results are written as JSON and compared with the stored
+baseline; a stage that got more than `--tolerance` and `--min-slowdown`
+seconds slower fails the run.
+
+```
+python -m benchmarks.run
+python -m benchmarks.run --sizes 10000 100000 --save-baseline
+```
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import fast_geohash
+import pruning_planting
+from benchmarks import synthetic
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'data' / 'stiles_data'))
+import parse_la_data  # noqa: E402
+
+
+SIZES = [10000, 100000, 1000000]
+RESULTS = 'tmp/benchmarks.json'
+BASELINE = 'benchmarks/baseline.json'
+TOLERANCE = 0.25
+# the fastest of this many runs is the stage's time, which is much steadier
+# than a single run
+REPEATS = 5
+# a fast stage can be 25% slower from noise alone, so it must also be at
+# least this many seconds slower to count
+MIN_SLOWDOWN = 0.005
+# the Stiles inventories are smaller than the street tree data, and generating
+# GeoJSON is slow, so the parser stages stop at this many trees
+MAX_STILES_SIZE = 100000
+
+
+def stages(size, layers, workdir):
+    """
+    The stages to benchmark at `size` trees, as (name, setup) pairs: setup
+    prepares the stage's input outside of the timing and returns a function
+    that runs the stage on it and returns the number of rows out.
+    """
+    trees = synthetic.synthetic_trees(size)
+
+    def geohash():
+        return lambda: len(fast_geohash.encode(trees['latitude'], trees['longitude'], precision=9))
+
+    def match_trees_off_hashes():
+        hashed = trees.assign(
+            geohash=fast_geohash.encode(trees['latitude'], trees['longitude'], precision=pruning_planting.PRECISION)
+        )
+        return lambda: len(pruning_planting.match_trees_off_hashes(layers['planting_street_points'], hashed))
+
+    def planting_for_trees(matcher):
+        def setup():
+            return lambda: len(pruning_planting.planting_for_trees(trees.copy(), matcher=matcher, layers=layers))
+        return setup
+
+    def pruning_for_trees():
+        planted = pruning_planting.planting_for_trees(trees.copy(), layers=layers)
+        return lambda: len(pruning_planting.pruning_for_trees(planted, layers=layers))
+
+    def enrich_trees():
+        return lambda: len(pruning_planting.enrich_trees(trees.copy(), layers))
+
+    yield 'geohash', geohash
+    yield 'match_trees_off_hashes', match_trees_off_hashes
+    yield 'planting_for_trees[geohash]', planting_for_trees('geohash')
+    yield 'planting_for_trees[nearest]', planting_for_trees('nearest')
+    yield 'pruning_for_trees', pruning_for_trees
+    yield 'enrich_trees', enrich_trees
+
+    if size <= MAX_STILES_SIZE:
+        city_dir = synthetic.write_city_geojson(workdir / str(size), 'agoura-hills', size)
+
+        def stiles_get_maximal_df():
+            return lambda: len(parse_la_data.CityParser(city_dir).get_maximal_df())
+
+        def stiles_iter_chunks():
+            return lambda: sum(len(chunk) for chunk in parse_la_data.CityParser(city_dir).iter_chunks())
+
+        yield 'stiles_get_maximal_df', stiles_get_maximal_df
+        yield 'stiles_iter_chunks', stiles_iter_chunks
+
+
+def measure(setup, repeats=REPEATS):
+    """
+    Run a stage `repeats` times for the fastest wall and CPU time, and once
+    more under tracemalloc for its peak memory.
+    """
+    run = setup()
+    wall = cpu = float('inf')
+    for _ in range(repeats):
+        start, start_cpu = time.perf_counter(), time.process_time()
+        rows = run()
+        wall = min(wall, time.perf_counter() - start)
+        cpu = min(cpu, time.process_time() - start_cpu)
+
+    run = setup()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'rows_out': rows, 'wall_s': round(wall, 4), 'cpu_s': round(cpu, 4), 'peak_mb': round(peak / 2 ** 20, 2)}
+
+
+def run_benchmarks(sizes, segments, only=None, repeats=REPEATS):
+    layers = synthetic.synthetic_layers(segments)
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in sizes:
+            for name, setup in stages(size, layers, Path(workdir)):
+                if only and not any(pattern in name for pattern in only):
+                    continue
+                result = {'stage': name, 'size': size, **measure(setup, repeats)}
+                print(
+                    f'{name:32} {size:>9} {result["wall_s"]:>9.3f}s {result["cpu_s"]:>9.3f}s cpu '
+                    f'{result["peak_mb"]:>9.1f} MB',
+                    file=sys.stderr
+                )
+                results.append(result)
+    return {
+        'machine': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'segments': segments,
+        'repeats': repeats,
+        'results': results,
+    }
+
+
+def compare(results, baseline, tolerance=TOLERANCE, min_slowdown=MIN_SLOWDOWN):
+    """
+    Return the stages that are both more than `tolerance` and more than
+    `min_slowdown` seconds slower than the baseline, as (stage, size,
+    baseline seconds, seconds) tuples.
+    """
+    previous = {(r['stage'], r['size']): r for r in baseline['results']}
+    regressions = []
+    for result in results['results']:
+        before = previous.get((result['stage'], result['size']))
+        if (
+            before
+            and result['wall_s'] > before['wall_s'] * (1 + tolerance)
+            and result['wall_s'] - before['wall_s'] >= min_slowdown
+        ):
+            regressions.append((result['stage'], result['size'], before['wall_s'], result['wall_s']))
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmarks the Python stages on synthetic data.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+        help=f'numbers of trees to run every stage on. defaults to {" ".join(map(str, SIZES))}')
+    parser.add_argument('--segments', type=int, default=5000,
+        help='number of synthetic street segments. defaults to 5000')
+    parser.add_argument('--only', nargs='+',
+        help='only run the stages whose names contain one of these')
+    parser.add_argument('-o', '--output', default=RESULTS,
+        help=f'where to write the results. defaults to {RESULTS}')
+    parser.add_argument('-b', '--baseline', default=BASELINE,
+        help=f'results to compare against. defaults to {BASELINE}')
+    parser.add_argument('-t', '--tolerance', type=float, default=TOLERANCE,
+        help=f'how much slower than the baseline a stage may get, as a fraction. defaults to {TOLERANCE}')
+    parser.add_argument('--min-slowdown', type=float, default=MIN_SLOWDOWN,
+        help=f'how many seconds slower a stage must also get to fail. defaults to {MIN_SLOWDOWN}')
+    parser.add_argument('-r', '--repeats', type=int, default=REPEATS,
+        help=f'number of timed runs of each stage, the fastest of which is kept. defaults to {REPEATS}')
+    parser.add_argument('--save-baseline', action='store_true',
+        help='store these results as the new baseline instead of comparing with it')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = run_benchmarks(args.sizes, args.segments, args.only, args.repeats)
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.min_slowdown)
+        for stage, size, before, after in regressions:
+            print(f'REGRESSION {stage} at {size} trees: {before:.3f}s -> {after:.3f}s', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
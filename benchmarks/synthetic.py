@@ -0,0 +1,143 @@
+"""
+Synthetic trees and reference layers for the benchmarks.
+
+Everything is generated inside a Santa Monica-sized bounding box with a
+fixed seed, so runs are repeatable and the layers have the same shape as
+the ones `pruning_planting.load_reference_layers` returns: a street grid
+of planting segments, a few medians, pruning years for the segments and
+pruning zones covering the city, with their cell index.
+"""
+
+import json
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+import pruning_planting
+import reference_index
+import tree_io
+import zone_index
+
+
+# south, west, north, east
+BBOX = (34.000, -118.520, 34.050, -118.440)
+SPECIES = [
+    ('Washingtonia robusta', 'Mexican Fan Palm'),
+    ('Ficus microcarpa', 'Indian Laurel Fig'),
+    ('Quercus agrifolia', 'Coast Live Oak'),
+    ('Jacaranda mimosifolia', 'Jacaranda'),
+    ('Platanus racemosa', 'California Sycamore'),
+]
+
+
+def _segments(rng, count, prefix):
+    # short east-west and north-south blocks along a street grid
+    south, west, north, east = BBOX
+    horizontal = rng.random(count) < 0.5
+    x0 = rng.uniform(west, east, count)
+    y0 = rng.uniform(south, north, count)
+    length = rng.uniform(0.0005, 0.002, count)
+    x1 = np.where(horizontal, x0 + length, x0)
+    y1 = np.where(horizontal, y0, y0 + length)
+    lines = shapely.linestrings(np.stack([np.stack([x0, y0], axis=1), np.stack([x1, y1], axis=1)], axis=1))
+    return gpd.GeoDataFrame({
+        'SEGMENT': [f'{prefix}{i}' for i in range(count)],
+        'YEAR': rng.integers(2019, 2030, count).astype(np.float64),
+        'REPLACE': rng.choice([botanical for botanical, _ in SPECIES], count),
+        'CYCLE_NO': rng.choice(['1A', '2A', '2B', '3A', '3B', '3C'], count),
+    }, geometry=lines, crs='epsg:4326')
+
+
+def synthetic_layers(segments=5000, seed=0, densify=None):
+    """
+    Reference layers with `segments` street segments (and a tenth as many
+    median segments), in the form `load_reference_layers` returns them.
+    """
+    rng = np.random.default_rng(seed)
+    streets = _segments(rng, segments, 'S')
+    medians = _segments(rng, max(1, segments // 10), 'M')
+
+    south, west, north, east = BBOX
+    edges = np.linspace(west, east, 4)
+    zones = gpd.GeoDataFrame({
+        'pruning_zone': [1, 2, 3],
+        'Shape_Leng': 0.0,
+        'Shape_Area': 0.0,
+    }, geometry=[shapely.box(edges[i], south, edges[i + 1], north) for i in range(3)], crs='epsg:4326')
+
+    segment_ids = pd.concat([streets['SEGMENT'], medians['SEGMENT']])
+    years = pd.Series(
+        rng.choice(['2017-2018', '2018-2019', '2019-2020'], len(segment_ids)), index=segment_ids.to_numpy()
+    )
+    return {
+        'planting_streets': streets,
+        'planting_medians': medians,
+        'planting_street_index': reference_index.ReferenceIndex(streets),
+        'planting_median_index': reference_index.ReferenceIndex(medians),
+        'planting_street_points': pruning_planting.explode_lines(streets, densify=densify),
+        'planting_median_points': pruning_planting.explode_lines(medians, densify=densify),
+        'pruning_years': years,
+        'pruning_zones': zones,
+        'pruning_zone_index': zone_index.ZoneIndex.build(zones),
+    }
+
+
+def synthetic_trees(count, seed=0):
+    """
+    `count` trees with the fields parse-trees.js writes that the Python
+    stages use, a tenth of them on medians, with the dtypes
+    `tree_io.read_trees` gives them.
+    """
+    rng = np.random.default_rng(seed)
+    south, west, north, east = BBOX
+    species = rng.integers(0, len(SPECIES), count)
+    return tree_io.typed(pd.DataFrame({
+        'tree_id': np.arange(count),
+        'name_botanical': np.array([botanical for botanical, _ in SPECIES])[species],
+        'name_common': np.array([common for _, common in SPECIES])[species],
+        'latitude': rng.uniform(south, north, count),
+        'longitude': rng.uniform(west, east, count),
+        'location_description': np.where(rng.random(count) < 0.1, 'Median', 'Street ROW'),
+        'heritage': rng.random(count) < 0.01,
+    }))
+
+
+def write_city_geojson(directory, city, count, seed=0):
+    """
+    Write a Stiles-style GeoJSON inventory of `count` trees for `city`
+    (one of the cities in parse_la_data.CITY_SCHEMAS that uses
+    InventoryID, species, botanical, Address, Street, DBH and height)
+    along with twenty unused properties, as the real inventories have.
+    """
+    rng = np.random.default_rng(seed)
+    south, west, north, east = BBOX
+    dbh = ['0-6', '07-12', '13-18', '19-24', '25-30', '31+']
+    height = ['01-15', '15-30', '30-45', '45-60', '60+']
+    species = rng.integers(0, len(SPECIES), count)
+    features = []
+    for i in range(count):
+        botanical, common = SPECIES[species[i]]
+        properties = {f'unused_{j}': 'x' * 12 for j in range(20)}
+        properties.update({
+            'InventoryID': i,
+            'species': common.upper(),
+            'botanical': botanical.upper(),
+            'Address': int(rng.integers(1, 3000)),
+            'Street': 'OCEAN AVE',
+            'DBH': dbh[i % len(dbh)],
+            'height': height[i % len(height)],
+        })
+        features.append({
+            'type': 'Feature',
+            'properties': properties,
+            'geometry': {'type': 'Point', 'coordinates': [rng.uniform(west, east), rng.uniform(south, north)]},
+        })
+
+    path = Path(directory) / city
+    path.mkdir(parents=True, exist_ok=True)
+    with open(path / f'{city}.geojson', 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f)
+    return path
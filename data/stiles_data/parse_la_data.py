@@ -1,404 +1,511 @@
 import argparse
+import io
+import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# util.py, tree_io.py and species_index.py live at the root of the repository
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT))
+import species_index  # noqa: E402
+import tree_io  # noqa: E402
+import util  # noqa: E402
+
+
+# the columns every city is normalized to; ones a city doesn't have are left
+# empty, except for the species attributes, which are looked up by name
+COMMON_COLUMNS = [
+    'tree_id',
+    'source_tree_id',
+    'city',
+    'name_common',
+    'name_botanical',
+    'address',
+    'height_min_ft',
+    'height_max_ft',
+    'diameter_min_in',
+    'diameter_max_in',
+    'estimated_value',
+    'location_description',
+    'latitude',
+    'longitude',
+] + species_index.SPECIES_COLUMNS
+COMMON_SCHEMA = pa.schema([
+    ('tree_id', pa.int64()),
+    ('source_tree_id', pa.string()),
+    ('city', pa.string()),
+    ('name_common', pa.string()),
+    ('name_botanical', pa.string()),
+    ('address', pa.string()),
+    ('height_min_ft', pa.float64()),
+    ('height_max_ft', pa.float64()),
+    ('diameter_min_in', pa.float64()),
+    ('diameter_max_in', pa.float64()),
+    ('estimated_value', pa.float64()),
+    ('location_description', pa.string()),
+    ('latitude', pa.float64()),
+    ('longitude', pa.float64()),
+    ('species_id', pa.int64()),
+    ('family_name_botanical', pa.string()),
+    ('family_name_common', pa.string()),
+    ('shade_production', pa.string()),
+    ('irrigation_requirements', pa.string()),
+    ('form', pa.string()),
+    ('type', pa.string()),
+    ('nativity', pa.string()),
+    ('iucn_status', pa.string()),
+    ('ipc_rating', pa.string()),
+    ('ipc_url', pa.string()),
+    ('eol_id', pa.int64()),
+    ('eol_url', pa.string()),
+])
+DEFAULT_CHUNK_SIZE = 50000
+
+
+DBH_CATEGORIES = ['0-6', '07-12', '13-18', '19-24', '25-30', '31+']
+HEIGHT_CATEGORIES = ['01-15', '15-30', '30-45', '45-60', '60+']
+
+# How each city's GeoJSON properties map onto our columns. A new city only
+# needs an entry here (keyed on its directory name):
+#
+#   columns:    output column -> source column, copied as is
+#   title:      output column -> source column, title-cased
+#   address:    (number column, street column) joined with a space, street title-cased,
+#               or {'column': source column, 'before': text} to keep what comes before `text`, title-cased
+#   categories: source column -> (min column, max column, categories), see CityParser.cat_parser
+#
+# Every city also gets city, latitude and longitude.
+CITY_SCHEMAS = {
+    'los-angeles-city': {
+        'title': {'name_common': 'species'},
+    },
+    'los-angeles-county': {
+        'columns': {'diameter_min_in': 'DIAMETER'},
+        'title': {'name_common': 'SPECIES'},
+    },
+    'agoura-hills': {
+        'columns': {'tree_id': 'InventoryID'},
+        'title': {'name_common': 'species', 'name_botanical': 'botanical'},
+        'address': ('Address', 'Street'),
+        'categories': {
+            'DBH': ('diameter_min_in', 'diameter_max_in', DBH_CATEGORIES),
+            'height': ('height_min_feet', 'height_max_feet', HEIGHT_CATEGORIES),
+        },
+    },
+    'alhambra': {
+        'columns': {'tree_id': 'Tree'},
+        'title': {'name_common': 'species', 'name_botanical': 'BotanicalN'},
+        'address': ('Address', 'Street'),
+        'categories': {
+            'DBH': ('diameter_min_in', 'diameter_max_in', DBH_CATEGORIES),
+            'height': ('height_min_feet', 'height_max_feet', HEIGHT_CATEGORIES),
+        },
+    },
+    'arcadia': {
+        'columns': {'tree_id': 'TREE_ID'},
+        'title': {'name_common': 'COM_NAME'},
+        'address': {'column': 'ADDR', 'before': 'ARCADIA'},
+    },
+    'artesia': {
+        'columns': {'tree_id': 'INVENTORYI'},
+        'title': {'name_common': 'species', 'name_botanical': 'BOTANICALN'},
+        'address': ('ADDRESS', 'STREET'),
+        'categories': {
+            'DBH': ('diameter_min_in', 'diameter_max_in', DBH_CATEGORIES),
+            'height': ('height_min_feet', 'height_max_feet', HEIGHT_CATEGORIES),
+        },
+    },
+    'bell-gardens': {
+        'columns': {'tree_id': 'INVENTORYI'},
+        'title': {'name_common': 'species', 'name_botanical': 'BOTANICALN'},
+        'address': ('ADDRESS', 'STREET'),
+        'categories': {
+            'DBH': ('diameter_min_in', 'diameter_max_in', DBH_CATEGORIES),
+            'height': ('height_min_feet', 'height_max_feet', HEIGHT_CATEGORIES),
+        },
+    },
+    'bellflower': {
+        'columns': {'tree_id': 'InventoryID', 'estimated_value': 'EstValue'},
+        'title': {'name_common': 'species', 'name_botanical': 'botanical'},
+        'address': ('Address', 'Street'),
+        'categories': {
+            'DBH': ('diameter_min_in', 'diameter_max_in', DBH_CATEGORIES + ['---']),
+            'height': ('height_min_feet', 'height_max_feet', HEIGHT_CATEGORIES + ['---']),
+        },
+    },
+    'beverly-hills': {
+        'columns': {'tree_id': 'TREEID'},
+        'title': {'name_common': 'species', 'name_botanical': 'BOTANICAL'},
+        'address': ('ADDRESS', 'STREET'),
+        'categories': {
+            'HEIGHT_RAN': (
+                'height_min_feet', 'height_max_feet', ['1-15', '16-30', '31-45', '46-60', '>60', '------', '']
+            ),
+        },
+    },
+}
+
+
+def source_columns(schema):
+    """
+    The GeoJSON properties a city schema refers to, in a stable order.
+    """
+    columns = list(schema.get('columns', {}).values()) + list(schema.get('title', {}).values())
+    address = schema.get('address')
+    if isinstance(address, dict):
+        columns.append(address['column'])
+    elif address:
+        columns.extend(address)
+    columns.extend(schema.get('categories', {}))
+    return list(dict.fromkeys(columns))
+
+
+def compile_schema(schema):
+    """
+    Turn a city schema into a function that takes the source dataframe
+    (with city, latitude and longitude already set) and returns the
+    city's columns, all built column-wise in one pass.
+    """
+    columns = dict(schema.get('columns', {}))
+    title = dict(schema.get('title', {}))
+    address = schema.get('address')
+    categories = dict(schema.get('categories', {}))
+
+    def transform(df):
+        out = {name: df[source] for name, source in columns.items()}
+        out.update({name: df[source].str.title() for name, source in title.items()})
+        if isinstance(address, dict):
+            out['address'] = df[address['column']].str.split(address['before']).str[0].str.title()
+        elif address:
+            number, street = address
+            out['address'] = df[number].astype(str).str.cat(df[street].str.title(), sep=' ')
+        for og_field, (min_field, max_field, cats) in categories.items():
+            parsed = CityParser.cat_parser(df[[og_field]].copy(), min_field, max_field, og_field, cats)
+            out[min_field] = parsed[min_field]
+            out[max_field] = parsed[max_field]
+        out.update({name: df[name] for name in ['city', 'latitude', 'longitude']})
+        return pd.DataFrame(out, index=df.index)
+
+    return transform
+
+
+def iter_features(path, block_size=1 << 20):
+    """
+    Yield the features of a GeoJSON FeatureCollection one at a time,
+    reading the file a block at a time instead of parsing it whole.
+    """
+    with open(path, 'rb') as f:
+        # skip ahead to the start of the features array. the keys are ascii,
+        # so they can be found in the bytes before decoding any of them
+        buffer = b''
+        while True:
+            start = buffer.find(b'"features"')
+            bracket = buffer.find(b'[', start) if start >= 0 else -1
+            if bracket >= 0:
+                break
+            block = f.read(block_size)
+            if not block:
+                return
+            buffer += block
+        f.seek(bracket + 1)
+        yield from tree_io.iter_raw_array(io.TextIOWrapper(f, encoding='utf-8'), block_size, parse=True)
+
+
+def _point(geometry):
+    # the first position of the geometry, straight from its coordinates
+    coordinates = (geometry or {}).get('coordinates')
+    while coordinates and isinstance(coordinates[0], list):
+        coordinates = coordinates[0]
+    return (coordinates[0], coordinates[1]) if coordinates else (np.nan, np.nan)
 
 
 class CityParser(object):
 
-    def __init__(self, path: Path):
+    def __init__(self, path: Path, schema=None):
         geo_jsons = [p for p in path.iterdir() if p.is_file() and p.suffix == '.geojson']
         self.city = path.parts[-1]
+        self.schema = CITY_SCHEMAS.get(self.city, {}) if schema is None else schema
+        self.transform = compile_schema(self.schema)
         assert len(geo_jsons) <= 1
         if len(geo_jsons) > 0:
             self.geo_json_path = geo_jsons[-1]
         else:
             self.geo_json_path = None
 
-    def get_maximal_df(self):
+    @util.stage
+    def read_df(self):
+        """
+        Read the GeoJSON, loading only the properties the city's schema uses.
+        """
         assert self.geo_json_path
-        df = gpd.read_file(str(self.geo_json_path.absolute())).assign(city=self.city)
+        df = gpd.read_file(
+            str(self.geo_json_path.absolute()), engine='pyogrio', columns=source_columns(self.schema)
+        ).assign(city=self.city)
         return self.lat_lon_from_geometry(df)
 
+    @util.stage
+    def get_maximal_df(self):
+        return self.transform(self.read_df())
+
+    def iter_chunks(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Stream the GeoJSON and yield the city's trees as dataframes of at most
+        chunk_size rows, with the same columns as get_maximal_df.
+
+        Only the properties the schema uses are kept from each feature, and
+        latitude and longitude come straight from the feature's coordinates
+        without building shapely geometries, so memory use depends on
+        chunk_size rather than on the size of the city.
+        """
+        assert self.geo_json_path
+        columns = source_columns(self.schema)
+        rows = []
+        coordinates = []
+        for feature in iter_features(self.geo_json_path):
+            properties = feature.get('properties') or {}
+            rows.append([properties.get(column) for column in columns])
+            coordinates.append(_point(feature.get('geometry')))
+            if len(rows) == chunk_size:
+                yield self._chunk(columns, rows, coordinates)
+                rows = []
+                coordinates = []
+        if rows:
+            yield self._chunk(columns, rows, coordinates)
+
+    def _chunk(self, columns, rows, coordinates):
+        longitudes, latitudes = zip(*coordinates)
+        df = pd.DataFrame(rows, columns=columns).assign(
+            city=self.city,
+            latitude=np.array(latitudes, dtype=np.float64),
+            longitude=np.array(longitudes, dtype=np.float64)
+        )
+        return self.transform(df)
+
     @staticmethod
     def lat_lon_from_geometry(df, y_is_lat=True):
+        geometry = gpd.GeoSeries(df['geometry'])
+        x, y = geometry.x.to_numpy(), geometry.y.to_numpy()
         if y_is_lat:
-            return df.assign(
-                latitude=df['geometry'].apply(lambda p: p.y),
-                longitude=df['geometry'].apply(lambda p: p.x)
-            )
-        return df.assign(
-            latitude=df['geometry'].apply(lambda p: p.x),
-            longitude=df['geometry'].apply(lambda p: p.y)
-        )
+            return df.assign(latitude=y, longitude=x)
+        return df.assign(latitude=x, longitude=y)
 
     @staticmethod
-    def cat_parser(df, min_field, max_field, og_field, cats):
-        actual_cats = [cat for cat in df[og_field].unique().tolist() if set(cat.strip()) != {'-'}]
-        if len(actual_cats) > len(cats):
-            raise RuntimeError(f'{len(cats)} categories but categories in df={df[og_field].unique().tolist()}')
-        df[min_field] = -1
-        df[max_field] = -1
+    def category_ranges(cats):
+        """
+        The (min, max) each category stands for: "07-12" is (7, 12), "31+" and
+        ">60" are (31, -1) and (60, -1), and anything else (e.g. "---") is (-1, -1).
+        """
+        ranges = {}
         for cat in cats:
-            mask = df[og_field].str.strip() == cat
             if len(cat.split('-')) == 2:
                 min_val, max_val = cat.split('-')
-                df.loc[mask, min_field] = int(min_val)
-                df.loc[mask, max_field] = int(max_val)
+                ranges[cat] = (int(min_val), int(max_val))
             elif cat.endswith('+'):
-                min_val = int(cat[:-1])
-                df.loc[mask, min_field] = int(min_val)
+                ranges[cat] = (int(cat[:-1]), -1)
             elif cat.startswith('>'):
-                min_val = int(cat[1:])
-                df.loc[mask, min_field] = int(min_val)
+                ranges[cat] = (int(cat[1:]), -1)
+            else:
+                ranges[cat] = (-1, -1)
+        return ranges
+
+    @classmethod
+    @util.stage
+    def cat_parser(cls, df, min_field, max_field, og_field, cats):
+        # parse each distinct value once, then look every row up by its category code
+        values = df[og_field].astype('category')
+        stripped = pd.Series(values.cat.categories, dtype=object).str.strip()
+        actual_cats = [cat for cat in stripped if not (isinstance(cat, str) and set(cat) == {'-'})]
+        if len(actual_cats) > len(cats):
+            raise RuntimeError(f'{len(cats)} categories but categories in df={df[og_field].unique().tolist()}')
 
+        ranges = cls.category_ranges(cats)
+        # the extra last row is for missing values, whose code is -1
+        table = np.array([ranges.get(cat, (-1, -1)) for cat in stripped] + [(-1, -1)], dtype=np.int64)
+        codes = values.cat.codes.to_numpy()
+        df[min_field] = table[codes, 0]
+        df[max_field] = table[codes, 1]
         return df
 
 
-class LosAngelesCityParser(CityParser):
-    def __init__(self, path: Path):
-        super().__init__(path)
-
-    def get_maximal_df(self):
-        df = super().get_maximal_df()
-        df = df.assign(name_common=df['species'].str.title())
-        df = self.lat_lon_from_geometry(df)
-        return df[['name_common', 'latitude', 'longitude', 'city']]
-
-
-class LosAngelesCountyParser(CityParser):
-
-    def __init__(self, path: Path):
-        super().__init__(path)
-
-    def get_maximal_df(self):
-        df = super().get_maximal_df()
-        df = df.assign(
-            name_common=df['SPECIES'].str.title(),
-            diameter_min_in=df['DIAMETER']
-        )
-        return df[['name_common', 'latitude', 'longitude', 'diameter_min_in', 'city']]
-
-
-class AgouraHillsParser(CityParser):
-
-    def __init__(self, path: Path):
-        super().__init__(path)
-
-    def get_maximal_df(self):
-        df = super().get_maximal_df()
-        df = df.assign(
-            tree_id=df['InventoryID'],
-            name_common=df['species'].str.title(),
-            name_botanical=df['botanical'].str.title(),
-            address=df['Address'].astype(str).str.cat(df['Street'].str.title(), sep=' ')
-        )
-        df = self.cat_parser(
-            df,
-            'diameter_min_in',
-            'diameter_max_in',
-            'DBH',
-            ['0-6', '07-12', '13-18', '19-24', '25-30', '31+']
-        )
-        df = self.cat_parser(
-            df,
-            'height_min_feet',
-            'height_max_feet',
-            'height',
-            ['01-15', '15-30', '30-45', '45-60', '60+']
-        )
-
-        return df[
-            [
-                'tree_id',
-                'name_common',
-                'name_botanical',
-                'address',
-                'height_min_feet',
-                'city',
-                'height_max_feet',
-                'latitude',
-                'longitude',
-                'diameter_min_in',
-                'diameter_max_in',
-            ]
-        ]
-
-
-class AlhambraParser(CityParser):
-
-    def __init__(self, path: Path):
-        super().__init__(path)
-
-    def get_maximal_df(self):
-        df = super().get_maximal_df()
-        df = df.assign(
-            name_common=df['species'].str.title(),
-            name_botanical=df['BotanicalN'].str.title(),
-            tree_id=df['Tree'],
-            address=df['Address'].astype(str).str.cat(df['Street'].str.title(), sep=' ')
-        )
-        df = self.cat_parser(
-            df,
-            'diameter_min_in',
-            'diameter_max_in',
-            'DBH',
-            ['0-6', '07-12', '13-18', '19-24', '25-30', '31+']
-        )
-        df = self.cat_parser(
-            df,
-            'height_min_feet',
-            'height_max_feet',
-            'height',
-            ['01-15', '15-30', '30-45', '45-60', '60+']
-        )
-        return df[
-            [
-                'name_common',
-                'name_botanical',
-                'city',
-                'tree_id',
-                'address',
-                'height_min_feet',
-                'height_max_feet',
-                'latitude',
-                'longitude',
-                'diameter_min_in',
-                'diameter_max_in',
-
-            ]
-        ]
-
-
-class ArcadiaParser(CityParser):
-
-    def __init__(self, path: Path):
-        super().__init__(path)
-
-    def get_maximal_df(self):
-        df = super().get_maximal_df()
-        df = df.assign(
-            tree_id=df['TREE_ID'],
-            name_common=df['COM_NAME'].str.title(),
-            address=df['ADDR'].str.split('ARCADIA').str[0].str.title()
-        )
-        return df[
-            [
-                'name_common',
-                'city',
-                'tree_id',
-                'address',
-                'latitude',
-                'longitude',
-
-            ]
-        ]
-
-
-class BellflowerParser(CityParser):
-
-    def __init__(self, path: Path):
-        super().__init__(path)
-
-    def get_maximal_df(self):
-        df = super().get_maximal_df()
-        df = df.assign(
-            estimated_value=df['EstValue'],
-            name_common=df['species'].str.title(),
-            name_botanical=df['botanical'].str.title(),
-            address=df['Address'].astype(str).str.cat(df['Street'].str.title(), sep=' '),
-            tree_id=df['InventoryID'],
-        )
-        df = self.cat_parser(
-            df,
-            'diameter_min_in',
-            'diameter_max_in',
-            'DBH',
-            ['0-6', '07-12', '13-18', '19-24', '25-30', '31+', '---']
-        )
-        df = self.cat_parser(
-            df,
-            'height_min_feet',
-            'height_max_feet',
-            'height',
-            ['01-15', '15-30', '30-45', '45-60', '60+', '---']
-        )
-
-        return df[
-            [
-                'name_common',
-                'name_botanical',
-                'city',
-                'tree_id',
-                'address',
-                'estimated_value',
-                'height_min_feet',
-                'height_max_feet',
-                'latitude',
-                'longitude',
-                'diameter_min_in',
-                'diameter_max_in',
-            ]
-        ]
-
-
-class BellGardensParser(CityParser):
-
-    def __init__(self, path: Path):
-        super().__init__(path)
-
-    def get_maximal_df(self):
-        df = super().get_maximal_df()
-        df = df.assign(
-            name_common=df['species'].str.title(),
-            name_botanical=df['BOTANICALN'].str.title(),
-            tree_id=df['INVENTORYI'],
-            address=df['ADDRESS'].astype(str).str.cat(df['STREET'].str.title(), sep=' ')
-        )
-        df = self.cat_parser(
-            df,
-            'diameter_min_in',
-            'diameter_max_in',
-            'DBH',
-            ['0-6', '07-12', '13-18', '19-24', '25-30', '31+']
-        )
-        df = self.cat_parser(
-            df,
-            'height_min_feet',
-            'height_max_feet',
-            'height',
-            ['01-15', '15-30', '30-45', '45-60', '60+']
-        )
-
-        return df[
-            [
-                'name_common',
-                'name_botanical',
-                'city',
-                'tree_id',
-                'address',
-                'height_min_feet',
-                'height_max_feet',
-                'latitude',
-                'longitude',
-                'diameter_min_in',
-                'diameter_max_in',
-            ]
-        ]
-
-
-class ArtesiaParser(CityParser):
-
-    def __init__(self, path: Path):
-        super().__init__(path)
-
-    def get_maximal_df(self):
-        df = super().get_maximal_df()
-        df = df.assign(
-            tree_id=df['INVENTORYI'],
-            address=df['ADDRESS'].astype(str).str.cat(df['STREET'].str.title(), sep=' '),
-            name_botanical=df['BOTANICALN'].str.title(),
-            name_common=df['species'].str.title(),
-        )
-        df = self.cat_parser(
-            df,
-            'diameter_min_in',
-            'diameter_max_in',
-            'DBH',
-            ['0-6', '07-12', '13-18', '19-24', '25-30', '31+']
-        )
-        df = self.cat_parser(
-            df,
-            'height_min_feet',
-            'height_max_feet',
-            'height',
-            ['01-15', '15-30', '30-45', '45-60', '60+']
-        )
-        return df[
-            [
-                'name_common',
-                'name_botanical',
-                'city',
-                'tree_id',
-                'address',
-                'height_min_feet',
-                'height_max_feet',
-                'latitude',
-                'longitude',
-                'diameter_min_in',
-                'diameter_max_in',
-
-            ]
-        ]
-
-
-class BeverlyHillsParser(CityParser):
-
-    def __init__(self, path: Path):
-        super().__init__(path)
-
-    def get_maximal_df(self):
-        df = super().get_maximal_df()
-        df = df.assign(
-            tree_id=df['TREEID'],
-            address=df['ADDRESS'].astype(str).str.cat(df['STREET'].str.title(), sep=' '),
-            name_botanical=df['BOTANICAL'].str.title(),
-            name_common=df['species'].str.title(),
-        )
-        df = self.cat_parser(
-            df,
-            'height_min_feet',
-            'height_max_feet',
-            'HEIGHT_RAN',
-            ['1-15', '16-30', '31-45', '46-60', '>60', '------', '']
-        )
-        return df[
-            [
-                'name_common',
-                'name_botanical',
-                'city',
-                'tree_id',
-                'address',
-                'height_min_feet',
-                'height_max_feet',
-                'latitude',
-                'longitude',
-            ]
-        ]
-
-
 class StilesDataParser(object):
 
-    mapper = {
-        'los-angeles-city': LosAngelesCityParser,
-        'los-angeles-county': LosAngelesCountyParser,
-        'agoura-hills': AgouraHillsParser,
-        'alhambra' : AlhambraParser,
-        'arcadia': ArcadiaParser,
-        'artesia': ArtesiaParser,
-        'bell-gardens': BellGardensParser,
-        'bellflower': BellflowerParser,
-        'beverly-hills': BeverlyHillsParser
-    }
+    mapper = CITY_SCHEMAS
 
     def __init__(self, data_path):
         root_path = Path(data_path)
         self.data_dirs = ([x for x in root_path.iterdir() if x.is_dir()])
 
-    def parse_all(self):
-        for data_dir in self.data_dirs:
-            city = data_dir.parts[-1]
-            if city != 'all':
-                if city in self.mapper:
-                    city_parser = self.mapper[city](data_dir)
-                    if city_parser.geo_json_path:
-                        city_parser.get_maximal_df()
+    def city_dirs(self):
+        """
+        The directories of the cities there is a parser and a GeoJSON file for.
+        """
+        return sorted(
+            data_dir for data_dir in self.data_dirs
+            if data_dir.parts[-1] in self.mapper and CityParser(data_dir).geo_json_path
+        )
+
+    @staticmethod
+    def species():
+        """
+        The species index the trees' attributes come from. It is loaded once,
+        before the cities are parsed, and handed to every worker.
+        """
+        return species_index.SpeciesIndex.load(ROOT / species_index.SPECIES_ATTRIBUTES)
+
+    @staticmethod
+    @util.stage
+    def normalize(df, species=None):
+        """
+        Put one city's trees into the COMMON_COLUMNS schema. The city's own id
+        is kept as text in source_tree_id; tree_id is assigned once all the
+        cities are combined. The species attributes come from `species`, a
+        species_index.SpeciesIndex, matched on the trees' names.
+        """
+        df = df.rename(columns={
+            'tree_id': 'source_tree_id',
+            'height_min_feet': 'height_min_ft',
+            'height_max_feet': 'height_max_ft',
+        })
+        if 'source_tree_id' in df.columns:
+            df['source_tree_id'] = df['source_tree_id'].astype(str).where(df['source_tree_id'].notna())
+        df = pd.DataFrame(df).reindex(columns=COMMON_COLUMNS[:-len(species_index.SPECIES_COLUMNS)])
+        return (species or StilesDataParser.species()).enrich(df)
+
+    @classmethod
+    def parse_city(cls, data_dir, species):
+        """
+        Parse one city directory, with the species attributes from `species`
+        (see `species`). Returns the city, its normalized trees (None
+        if it failed), the seconds it took and the error, if any.
+        """
+        city = data_dir.parts[-1]
+        start = time.perf_counter()
+        try:
+            with util.profile('StilesDataParser.parse_city') as record:
+                record['city'] = city
+                df = cls.normalize(CityParser(data_dir, cls.mapper[city]).get_maximal_df(), species)
+                record['rows_out'] = len(df)
+            return city, df, time.perf_counter() - start, None
+        except Exception:
+            return city, None, time.perf_counter() - start, traceback.format_exc()
+
+    @classmethod
+    def stream_city(cls, data_dir, part_path, species, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Stream one city directory into a Parquet file at part_path, a chunk at
+        a time, with the species attributes from `species`. Returns the city, the number of trees, the seconds it took and
+        the error, if any.
+        """
+        city = data_dir.parts[-1]
+        start = time.perf_counter()
+        rows = 0
+        try:
+            with util.profile('StilesDataParser.stream_city') as record, \
+                    pq.ParquetWriter(part_path, COMMON_SCHEMA) as writer:
+                record['city'] = city
+                for chunk in CityParser(data_dir, cls.mapper[city]).iter_chunks(chunk_size):
+                    chunk = cls.normalize(chunk, species)
+                    writer.write_table(pa.Table.from_pandas(chunk, schema=COMMON_SCHEMA, preserve_index=False))
+                    rows += len(chunk)
+                record['rows_out'] = rows
+            return city, rows, time.perf_counter() - start, None
+        except Exception:
+            return city, rows, time.perf_counter() - start, traceback.format_exc()
+
+    @staticmethod
+    def report(city, rows, seconds, error):
+        if error:
+            print(f'{city}: failed after {seconds:.1f}s\n{error}', file=sys.stderr)
+        else:
+            print(f'{city}: {rows} trees in {seconds:.1f}s', file=sys.stderr)
+
+    @util.stage
+    def write_all(self, output, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        The bounded-memory version of parse_all: every
+        city is streamed into its own Parquet part on a pool of `workers`
+        processes, and the parts are then copied into `output` batch by batch,
+        numbering the trees as they go.
+
+        Returns the number of trees written.
+        """
+        output = Path(output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        city_dirs = self.city_dirs()
+        ndjson = output.suffix in ('.ndjson', '.jsonl')
+        with tempfile.TemporaryDirectory(dir=output.parent) as tmp:
+            parts = [Path(tmp) / f'{data_dir.parts[-1]}.parquet' for data_dir in city_dirs]
+            species = self.species()
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(
+                    self.stream_city, city_dirs, parts, [species] * len(parts), [chunk_size] * len(parts)
+                ))
+
+            tree_id = 0
+            with (open(output, 'w') if ndjson else pq.ParquetWriter(output, COMMON_SCHEMA)) as writer:
+                for part, (city, rows, seconds, error) in zip(parts, results):
+                    self.report(city, rows, seconds, error)
+                    if error:
+                        continue
+                    for batch in pq.ParquetFile(part).iter_batches(batch_size=chunk_size):
+                        ids = pa.array(np.arange(tree_id, tree_id + batch.num_rows), type=pa.int64())
+                        table = pa.Table.from_batches([batch]).set_column(0, 'tree_id', ids)
+                        tree_id += batch.num_rows
+                        if ndjson:
+                            text = table.to_pandas().to_json(orient='records', lines=True)
+                            writer.write(text if text.endswith('\n') else text + '\n')
+                        else:
+                            writer.write_table(table)
+        return tree_id
+
+    @util.stage
+    def parse_all(self, workers=None):
+        """
+        Parse every city on a pool of `workers` processes and combine them into
+        one dataframe with the COMMON_COLUMNS schema, in city order.
+
+        A city that fails is reported and left out; the others still go in.
+        """
+        city_dirs = self.city_dirs()
+        species = self.species()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(self.parse_city, city_dirs, [species] * len(city_dirs)))
+
+        frames = []
+        for city, df, seconds, error in results:
+            self.report(city, 0 if df is None else len(df), seconds, error)
+            if not error:
+                frames.append(df)
+
+        if not frames:
+            return pd.DataFrame(columns=COMMON_COLUMNS)
+        trees = pd.concat(frames, ignore_index=True)
+        trees['tree_id'] = range(len(trees))
+        return trees
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--datapath", required=True, type=str)
+    parser.add_argument("-o", "--output", type=str,
+        help="where to write the combined trees (.parquet, .ndjson or .jsonl). "
+             "defaults to all/trees.parquet under --datapath")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+        help="number of cities parsed at once. defaults to the number of CPUs")
+    parser.add_argument("-c", "--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+        help=f"number of trees each city is read in at a time. defaults to {DEFAULT_CHUNK_SIZE}")
     args = parser.parse_args()
 
     data_parser = StilesDataParser(args.datapath)
-    data_parser.parse_all()
+    data_parser.write_all(
+        args.output or Path(args.datapath) / 'all' / 'trees.parquet', workers=args.workers, chunk_size=args.chunk_size
+    )
@@ -0,0 +1,300 @@
+"""
+Removes trees that appear in more than one overlapping inventory.
+
+The LA City, LA County and individual city inventories cover some of the
+same streets, so the combined Stiles dataset lists some trees twice. Two
+trees from different sources are taken to be the same tree when they are
+within `max_distance` feet of each other and their species are
+compatible; of the two, the one from the source that comes first in the
+priority order is kept. A tree is the duplicate of at most one tree from
+each other source: trees are paired with their mutually nearest match.
+
+Trees are bucketed into a grid of `max_distance`-sized cells, so each tree
+is only compared with the trees in its own and the neighbouring cells, and
+the whole thing runs in close to linear time.
+
+```
+python dedupe_trees.py all/trees.parquet all/deduped.parquet -d 10 -p arcadia los-angeles-county
+```
+
+writes the surviving trees to all/deduped.parquet and one row per removed
+tree to all/deduped.dedupe.csv.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyproj
+
+import species_index
+import tree_io
+import util
+
+
+PROJECTED_CRS = 'epsg:2229'
+DEFAULT_MAX_DISTANCE = 10.0
+# how many candidate pairs are built at a time
+PAIR_BLOCK_SIZE = 1 << 22
+# the cell itself and the neighbours that come after it, so each pair of cells is looked at once
+NEIGHBOURS = [(0, 0), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+def project(latitudes, longitudes):
+    """
+    Project coordinates to PROJECTED_CRS, which is in feet.
+    """
+    transformer = pyproj.Transformer.from_crs('epsg:4326', PROJECTED_CRS, always_xy=True)
+    return transformer.transform(np.asarray(longitudes, dtype=np.float64), np.asarray(latitudes, dtype=np.float64))
+
+
+def species_keys(trees, species=None):
+    """
+    What species compatibility is judged on, for every tree: its normalized
+    botanical name, the species id `species` (a species_index.SpeciesIndex)
+    finds for its names, and its normalized common name. Each is missing
+    (NaN, or -1 for the id) where the tree doesn't have it.
+    """
+    if species is None:
+        species = species_index.SpeciesIndex.load()
+    keys = pd.DataFrame(index=trees.index)
+    for column, key in [('name_botanical', 'botanical'), ('name_common', 'common')]:
+        names = trees[column] if column in trees.columns else pd.Series(np.nan, index=trees.index)
+        normalized = species_index.normalize_names(names)
+        keys[key] = normalized.where(normalized != '').astype(object)
+    rows = species.lookup(trees)
+    ids = species.attributes['species_id'].iloc[np.maximum(rows, 0)].fillna(-1).to_numpy(dtype=np.int64)
+    keys['species_id'] = np.where(rows >= 0, ids, -1)
+    return keys
+
+
+def _same_common_name(a, b):
+    # "oak" is compatible with "coast live oak": a generic name matches the
+    # specific names that end in it
+    return a == b or a.endswith(' ' + b) or b.endswith(' ' + a)
+
+
+def compatible_species(keys, i, j):
+    """
+    Whether trees i and j (arrays of positions) can be the same tree, going
+    by the first of these that both trees have: their botanical names,
+    their species ids or their common names. Trees that have none of them
+    in common are compatible.
+    """
+    botanical = keys['botanical'].to_numpy()
+    ids = keys['species_id'].to_numpy()
+    common = keys['common'].to_numpy()
+
+    compatible = np.ones(len(i), dtype=bool)
+    decided = np.zeros(len(i), dtype=bool)
+    both = pd.notna(botanical[i]) & pd.notna(botanical[j])
+    compatible[both] = botanical[i][both] == botanical[j][both]
+    decided |= both
+
+    both = ~decided & (ids[i] >= 0) & (ids[j] >= 0)
+    compatible[both] = ids[i][both] == ids[j][both]
+    decided |= both
+
+    both = np.nonzero(~decided & pd.notna(common[i]) & pd.notna(common[j]))[0]
+    compatible[both] = [_same_common_name(a, b) for a, b in zip(common[i[both]], common[j[both]])]
+    return compatible
+
+
+def candidate_pairs(x, y, cell_size):
+    """
+    Yield arrays (i, j) of the positions of every pair of points that are in
+    the same or neighbouring grid cells of `cell_size`, each pair once with
+    i != j. Only these pairs can be within `cell_size` of each other.
+    """
+    if len(x) == 0:
+        return
+    ix = np.floor(x / cell_size).astype(np.int64)
+    iy = np.floor(y / cell_size).astype(np.int64)
+    # number the cells column by column, leaving a row of empty cells at either
+    # end of every column so the neighbours above and below never wrap around
+    ix -= ix.min()
+    iy -= iy.min() - 1
+    stride = int(iy.max()) + 2
+    keys = ix * stride + iy
+
+    order = np.argsort(keys, kind='stable')
+    cells, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+
+    for dx, dy in NEIGHBOURS:
+        neighbours = cells + dx * stride + dy
+        found = np.searchsorted(cells, neighbours)
+        exists = found < len(cells)
+        exists[exists] = cells[found[exists]] == neighbours[exists]
+        a = np.nonzero(exists)[0]
+        b = found[exists]
+        sizes = counts[a] * counts[b]
+
+        # build the pairs a block of cells at a time to bound memory
+        ends = np.cumsum(sizes)
+        bounds = np.searchsorted(ends, np.arange(PAIR_BLOCK_SIZE, ends[-1] if len(ends) else 0, PAIR_BLOCK_SIZE))
+        for cell_a, cell_b, size in zip(
+            np.split(a, bounds), np.split(b, bounds), np.split(sizes, bounds)
+        ):
+            pair_cell = np.repeat(np.arange(len(cell_a)), size)
+            offset = np.arange(size.sum()) - np.repeat(np.cumsum(size) - size, size)
+            width = counts[cell_b][pair_cell]
+            i = order[starts[cell_a][pair_cell] + offset // width]
+            j = order[starts[cell_b][pair_cell] + offset % width]
+            if (dx, dy) == (0, 0):
+                keep = i < j
+                i, j = i[keep], j[keep]
+            yield i, j
+
+
+def one_to_one(pairs, sources, rank):
+    """
+    Reduce candidate `pairs` (a dataframe of positions "i" and "j" and their
+    "distance") so each tree is in at most one pair with the trees of each
+    other source, by repeatedly taking the pairs whose trees are each
+    other's nearest remaining candidate from that source.
+    """
+    pairs = pairs.reset_index(drop=True)
+    accepted = []
+    remaining = np.arange(len(pairs))
+    used = np.zeros(0, dtype=np.int64)
+    sources_count = int(sources.max()) + 1 if len(sources) else 1
+
+    i, j = pairs['i'].to_numpy(), pairs['j'].to_numpy()
+    distance = pairs['distance'].to_numpy()
+    # a tree and another source, as one integer
+    slot_i = i * sources_count + sources[j]
+    slot_j = j * sources_count + sources[i]
+    while len(remaining):
+        # every tree's nearest candidate from each other source, ties going
+        # to the higher ranked candidate
+        ends = pd.DataFrame({
+            'pair': np.concatenate([remaining, remaining]),
+            'slot': np.concatenate([slot_i[remaining], slot_j[remaining]]),
+            'distance': np.concatenate([distance[remaining], distance[remaining]]),
+            'other_rank': np.concatenate([rank[j[remaining]], rank[i[remaining]]]),
+        }).sort_values(['distance', 'other_rank', 'pair'], kind='stable')
+        nearest = ends.drop_duplicates('slot')['pair'].to_numpy()
+        pair_ids, counts = np.unique(nearest, return_counts=True)
+        mutual = pair_ids[counts == 2]
+        accepted.append(mutual)
+
+        used = np.concatenate([used, slot_i[mutual], slot_j[mutual]])
+        remaining = remaining[~(np.isin(slot_i[remaining], used) | np.isin(slot_j[remaining], used))]
+
+    accepted = np.sort(np.concatenate(accepted)) if accepted else np.zeros(0, dtype=np.int64)
+    return pairs.iloc[accepted]
+
+
+def find_duplicates(trees, max_distance=DEFAULT_MAX_DISTANCE, priority=(), source_column='city', species=None):
+    """
+    Find the trees that duplicate a tree from a higher priority source.
+
+    Sources are ranked in the order of `priority`, followed by any others
+    in alphabetical order; within a source, earlier rows rank higher. Two
+    trees from different sources are candidates if they are within
+    `max_distance` feet and their species are compatible (see
+    `compatible_species`; `species` is the species_index.SpeciesIndex
+    their names are looked up in). Candidates are paired one to one per
+    pair of sources (see `one_to_one`), the lower ranked tree of each pair
+    is a duplicate, and each duplicate points at the highest ranked tree it
+    duplicates. Trees without coordinates are never duplicates.
+
+    :return: dataframe indexed by the position of each duplicate, with the
+        position of the tree it duplicates in "duplicate_of" and the distance
+        between them in feet
+    """
+    x, y = project(trees['latitude'], trees['longitude'])
+    sources = trees[source_column].astype(str).to_numpy()
+    order = list(priority) + sorted(set(sources) - set(priority))
+    source_rank = pd.Series(range(len(order)), index=order).loc[sources].to_numpy()
+    rank = np.lexsort((np.arange(len(trees)), source_rank)).argsort()
+
+    keys = species_keys(trees, species)
+    located = np.nonzero(np.isfinite(x) & np.isfinite(y))[0]
+
+    candidates = []
+    for i, j in candidate_pairs(x[located], y[located], max_distance):
+        i, j = located[i], located[j]
+        distance = np.hypot(x[i] - x[j], y[i] - y[j])
+        match = (distance <= max_distance) & (source_rank[i] != source_rank[j])
+        i, j, distance = i[match], j[match], distance[match]
+        match = compatible_species(keys, i, j)
+        candidates.append(pd.DataFrame({'i': i[match], 'j': j[match], 'distance': distance[match]}))
+
+    empty = pd.DataFrame({'i': np.zeros(0, dtype=np.int64), 'j': np.zeros(0, dtype=np.int64), 'distance': 0.0})
+    matched = one_to_one(pd.concat(candidates or [empty], ignore_index=True), source_rank, rank)
+    i, j = matched['i'].to_numpy(), matched['j'].to_numpy()
+    swap = rank[j] < rank[i]
+    pairs = pd.DataFrame({
+        'duplicate': np.where(swap, i, j),
+        'duplicate_of': np.where(swap, j, i),
+        'distance_ft': matched['distance'].to_numpy(),
+    })
+    pairs['rank'] = rank[pairs['duplicate_of']]
+    return pairs.sort_values(['duplicate', 'rank']).drop_duplicates('duplicate').set_index('duplicate')[
+        ['duplicate_of', 'distance_ft']
+    ].sort_index()
+
+
+def dedupe_report(trees, duplicates, source_column='city'):
+    """
+    One row per removed tree: its id and source, and the id and source of
+    the tree that was kept in its place.
+    """
+    id_column = 'tree_id' if 'tree_id' in trees.columns else None
+    ids = trees[id_column].to_numpy() if id_column else np.arange(len(trees))
+    sources = trees[source_column].to_numpy()
+    return pd.DataFrame({
+        'tree_id': ids[duplicates.index],
+        'source': sources[duplicates.index],
+        'duplicate_of': ids[duplicates['duplicate_of']],
+        'duplicate_of_source': sources[duplicates['duplicate_of']],
+        'distance_ft': duplicates['distance_ft'].round(2).to_numpy(),
+    })
+
+
+def dedupe_trees(trees, max_distance=DEFAULT_MAX_DISTANCE, priority=(), source_column='city', species=None):
+    """
+    Remove the duplicates find_duplicates finds. Returns the remaining
+    trees, in their original order, and the dedupe report.
+    """
+    trees = trees.reset_index(drop=True)
+    duplicates = find_duplicates(trees, max_distance, priority, source_column, species)
+    report = dedupe_report(trees, duplicates, source_column)
+    keep = np.ones(len(trees), dtype=bool)
+    keep[duplicates.index] = False
+    return trees[keep].reset_index(drop=True), report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Removes trees that appear in more than one inventory.')
+    parser.add_argument('infile', help='combined trees file (json, ndjson, parquet or arrow)')
+    parser.add_argument('outfile', help='where to write the deduplicated trees')
+    parser.add_argument('-d', '--max-distance', type=float, default=DEFAULT_MAX_DISTANCE,
+        help=f'trees from different sources closer than this many feet can be duplicates. '
+             f'defaults to {DEFAULT_MAX_DISTANCE}')
+    parser.add_argument('-p', '--priority', nargs='+', default=[],
+        help='sources in the order their trees are preferred. unlisted sources come after, alphabetically')
+    parser.add_argument('-s', '--source-column', default='city',
+        help='the column that says which inventory a tree came from. defaults to city')
+    parser.add_argument('-r', '--report',
+        help='where to write the dedupe report csv. defaults to the outfile with a .dedupe.csv extension')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    trees = tree_io.read_trees(args.infile)
+    deduped, report = dedupe_trees(trees, args.max_distance, args.priority, args.source_column)
+    tree_io.write_trees(deduped, args.outfile)
+
+    report_path = args.report or Path(args.outfile).with_suffix('.dedupe.csv')
+    report.to_csv(report_path, index=False)
+
+    summary = report.groupby(['source', 'duplicate_of_source']).size()
+    util.log(f'== Dedupe: removed {len(report)} of {len(trees)} trees')
+    for (source, kept_source), count in summary.items():
+        print(f'{source}: {count} trees duplicated {kept_source}', file=sys.stderr)
@@ -0,0 +1,307 @@
+"""
+Vectorized geohash encoding and decoding.
+
+These work on whole arrays of coordinates at once instead of calling
+python-geohash once per point, and give the same hashes as
+`geohash.encode`. Coordinates are quantized into integers, their bits
+are interleaved (longitude first), and the result is read off five bits
+at a time as base32 characters.
+"""
+
+import numpy as np
+
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+MAX_PRECISION = 12
+
+_BASE32_CODES = np.frombuffer(BASE32.encode('ascii'), dtype=np.uint8)
+_BASE32_LOOKUP = np.full(256, 255, dtype=np.uint8)
+_BASE32_LOOKUP[_BASE32_CODES] = np.arange(32, dtype=np.uint8)
+_BASE32_LOOKUP[np.frombuffer(BASE32.upper().encode('ascii'), dtype=np.uint8)] = np.arange(32, dtype=np.uint8)
+# numpy stores unicode strings as UCS4, so building the characters as
+# uint32 lets us view the result as strings without another conversion
+_BASE32_UCS4 = _BASE32_CODES.astype(np.uint32)
+_SPREAD_STEPS = [
+    (np.uint64(16), np.uint64(0x0000FFFF0000FFFF)),
+    (np.uint64(8), np.uint64(0x00FF00FF00FF00FF)),
+    (np.uint64(4), np.uint64(0x0F0F0F0F0F0F0F0F)),
+    (np.uint64(2), np.uint64(0x3333333333333333)),
+    (np.uint64(1), np.uint64(0x5555555555555555)),
+]
+_SQUASH_STEPS = [
+    (np.uint64(1), np.uint64(0x3333333333333333)),
+    (np.uint64(2), np.uint64(0x0F0F0F0F0F0F0F0F)),
+    (np.uint64(4), np.uint64(0x00FF00FF00FF00FF)),
+    (np.uint64(8), np.uint64(0x0000FFFF0000FFFF)),
+    (np.uint64(16), np.uint64(0x00000000FFFFFFFF)),
+]
+# points are encoded and decoded this many at a time, so the intermediate
+# arrays stay in cache
+BLOCK_SIZE = 1 << 14
+
+
+def _bit_lengths(precision):
+    if not 1 <= precision <= MAX_PRECISION:
+        raise ValueError(f'precision must be between 1 and {MAX_PRECISION}, got {precision}')
+    bits = 5 * precision
+    # longitude takes the first bit, so it gets the extra one when odd
+    return bits, bits // 2, (bits + 1) // 2
+
+
+def _spread_bits(x):
+    """
+    Insert a zero bit between each of the low 32 bits of `x`, in place.
+    """
+    shifted = np.empty_like(x)
+    x &= np.uint64(0x00000000FFFFFFFF)
+    for shift, mask in _SPREAD_STEPS:
+        np.left_shift(x, shift, out=shifted)
+        x |= shifted
+        x &= mask
+    return x
+
+
+def _squash_bits(x):
+    """
+    Inverse of `_spread_bits`: keep every other bit of `x`, starting at bit 0.
+    """
+    x = x & np.uint64(0x5555555555555555)
+    shifted = np.empty_like(x)
+    for shift, mask in _SQUASH_STEPS:
+        np.right_shift(x, shift, out=shifted)
+        x |= shifted
+        x &= mask
+    return x
+
+
+def _quantize(values, half_range, bits, dtype=np.uint64):
+    # values / (2 * half_range) rounds the same way python-geohash's
+    # values / half_range does, and scaling by a power of two is exact,
+    # so flooring here picks exactly the same cell. Values are never
+    # below -half_range, so only the top needs clipping.
+    cells = values / (2 * half_range)
+    cells *= float(1 << bits)
+    np.floor(cells, out=cells)
+    cells += 1 << (bits - 1)
+    np.minimum(cells, (1 << bits) - 1, out=cells)
+    return cells.astype(dtype)
+
+
+def _coordinates(latitudes, longitudes):
+    lats = np.asarray(latitudes, dtype=np.float64).ravel()
+    lons = np.asarray(longitudes, dtype=np.float64).ravel()
+    if lats.shape != lons.shape:
+        raise ValueError('latitudes and longitudes must have the same length')
+    return lats, lons
+
+
+def _check_latitudes(lats):
+    if np.any((lats < -90.0) | (lats > 90.0)):
+        raise ValueError('invalid latitude.')
+
+
+def _wrap_longitudes(lons):
+    lons = lons + 180.0
+    # the modulo only changes longitudes outside [-180, 180)
+    if len(lons) and (lons.min() < 0.0 or lons.max() >= 360.0):
+        np.mod(lons, 360.0, out=lons)
+    lons -= 180.0
+    return lons
+
+
+def _codes(lats, lons, precision):
+    # encode_codes without the checks
+    bits, lat_bits, lon_bits = _bit_lengths(precision)
+    lat_cells = _spread_bits(_quantize(lats, 90.0, lat_bits))
+    lon_cells = _spread_bits(_quantize(_wrap_longitudes(lons), 180.0, lon_bits))
+    if bits % 2:
+        lat_cells <<= np.uint64(1)
+    else:
+        lon_cells <<= np.uint64(1)
+    lon_cells |= lat_cells
+    return lon_cells
+
+
+def _interleaved(lon_bits, lat_bits):
+    # the base32 character(s) spelled by every `lon_bits` bits of a
+    # longitude cell interleaved with `lat_bits` bits of a latitude cell,
+    # longitude first, indexed by (lon << lat_bits) | lat
+    index = np.arange(1 << (lon_bits + lat_bits), dtype=np.uint64)
+    lon = _spread_bits(index >> np.uint64(lat_bits))
+    lat = _spread_bits(index & np.uint64((1 << lat_bits) - 1))
+    code = (lon << np.uint64(1)) | lat if lon_bits == lat_bits else lon | (lat << np.uint64(1))
+    chars = [
+        _BASE32_UCS4[((code >> np.uint64(shift)) & np.uint64(31)).astype(np.intp)]
+        for shift in range(lon_bits + lat_bits - 5, -1, -5)
+    ]
+    # as they are laid out in memory, so a pair can be written as one uint64
+    return np.stack(chars, axis=1).view(np.uint64 if len(chars) == 2 else np.uint32).ravel()
+
+
+_CELL_PAIRS = _interleaved(5, 5)
+_CELL_LAST = _interleaved(3, 2)
+
+
+def encode(latitudes, longitudes, precision=12):
+    """
+    Encode arrays of latitudes and longitudes into a numpy array of
+    geohash strings with `precision` characters. Points with a missing
+    (NaN) latitude or longitude get an empty string.
+    """
+    bits, lat_bits, lon_bits = _bit_lengths(precision)
+    lats, lons = _coordinates(latitudes, longitudes)
+    missing = ~(np.isfinite(lats) & np.isfinite(lons))
+    if missing.any():
+        lats, lons = np.where(missing, 0.0, lats), np.where(missing, 0.0, lons)
+    _check_latitudes(lats)
+
+    chars = np.empty((len(lats), precision), dtype=np.uint32)
+    # the same memory, as 8 byte pairs of characters (unaligned when
+    # precision is odd, which numpy handles)
+    pairs = np.ndarray(
+        buffer=chars, dtype=np.uint64, shape=(len(lats), precision // 2), strides=(4 * precision, 8)
+    )
+    # every pair of characters is 5 bits of each cell, so the characters
+    # are looked up straight from the cells, without interleaving them
+    pair_shifts = [
+        (np.uint32(lon_bits - 5 * (i + 1)), np.uint32(lat_bits - 5 * (i + 1))) for i in range(precision // 2)
+    ]
+    for start in range(0, len(lats), BLOCK_SIZE):
+        stop = start + BLOCK_SIZE
+        lat_cells = _quantize(lats[start:stop], 90.0, lat_bits, np.uint32)
+        lon_cells = _quantize(_wrap_longitudes(lons[start:stop]), 180.0, lon_bits, np.uint32)
+        block = pairs[start:stop]
+        for i, (lon_shift, lat_shift) in enumerate(pair_shifts):
+            index = (lon_cells >> lon_shift) & np.uint32(31)
+            index <<= np.uint32(5)
+            index |= (lat_cells >> lat_shift) & np.uint32(31)
+            block[:, i] = _CELL_PAIRS[index.astype(np.intp)]
+        if precision % 2:
+            # the odd character out is the last 3 bits of the longitude
+            # and 2 of the latitude
+            index = (lon_cells & np.uint32(7)) << np.uint32(2)
+            index |= lat_cells & np.uint32(3)
+            chars[start:stop, -1] = _CELL_LAST[index.astype(np.intp)]
+    # numpy strings end at the first null character
+    chars[missing] = 0
+    return chars.view(f'U{precision}').ravel()
+
+
+def encode_codes(latitudes, longitudes, precision=12):
+    """
+    Like `encode`, but return each geohash as the integer its base32
+    characters spell. Dropping the last character of a geohash is a
+    shift right by five bits of its code. Missing coordinates have no
+    code, so they are an error here.
+    """
+    _bit_lengths(precision)
+    lats, lons = _coordinates(latitudes, longitudes)
+    if not np.all(np.isfinite(lats) & np.isfinite(lons)):
+        raise ValueError('missing latitude or longitude.')
+    _check_latitudes(lats)
+    return _codes(lats, lons, precision)
+
+
+def _characters(hashes):
+    """
+    The characters of an array of strings as a 2d array of their code
+    points (or bytes), one row per string padded with zeros.
+    """
+    hashes = np.asarray(hashes)
+    if hashes.dtype.kind not in 'US':
+        hashes = hashes.astype(str)
+    hashes = np.ascontiguousarray(hashes.ravel())
+    if hashes.dtype.kind == 'U':
+        return hashes.view(np.uint32).reshape(len(hashes), -1)
+    return hashes.view(np.uint8).reshape(len(hashes), -1)
+
+
+def to_codes(hashes):
+    """
+    The integer codes (see `encode_codes`) of an array of geohashes, which
+    must all have the same precision. Returns the codes and the precision.
+    """
+    # read the characters straight out of the array's buffer: numpy pads
+    # shorter strings with zeros, so the precision is where they start
+    chars = _characters(hashes)
+    if len(chars) == 0:
+        return np.zeros(0, dtype=np.uint64), 1
+    precision = int(np.count_nonzero(chars[0]))
+    _bit_lengths(precision)
+    places = np.uint64(1) << np.arange(5 * (precision - 1), -1, -5, dtype=np.uint64)
+
+    codes = np.empty(len(chars), dtype=np.uint64)
+    for start in range(0, len(chars), BLOCK_SIZE):
+        block = chars[start:start + BLOCK_SIZE]
+        if block[:, precision:].any():
+            raise ValueError('all geohashes must have the same precision')
+        # upper and lower case look up the same digit; anything else
+        # (including the padding of shorter strings, and code points past
+        # the table) is 255
+        digits = np.take(_BASE32_LOOKUP, block[:, :precision], mode='clip')
+        if np.any(digits == 255):
+            if not block[:, :precision].all():
+                raise ValueError('all geohashes must have the same precision')
+            raise ValueError('invalid geohash character')
+        # each digit times its place value, summed
+        codes[start:start + BLOCK_SIZE] = digits.astype(np.uint64) @ places
+    return codes, precision
+
+
+def _decode_cells(hashes):
+    codes, precision = to_codes(hashes)
+    if len(codes) == 0:
+        empty = np.zeros(0, dtype=np.uint64)
+        return empty, empty, 5, 2, 3
+    bits, lat_bits, lon_bits = _bit_lengths(precision)
+
+    lat_cells, lon_cells = np.empty_like(codes), np.empty_like(codes)
+    for start in range(0, len(codes), BLOCK_SIZE):
+        block = codes[start:start + BLOCK_SIZE]
+        if bits % 2:
+            lon, lat = _squash_bits(block), _squash_bits(block >> np.uint64(1))
+        else:
+            lon, lat = _squash_bits(block >> np.uint64(1)), _squash_bits(block)
+        lat_cells[start:start + BLOCK_SIZE], lon_cells[start:start + BLOCK_SIZE] = lat, lon
+    return lat_cells, lon_cells, bits, lat_bits, lon_bits
+
+
+def decode(hashes, delta=False):
+    """
+    Decode an array of geohashes into arrays of the latitudes and
+    longitudes at the center of each cell, like `geohash.decode`.
+
+    With `delta=True` the half-height and half-width of the cells are
+    returned as well.
+    """
+    lat_cells, lon_cells, _, lat_bits, lon_bits = _decode_cells(hashes)
+    lat_delta = 90.0 / (1 << lat_bits)
+    lon_delta = 180.0 / (1 << lon_bits)
+    # in place, keeping the order of the operations so the results are unchanged
+    lats = lat_cells.astype(np.float64)
+    lats *= 2 * lat_delta
+    lats -= 90.0
+    lats += lat_delta
+    lons = lon_cells.astype(np.float64)
+    lons *= 2 * lon_delta
+    lons -= 180.0
+    lons += lon_delta
+    if delta:
+        return lats, lons, lat_delta, lon_delta
+    return lats, lons
+
+
+def bbox(hashes):
+    """
+    Return arrays of the south, west, north and east edges of each
+    geohash cell.
+    """
+    lats, lons, lat_delta, lon_delta = decode(hashes, delta=True)
+    return lats - lat_delta, lons - lon_delta, lats + lat_delta, lons + lon_delta
+
+
+def truncate(hashes, digits):
+    """
+    Cut every geohash in an array down to its first `digits` characters.
+    """
+    return np.asarray(hashes, dtype=str).astype(f'U{digits}')
@@ -0,0 +1,141 @@
+"""
+Downloads that are only repeated when the source has changed.
+
+Each url is stored in a local cache directory next to the ETag and
+Last-Modified headers it was served with. The next fetch sends those back
+as a conditional request, so an unchanged dataset costs one 304 response
+instead of a full download, and if the source can't be reached at all the
+cached copy is used instead.
+
+Bodies are streamed to disk (and un-gzipped if the server compressed them
+in transit), so large inventories never have to fit in memory. Local
+paths are passed through untouched, which lets callers treat every
+source the same way.
+
+```
+python fetch.py 'https://data.smgov.net/resource/w8ue-6cnd.csv?$limit=50000' > trees.csv
+```
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import zlib
+from pathlib import Path
+
+import util
+
+
+CACHE_DIR = os.environ.get('FETCH_CACHE_DIR', 'tmp/fetch_cache')
+TIMEOUT = 60
+BLOCK_SIZE = 1 << 20
+
+
+def is_url(source):
+    return urllib.parse.urlparse(str(source)).scheme in ('http', 'https')
+
+
+def cache_paths(url, cache_dir=None):
+    """
+    The files the body and the headers of `url` are cached in. The body
+    keeps the url's extensions (e.g. ".csv.gz"), so readers can still tell
+    what kind of file it is.
+    """
+    name = hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]
+    suffixes = ''.join(Path(urllib.parse.urlparse(url).path).suffixes[-2:])
+    cache_dir = Path(cache_dir or CACHE_DIR)
+    return cache_dir / f'{name}{suffixes}', cache_dir / f'{name}.json'
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _stream_body(response, body_path):
+    # servers may gzip the body in transit even though we want the file itself
+    decompressor = None
+    if response.headers.get('Content-Encoding', '').lower() == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    with util.atomic_write(body_path) as tmp, open(tmp, 'wb') as f:
+        for block in iter(lambda: response.read(BLOCK_SIZE), b''):
+            f.write(decompressor.decompress(block) if decompressor else block)
+        if decompressor:
+            f.write(decompressor.flush())
+
+
+def fetch(source, cache_dir=None, timeout=TIMEOUT):
+    """
+    Return the path of a local file with the contents of `source`.
+
+    Urls are downloaded into the cache unless the cached copy is still
+    current; if the server can't be reached or answers with an error, the
+    cached copy is returned as long as there is one. Anything that isn't an
+    http(s) url is returned as a path unchanged.
+    """
+    if not is_url(source):
+        return Path(source)
+
+    body_path, meta_path = cache_paths(source, cache_dir)
+    meta = _read_meta(meta_path) if body_path.exists() else {}
+
+    request = urllib.request.Request(source, headers={'Accept-Encoding': 'gzip'})
+    if meta.get('etag'):
+        request.add_header('If-None-Match', meta['etag'])
+    if meta.get('last_modified'):
+        request.add_header('If-Modified-Since', meta['last_modified'])
+
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body_path.parent.mkdir(parents=True, exist_ok=True)
+            _stream_body(response, body_path)
+            meta = {
+                'url': source,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'fetched': time.time(),
+            }
+            with util.atomic_write(meta_path) as tmp, open(tmp, 'w') as f:
+                json.dump(meta, f)
+            util.log(f'== Fetched {source}')
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            util.log(f'== Not modified, using cached {source}')
+        elif meta:
+            util.log(f'== Fetching {source} failed with {e.code}, using the cached copy')
+        else:
+            raise
+    except (urllib.error.URLError, OSError) as e:
+        if not meta:
+            raise
+        util.log(f'== Could not reach {source} ({e}), using the cached copy')
+    return body_path
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Download a url through the local cache and write it to stdout.')
+    parser.add_argument('url', help='url (or local file) to fetch')
+    parser.add_argument('-c', '--cache-dir', default=CACHE_DIR,
+        help=f'cache directory. defaults to {CACHE_DIR}')
+    parser.add_argument('-t', '--timeout', type=float, default=TIMEOUT,
+        help=f'seconds to wait for the server before using the cached copy. defaults to {TIMEOUT}')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    path = fetch(args.url, cache_dir=args.cache_dir, timeout=args.timeout)
+    with open(path, 'rb') as f:
+        shutil.copyfileobj(f, sys.stdout.buffer, BLOCK_SIZE)
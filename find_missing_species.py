@@ -1,24 +1,41 @@
 import argparse
+import sys
 
 import pandas as pd
 
+import fetch
+import util
+
 
 species_id_col_name = 'Species ID'
+default_trees_inventory_url = 'https://data.smgov.net/resource/w8ue-6cnd.csv?$limit=50000'
+default_chunk_size = 10000
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Finds rows in trees inventory with species id missing from species_attributes.csv.')
-    parser.add_argument('-u', '--trees-inventory-url',
-        default='https://data.smgov.net/resource/w8ue-6cnd.csv?$limit=50000',
-        help='trees inventory url')
+    parser.add_argument('-u', '--trees-inventory-url', action='append',
+        help='trees inventory url, local file or gzipped csv. with --stream this can be given more than once. '
+             f'defaults to {default_trees_inventory_url}')
     parser.add_argument('-s', '--species-attributes-csv',
         default='data/species_attributes.csv',
         help='file path for species_attributes.csv')
     parser.add_argument('-o', '--output-file', help='output file as csv. if not specified output csv to stdout')
+    parser.add_argument('--stream', action='store_true',
+        help='read the inventories in chunks and write matching rows as they are found')
+    parser.add_argument('-c', '--chunk-size', type=int, default=default_chunk_size,
+        help=f'with --stream, the number of inventory rows read at a time. defaults to {default_chunk_size}')
+    parser.add_argument('--columns', nargs='+',
+        help='with --stream, only read and output these inventory columns')
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    args.trees_inventory_url = args.trees_inventory_url or [default_trees_inventory_url]
+    if len(args.trees_inventory_url) > 1 and not args.stream:
+        parser.error('more than one --trees-inventory-url needs --stream')
+    return args
 
 
+@util.stage
 def filter_new_species_ids(trees_inventory_df, species_df):
     """
     This finds full rows (aka all columns) from trees_inventory_df where
@@ -52,12 +69,110 @@ def filter_new_species_ids(trees_inventory_df, species_df):
         drop('_merge', 1)
 
 
+@util.stage
+def read_species_ids(species_attributes_csv):
+    """
+    Read just the species_id_col_name column of species_attributes.csv
+    and return its ids, ready for `Series.isin`.
+
+    :param species_attributes_csv: file path for species_attributes.csv
+
+    :return: index of the known species ids
+    """
+    species_df = pd.read_csv(species_attributes_csv, usecols=[species_id_col_name])
+    return pd.Index(species_df[species_id_col_name].unique())
+
+
+def iter_new_species_ids(trees_inventory_source, species_ids, chunk_size=default_chunk_size, columns=None):
+    """
+    The streaming version of filter_new_species_ids: read the tree
+    inventory in chunks of chunk_size rows and yield the rows of each chunk
+    whose species_id_col_name is not in species_ids.
+
+    Every column is read as text, so the rows are written out just as
+    they appear in the inventory, and a column doesn't change type between
+    chunks. Only the species id is parsed as a number, to compare it with
+    the ids from species_attributes.csv the way the merge does.
+
+    :param trees_inventory_source: url, file path or gzipped csv of the trees inventory. urls are
+        downloaded through the fetch cache
+    :param species_ids: the known species ids, as returned by read_species_ids
+    :param chunk_size: number of inventory rows to read at a time
+    :param columns: only read these columns, plus species_id_col_name. None reads them all
+
+    :return: iterator of dataframes with the rows of each chunk that have a new species id
+    """
+    usecols = None
+    if columns is not None:
+        usecols = list(columns) + ([species_id_col_name] if species_id_col_name not in columns else [])
+
+    chunks = pd.read_csv(
+        fetch.fetch(trees_inventory_source), usecols=usecols, dtype=str, keep_default_na=False,
+        chunksize=chunk_size, compression='infer'
+    )
+    for chunk in chunks:
+        if species_id_col_name not in chunk.columns:
+            raise ValueError(f'{trees_inventory_source} does not have column: {species_id_col_name}')
+        ids = pd.to_numeric(chunk[species_id_col_name], errors='coerce')
+        yield chunk[~ids.isin(species_ids)]
+
+
+@util.stage
+def stream_new_species_ids(trees_inventory_sources, species_ids, outfile, chunk_size=default_chunk_size,
+                           columns=None):
+    """
+    Write the rows with new species ids from every inventory source to
+    outfile as one csv, without holding more than a chunk of any inventory
+    in memory.
+
+    :param trees_inventory_sources: urls, file paths or gzipped csvs of the trees inventories
+    :param species_ids: the known species ids, as returned by read_species_ids
+    :param outfile: file object the csv is written to
+    :param chunk_size: number of inventory rows to read at a time
+    :param columns: only read and output these columns. None reads them all
+
+    :return: dict of source to (number of rows, set of new species ids) found in it
+    """
+    header = None
+    counts = {}
+    for source in trees_inventory_sources:
+        rows = 0
+        new_ids = set()
+        for new_species in iter_new_species_ids(source, species_ids, chunk_size, columns):
+            new_ids.update(new_species[species_id_col_name])
+            if columns is not None:
+                new_species = new_species[list(columns)]
+            if header is None:
+                header = list(new_species.columns)
+                outfile.write(new_species.iloc[:0].to_csv(index=False))
+            elif list(new_species.columns) != header:
+                raise ValueError(f'{source} does not have the same columns as the other inventories')
+            new_species.to_csv(outfile, index=False, header=False)
+            rows += len(new_species)
+        counts[source] = (rows, new_ids)
+    return counts
+
+
 if __name__ == '__main__':
     args = parse_args()
 
+    if args.stream:
+        outfile = open(args.output_file, 'w', newline='') if args.output_file else sys.stdout
+        species_ids = read_species_ids(args.species_attributes_csv)
+        counts = stream_new_species_ids(
+            args.trees_inventory_url, species_ids, outfile, args.chunk_size, args.columns
+        )
+        if outfile is not sys.stdout:
+            outfile.close()
+        for source, (rows, new_ids) in counts.items():
+            print(f'{source}: {rows} rows with {len(new_ids)} missing species ids', file=sys.stderr)
+        sys.exit()
+
     # read in the data
     species_df = pd.read_csv(args.species_attributes_csv)
-    trees_inventory_df = pd.read_csv(args.trees_inventory_url)
+    with util.profile('read_trees_inventory') as record:
+        trees_inventory_df = pd.read_csv(fetch.fetch(args.trees_inventory_url[0]))
+        record['rows_out'] = len(trees_inventory_df)
 
     # verify that both dataframes have the join column
     if species_id_col_name not in species_df.columns:
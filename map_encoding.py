@@ -0,0 +1,179 @@
+"""
+Compact, columnar encoding of the map summary.
+
+map.json repeats every key for every tree and is printed with indent=2.
+This stores each of the map fields as one column instead:
+
+- string fields are dictionary encoded: the distinct values once, and one
+  integer code per tree;
+- latitude and longitude are fixed point (`precision` decimal places) and
+  delta encoded, with the trees in spatial order so the deltas are small;
+  missing coordinates are flagged in a `missing` bitset (and repeat the
+  previous value, so their deltas are 0);
+- tree_id is delta encoded in the same order;
+- heritage is a bitset, base64 encoded (missing counts as false).
+
+```
+{
+  "version": 1,
+  "count": 2,
+  "columns": {
+    "latitude": {"encoding": "delta", "scale": 7, "values": [340123456, 15]},
+    "name_common": {"encoding": "dictionary", "dictionary": ["Palm"], "values": [0, 0]},
+    "heritage": {"encoding": "bitset", "values": "AQ=="},
+    ...
+  }
+}
+```
+
+`decode` is the reference decoder; it gives back the map records (in
+spatial order).
+
+```
+python map_encoding.py enriched_trees.json build/data/map.columns.json
+```
+"""
+
+import argparse
+import base64
+import json
+
+import numpy as np
+import pandas as pd
+
+import fast_geohash
+import map_tiles
+import tree_io
+
+
+VERSION = 1
+PRECISION = 7
+COORDINATES = ['latitude', 'longitude']
+
+
+def _delta(values):
+    return np.diff(values, prepend=0).tolist()
+
+
+def _undelta(values):
+    return np.cumsum(np.asarray(values, dtype=np.int64))
+
+
+def _bitset(flags):
+    bits = np.packbits(flags, bitorder='little')
+    return base64.b64encode(bits.tobytes()).decode('ascii')
+
+
+def _unbitset(values, count):
+    bits = np.frombuffer(base64.b64decode(values), dtype=np.uint8)
+    return np.unpackbits(bits, count=count, bitorder='little').astype(bool)
+
+
+def encode_column(values, name, precision=PRECISION):
+    """
+    Encode one column of the map summary.
+    """
+    if name in COORDINATES:
+        values = values.to_numpy(dtype=np.float64, na_value=np.nan)
+        missing = ~np.isfinite(values)
+        fixed = np.round(np.where(missing, 0, values) * 10 ** precision).astype(np.int64)
+        column = {'encoding': 'delta', 'scale': precision}
+        if missing.any():
+            # repeat the last value before each missing one (the first
+            # value, for those before it)
+            positions = np.maximum.accumulate(np.where(missing, -1, np.arange(len(fixed))))
+            fixed = fixed[np.where(positions < 0, np.argmax(~missing), positions)]
+            column['missing'] = _bitset(missing)
+        column['values'] = _delta(fixed)
+        return column
+    if name == 'heritage':
+        return {'encoding': 'bitset', 'values': _bitset(values.fillna(False).to_numpy(dtype=bool))}
+    if pd.api.types.is_integer_dtype(values.dtype):
+        return {'encoding': 'delta', 'values': _delta(values.to_numpy(dtype=np.int64))}
+    codes, dictionary = pd.factorize(values)
+    # to_json turns numpy scalars into plain JSON values
+    dictionary = json.loads(pd.Series(dictionary, dtype=object).to_json(orient='values'))
+    # missing values get their own entry, as null
+    if (codes < 0).any():
+        codes = np.where(codes < 0, len(dictionary), codes)
+        dictionary.append(None)
+    return {'encoding': 'dictionary', 'dictionary': dictionary, 'values': codes.tolist()}
+
+
+def decode_column(column, count):
+    """
+    Decode one column back into a list of `count` values.
+    """
+    encoding = column['encoding']
+    if encoding == 'delta':
+        values = _undelta(column['values'])
+        if 'scale' in column:
+            values = np.round(values / 10 ** column['scale'], column['scale']).tolist()
+            if 'missing' in column:
+                for i in np.flatnonzero(_unbitset(column['missing'], count)):
+                    values[i] = None
+            return values
+        return values.tolist()
+    if encoding == 'bitset':
+        return _unbitset(column['values'], count).tolist()
+    if encoding == 'dictionary':
+        dictionary = column['dictionary']
+        return [dictionary[code] for code in column['values']]
+    raise ValueError(f'unknown column encoding {encoding}')
+
+
+def spatial_order(trees):
+    """
+    The order that puts nearby trees next to each other: by geohash, with
+    the trees without coordinates first.
+    """
+    lats = trees['latitude'].to_numpy(dtype=np.float64, na_value=np.nan)
+    lons = trees['longitude'].to_numpy(dtype=np.float64, na_value=np.nan)
+    located = np.isfinite(lats) & np.isfinite(lons)
+    hashes = np.full(len(trees), '', dtype=object)
+    hashes[located] = fast_geohash.encode(lats[located], lons[located], precision=9)
+    return np.argsort(hashes, kind='stable')
+
+
+def encode(trees, precision=PRECISION):
+    """
+    Encode the map fields of the trees (see map_tiles.MAP_FIELDS).
+    """
+    trees = map_tiles.map_data(trees)
+    trees = trees.iloc[spatial_order(trees)]
+    return {
+        'version': VERSION,
+        'count': len(trees),
+        'columns': {name: encode_column(trees[name], name, precision) for name in trees.columns},
+    }
+
+
+def decode(payload):
+    """
+    Decode an encoded map summary back into a list of map records.
+    """
+    if payload.get('version') != VERSION:
+        raise ValueError(f'unsupported map encoding version {payload.get("version")}')
+    count = payload['count']
+    columns = {name: decode_column(column, count) for name, column in payload['columns'].items()}
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Writes the map summary of the trees in a compact columnar form.')
+    parser.add_argument('infile', nargs='?', default='-',
+        help='enriched trees file. if not specified read JSON from stdin')
+    parser.add_argument('outfile', help='where to write the encoded map summary')
+    parser.add_argument('-i', '--input-format', choices=tree_io.FORMATS,
+        help='format of infile. defaults to the one its extension implies, or json')
+    parser.add_argument('-p', '--precision', type=int, default=PRECISION,
+        help=f'decimal places kept of latitude and longitude. defaults to {PRECISION}')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    trees = tree_io.read_trees(args.infile, args.input_format)
+    with open(args.outfile, 'w') as f:
+        json.dump(encode(trees, args.precision), f, separators=(',', ':'))
@@ -0,0 +1,173 @@
+"""
+Writes the map summary as a pyramid of tiles instead of one map.json.
+
+The trees from `pruning_planting.py` are cut into standard web map tiles
+(`<zoom>/<x>/<y>.json`, the same numbering as the map's base layer), so
+the map only has to fetch the tiles that are in view:
+
+- at `max_zoom`, each tile lists its trees with the fields `getMapData`
+  in split-trees.js keeps, and the map reuses these tiles when zoomed in
+  further;
+- at the coarser zooms, each tile holds clusters instead: its trees are
+  grouped on a finer grid (2 ** cluster_bits cells a side) and every cell
+  becomes one point with the number of trees in it.
+
+`manifest.json` lists every tile with its bounds and tree count. Trees
+without coordinates aren't on the map, so they are left out.
+
+```
+python map_tiles.py trees.json build/data/tiles
+```
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import tree_io
+import util
+
+
+# the fields getMapData in split-trees.js copies into map.json
+MAP_FIELDS = [
+    'family_name_botanical',
+    'family_name_common',
+    'iucn_status',
+    'latitude',
+    'longitude',
+    'name_botanical',
+    'name_common',
+    'nativity',
+    'tree_id',
+    'heritage',
+]
+MIN_ZOOM = 10
+MAX_ZOOM = 16
+CLUSTER_BITS = 3
+# web mercator stops short of the poles
+MAX_LATITUDE = 85.0511287798
+
+
+def map_data(trees):
+    """
+    The map fields of every tree, like getMapData: fields a tree doesn't
+    have are left out.
+    """
+    return trees[[field for field in MAP_FIELDS if field in trees.columns]]
+
+
+def tile_xy(latitudes, longitudes, zoom):
+    """
+    The x and y of the web mercator tiles at `zoom` that contain each point.
+    """
+    n = 1 << zoom
+    lats = np.radians(np.clip(np.asarray(latitudes, dtype=np.float64), -MAX_LATITUDE, MAX_LATITUDE))
+    lons = np.asarray(longitudes, dtype=np.float64)
+    x = np.floor((lons + 180.0) / 360.0 * n)
+    y = np.floor((1.0 - np.arcsinh(np.tan(lats)) / np.pi) / 2.0 * n)
+    return np.clip(x, 0, n - 1).astype(np.int64), np.clip(y, 0, n - 1).astype(np.int64)
+
+
+def tile_bounds(zoom, x, y):
+    """
+    The [west, south, east, north] bounds of a tile, in degrees.
+    """
+    n = 1 << zoom
+
+    def latitude(row):
+        return float(np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * row / n)))))
+
+    return [x / n * 360.0 - 180.0, latitude(y + 1), (x + 1) / n * 360.0 - 180.0, latitude(y)]
+
+
+def _records(df):
+    # NaN isn't valid JSON, and the map expects null for missing values
+    return json.loads(df.to_json(orient='records'))
+
+
+def build_tiles(trees, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM, cluster_bits=CLUSTER_BITS):
+    """
+    Yield (zoom, x, y, payload, count) for every non-empty tile of the
+    pyramid, finest zoom first. Trees without coordinates are left out.
+    """
+    trees = map_data(trees)
+    located = np.isfinite(trees['latitude'].to_numpy(dtype=np.float64, na_value=np.nan))
+    located &= np.isfinite(trees['longitude'].to_numpy(dtype=np.float64, na_value=np.nan))
+    trees = trees[located].reset_index(drop=True)
+    if len(trees) == 0:
+        return
+    # every coarser tile and cluster cell is a prefix of the finest one
+    finest = max(max_zoom, max_zoom - 1 + cluster_bits)
+    x, y = tile_xy(trees['latitude'], trees['longitude'], finest)
+
+    shift = finest - max_zoom
+    for (tx, ty), tile in trees.groupby([x >> shift, y >> shift], sort=True):
+        yield max_zoom, int(tx), int(ty), {'trees': _records(tile)}, len(tile)
+
+    lats = trees['latitude'].to_numpy()
+    lons = trees['longitude'].to_numpy()
+    for zoom in range(max_zoom - 1, min_zoom - 1, -1):
+        cell_shift = finest - zoom - cluster_bits
+        clusters = pd.DataFrame({'latitude': lats, 'longitude': lons}).groupby(
+            [x >> cell_shift, y >> cell_shift]
+        ).agg(latitude=('latitude', 'mean'), longitude=('longitude', 'mean'), count=('latitude', 'size'))
+        cx = clusters.index.get_level_values(0).to_numpy()
+        cy = clusters.index.get_level_values(1).to_numpy()
+        for (tx, ty), tile in clusters.groupby([cx >> cluster_bits, cy >> cluster_bits]):
+            payload = {'clusters': _records(tile[['latitude', 'longitude', 'count']])}
+            yield zoom, int(tx), int(ty), payload, int(tile['count'].sum())
+
+
+def write_tiles(trees, directory, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM, cluster_bits=CLUSTER_BITS):
+    """
+    Write the tile pyramid and its manifest to `directory`. Returns the manifest.
+    """
+    directory = Path(directory)
+    tiles = []
+    for zoom, x, y, payload, count in build_tiles(trees, min_zoom, max_zoom, cluster_bits):
+        path = directory / str(zoom) / str(x) / f'{y}.json'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(payload, f, separators=(',', ':'))
+        tiles.append({'z': zoom, 'x': x, 'y': y, 'bounds': tile_bounds(zoom, x, y), 'count': count})
+
+    manifest = {
+        'min_zoom': min_zoom,
+        'max_zoom': max_zoom,
+        'fields': [field for field in MAP_FIELDS if field in trees.columns],
+        'tiles': tiles,
+    }
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / 'manifest.json', 'w') as f:
+        json.dump(manifest, f, separators=(',', ':'))
+    util.log(f'== Wrote {len(tiles)} map tiles for {len(trees)} trees')
+    return manifest
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Writes the map summary of the trees as a pyramid of tiles.')
+    parser.add_argument('infile', nargs='?', default='-',
+        help='enriched trees file. if not specified read JSON from stdin')
+    parser.add_argument('outdir', help='directory to write the tiles and manifest.json to')
+    parser.add_argument('-i', '--input-format', choices=tree_io.FORMATS,
+        help='format of infile. defaults to the one its extension implies, or json')
+    parser.add_argument('--min-zoom', type=int, default=MIN_ZOOM,
+        help=f'coarsest zoom to write tiles for. defaults to {MIN_ZOOM}')
+    parser.add_argument('--max-zoom', type=int, default=MAX_ZOOM,
+        help=f'zoom whose tiles list individual trees. defaults to {MAX_ZOOM}')
+    parser.add_argument('--cluster-bits', type=int, default=CLUSTER_BITS,
+        help=f'coarser tiles hold up to 2 ** (2 * this) clusters. defaults to {CLUSTER_BITS}')
+
+    args = parser.parse_args()
+    if args.min_zoom > args.max_zoom:
+        parser.error('--min-zoom can not be greater than --max-zoom')
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    trees = tree_io.read_trees(args.infile, args.input_format)
+    write_tiles(trees, args.outdir, args.min_zoom, args.max_zoom, args.cluster_bits)
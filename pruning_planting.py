@@ -2,48 +2,194 @@
 Data processing for tree data.
 """
 
-import geohash
+import argparse
+import hashlib
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import LineString, MultiLineString
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+
+import fast_geohash
+import reference_cache
+import reference_index
+import tree_io
+import util
+import zone_index
 
 
 PRECISION = 9
+# NAD83 / California zone 5 (ftUS): the CRS the reference shapefiles are
+# published in, used wherever we need distances in feet.
+PROJECTED_CRS = 'epsg:2229'
+MATCHERS = ('geohash', 'nearest')
+# geohash length of the tiles trees are partitioned into for parallel runs
+TILE_PRECISION = 5
+# the fields of a tree that enrichment reads, and the ones it adds
+HASHED_COLUMNS = ['latitude', 'longitude', 'location_description']
+ENRICHED_COLUMNS = ['pruning_zone', 'segment', 'planting_year', 'replacement_species', 'pruning_year']
+# added by `vacant_sites_for_trees`, when it is asked for
+VACANT_SITE_COLUMNS = ['vacant_site_type', 'vacant_site_latitude', 'vacant_site_longitude', 'vacant_site_distance_ft']
+
+PLANTING_STREETS = 'data/planting/TreePlanting_Streets.shp'
+PLANTING_MEDIANS = 'data/planting/TreePlanting_Medians.shp'
+PRUNING_ZONES = 'data/pruning/pruning_zones.shp'
+PRUNING_DIR = 'data/pruning'
+PRUNING_CYCLES = 'data/pruning/pruning_2019/pruning_cycles_2019.csv'
+VACANT_SITES = {
+    'street': 'data/planting/TreePlanting_VacantTreeSites_Streets.shp',
+    'median': 'data/planting/TreePlanting_VacantTreeSites_Medians.shp',
+}
 
 
-def load_dataset(name, line_to_points=False):
+@util.stage
+def load_dataset(name, line_to_points=False, densify=None, use_cache=True):
     """
     Given a file path, load the data into a geodataframe,
     reproject it into WGS84, and return the geodataframe.
+
+    With `line_to_points` this instead returns the table built by
+    `explode_lines`, with a row for every vertex of every line. `densify`
+    is passed on to it.
+
+    The processed dataset is kept in the reference cache, so it is only
+    rebuilt when the source files change (see reference_cache.py).
     """
-    # Load the street planting shape data, reprojecting into WGS84
-    gdf = gpd.read_file(name, crs='+init=epsg:2229')
-    gdf = gdf.to_crs({'init': 'epsg:4326', 'no_defs': True})
+    if not use_cache:
+        return _load_dataset(name, line_to_points, densify)
+    return reference_cache.cached(
+        name,
+        'epsg:4326',
+        lambda: _load_dataset(name, line_to_points, densify),
+        line_to_points=line_to_points,
+        densify=densify,
+        precision=PRECISION
+    )
+
+
+def _load_dataset(name, line_to_points, densify):
+    with util.profile('read_file') as record:
+        gdf = gpd.read_file(name, crs='+init=epsg:2229')
+        record['rows_out'] = len(gdf)
     if line_to_points:
-        dfs = []
-        for row in gdf.itertuples():
-            if isinstance(row.geometry, LineString):
-                points = list(row.geometry.coords)
-            elif isinstance(row.geometry, MultiLineString):
-                points = []
-                for line in row.geometry.geoms:
-                    points += list(line.coords)
-            else:
-                raise RuntimeError('Geometry is not a Line nor a MultiLine')
-            dfs.append(pd.DataFrame({'point': points}).assign(SEGMENT=row.SEGMENT))
-        exploded_df = pd.concat(dfs, sort=False)
-        return pd.merge(gdf, exploded_df, on='SEGMENT')
-    return gdf
-
-
-def geohash_series(series, precision=9):
-    hashes = []
-    for point in series:
-        hashes.append(geohash.encode(*point[::-1], precision=precision))
-    return hashes
-
-
-def planting_for_trees(trees: pd.DataFrame):
+        return explode_lines(gdf, densify=densify)
+    # Load the street planting shape data, reprojecting into WGS84
+    with util.profile('to_crs', rows_in=len(gdf)):
+        return gdf.to_crs({'init': 'epsg:4326', 'no_defs': True})
+
+
+@util.stage
+def explode_lines(gdf, densify=None):
+    """
+    Flatten the lines in a geodataframe into a table with a row for every
+    vertex, holding the SEGMENT the vertex belongs to, its WGS84
+    "longitude" and "latitude", and its "geohash".
+
+    If `densify` is given, vertices are first added along the lines so
+    that consecutive vertices are at most that far apart, in the units of
+    the geodataframe's CRS (feet for the city's shapefiles).
+
+    The coordinates of every line are pulled out in a single pass, and
+    none of the other columns are repeated per vertex.
+    """
+    if not gdf.geom_type.isin(['LineString', 'MultiLineString']).all():
+        raise RuntimeError('Geometry is not a Line nor a MultiLine')
+    geometry = gdf.geometry
+    if densify:
+        geometry = gpd.GeoSeries(shapely.segmentize(geometry.to_numpy(), densify), crs=geometry.crs)
+    with util.profile('explode_lines.to_crs', rows_in=len(geometry)):
+        geometry = geometry.to_crs({'init': 'epsg:4326', 'no_defs': True})
+
+    coords, owners = shapely.get_coordinates(geometry.to_numpy(), return_index=True)
+    return pd.DataFrame({
+        'SEGMENT': gdf['SEGMENT'].to_numpy()[owners],
+        'longitude': coords[:, 0],
+        'latitude': coords[:, 1],
+        'geohash': fast_geohash.encode(coords[:, 1], coords[:, 0], precision=PRECISION),
+    })
+
+
+def warm_cache():
+    """
+    Load every reference dataset the pipeline uses into the reference cache.
+    """
+    for name in [PLANTING_STREETS, PLANTING_MEDIANS]:
+        load_dataset(name)
+        load_dataset(name, line_to_points=True)
+    for names in pruning_files().values():
+        for name in names:
+            load_dataset(name)
+    for name in VACANT_SITES.values():
+        load_dataset(name)
+    load_zone_index(load_dataset(PRUNING_ZONES).rename(columns={'Id': 'pruning_zone'}))
+
+
+@util.stage
+def load_reference_layers(densify=None, vacant_sites=False):
+    """
+    Load every reference layer used by `planting_for_trees` and
+    `pruning_for_trees`, so they can be loaded once and shared across
+    many batches of trees.
+
+    `densify` is passed on to `explode_lines` for the planting points.
+    The planting segments are also indexed for the nearest matcher.
+    With `vacant_sites` the index of the vacant tree sites is loaded too,
+    which makes `enrich_trees` run `vacant_sites_for_trees`.
+    """
+    zones = load_dataset(PRUNING_ZONES).rename(columns={'Id': 'pruning_zone'})
+    streets = load_dataset(PLANTING_STREETS)
+    medians = load_dataset(PLANTING_MEDIANS)
+    layers = {
+        'planting_streets': streets,
+        'planting_medians': medians,
+        'planting_street_index': reference_index.ReferenceIndex(streets),
+        'planting_median_index': reference_index.ReferenceIndex(medians),
+        'planting_street_points': load_dataset(PLANTING_STREETS, True, densify=densify),
+        'planting_median_points': load_dataset(PLANTING_MEDIANS, True, densify=densify),
+        'pruning_years': pruning_year_lookup(),
+        'pruning_zones': zones,
+        'pruning_zone_index': load_zone_index(zones),
+    }
+    if vacant_sites:
+        layers['vacant_sites'] = load_vacant_sites()
+    return layers
+
+
+def load_zone_index(zones):
+    """
+    The geohash cell index of the pruning zones (see zone_index.py). The
+    cells are kept in the reference cache, next to the zones.
+    """
+    cells = reference_cache.cached(
+        PRUNING_ZONES,
+        'epsg:4326',
+        lambda: zone_index.build_cells(zones),
+        zone_cells=zone_index.MAX_PRECISION
+    )
+    return zone_index.ZoneIndex(zones, cells)
+
+
+def load_vacant_sites():
+    """
+    A `reference_index.ReferenceIndex` of the vacant street and median tree
+    sites. The street sites come without attributes, so a site is known by
+    its type and coordinates.
+    """
+    sites = pd.concat(
+        [load_dataset(name)[['geometry']].assign(vacant_site_type=kind) for kind, name in VACANT_SITES.items()],
+        ignore_index=True
+    )
+    return reference_index.ReferenceIndex(sites)
+
+
+@util.stage
+def planting_for_trees(trees: pd.DataFrame, matcher='geohash', max_distance=None, densify=None, layers=None):
     """
     Match a replacement species and planting year for
     all the trees in a dataframe.
@@ -52,30 +198,39 @@ def planting_for_trees(trees: pd.DataFrame):
     The columns of the dataframe are the same as the JSON properties
     described in the "parse-trees.js" script.
 
+    `matcher` selects how trees are assigned a street segment: 'geohash'
+    uses the geohash prefix ladder in `match_trees_off_hashes`, 'nearest'
+    uses the spatial index in `match_trees_nearest_segment`, which also
+    honours `max_distance` (in feet). With the geohash matcher, `densify`
+    adds segment vertices every that many feet before matching.
+
+    `layers` are the reference layers from `load_reference_layers`; they
+    are loaded (with `densify`) when not given.
+
     This returns a new dataframe which is the same as the old one,
     but includes columns for street segment, planting year, and
     replacement species.
     """
-    # Load the street planting shape data, reprojecting into WGS84
-    planting_street_segments = load_dataset("data/planting/TreePlanting_Streets.shp", True)
-    planting_street_segments = planting_street_segments.assign(
-        geohash=geohash_series(planting_street_segments['point'], precision=PRECISION)
-    )
-    planting_median_segments = load_dataset("data/planting/TreePlanting_Medians.shp", True)
-    planting_median_segments = planting_median_segments.assign(
-        geohash=geohash_series(planting_median_segments['point'], precision=PRECISION)
-    )
+    if matcher not in MATCHERS:
+        raise ValueError(f'Unknown matcher {matcher!r}, expected one of {MATCHERS}')
 
-    trees['POINTS'] = [(tree.longitude, tree.latitude) for tree in trees.itertuples()]
-    trees['geohash'] = geohash_series(trees['POINTS'], precision=PRECISION)
+    if layers is None:
+        layers = load_reference_layers(densify=densify)
+    planting_street_segments = layers['planting_streets']
+    planting_median_segments = layers['planting_medians']
 
     median_mask = trees['location_description'].astype(str).str.lower() == 'median'
-    median_trees = match_trees_off_hashes(
-        planting_median_segments, trees[median_mask]
-    )
-    off_median_trees = match_trees_off_hashes(
-        planting_street_segments, trees[~median_mask]
-    )
+    if matcher == 'nearest':
+        median_trees = match_trees_nearest_segment(
+            layers['planting_median_index'], trees[median_mask], max_distance=max_distance
+        )
+        off_median_trees = match_trees_nearest_segment(
+            layers['planting_street_index'], trees[~median_mask], max_distance=max_distance
+        )
+    else:
+        trees['geohash'] = fast_geohash.encode(trees['latitude'], trees['longitude'], precision=PRECISION)
+        median_trees = match_trees_off_hashes(layers['planting_median_points'], trees[median_mask])
+        off_median_trees = match_trees_off_hashes(layers['planting_street_points'], trees[~median_mask])
     trees = pd.concat([median_trees, off_median_trees], sort=False)
     planting_segments = pd.concat(
         [planting_street_segments.drop_duplicates('SEGMENT'), planting_median_segments.drop_duplicates('SEGMENT')]
@@ -89,13 +244,39 @@ def planting_for_trees(trees: pd.DataFrame):
     return trees
 
 
+@util.stage(rows_in='to_match_df')
+def match_trees_nearest_segment(segments, to_match_df, max_distance=None):
+    """
+    Assign each tree the SEGMENT of the closest line in `segments`, a
+    `reference_index.ReferenceIndex` of the segments (as
+    `load_reference_layers` builds them) or a geodataframe to index.
+
+    Distances are measured in feet, in PROJECTED_CRS, and matching n trees
+    against m segments is O(n log m). Trees that are further than
+    `max_distance` feet from every segment, or have no coordinates, get no
+    SEGMENT.
+    """
+    og_df = to_match_df.copy()
+    if len(og_df) == 0:
+        return og_df.assign(SEGMENT=pd.Series(dtype=object))
+
+    if not isinstance(segments, reference_index.ReferenceIndex):
+        segments = reference_index.ReferenceIndex(segments)
+    tree_idx, segment_idx, _ = segments.nearest(og_df['latitude'], og_df['longitude'], max_distance=max_distance)
+    matches = pd.Series(segments.layer['SEGMENT'].to_numpy()[segment_idx], index=og_df.index[tree_idx])
+    return og_df.assign(SEGMENT=matches)
+
+
+@util.stage(rows_in='to_match_df')
 def match_trees_off_hashes(candidate_matches, to_match_df):
     digits = PRECISION
     og_df = to_match_df.copy()
     mapper = {}
     while digits > 0 and len(to_match_df) > 0:
-        candidate_matches = candidate_matches.assign(geohash_digits=candidate_matches['geohash'].str[:digits])
-        to_match_df = to_match_df.assign(geohash_digits=to_match_df['geohash'].str[:digits])
+        candidate_matches = candidate_matches.assign(
+            geohash_digits=fast_geohash.truncate(candidate_matches['geohash'], digits)
+        )
+        to_match_df = to_match_df.assign(geohash_digits=fast_geohash.truncate(to_match_df['geohash'], digits))
         merged = pd.merge(candidate_matches, to_match_df, on='geohash_digits')
         if len(merged):
             mapper.update(merged.set_index('tree_id').to_dict()['SEGMENT'])
@@ -105,7 +286,70 @@ def match_trees_off_hashes(candidate_matches, to_match_df):
     return og_df.assign(SEGMENT=og_df['tree_id'].map(mapper))
 
 
-def pruning_for_trees(trees):
+def pruning_files(pruning_dir=PRUNING_DIR):
+    """
+    Find the pruning shapefiles for every fiscal year, e.g.
+    "pruning1718_streets.shp" and "pruning1718_medians.shp" for 2017-2018.
+
+    Returns a dict from fiscal year to file names, earliest year first.
+    """
+    pattern = re.compile(r'pruning(\d{2})(\d{2})_(streets|medians)\.shp$')
+    years = {}
+    for path in sorted(Path(pruning_dir).glob('pruning*.shp')):
+        match = pattern.match(path.name)
+        if match:
+            year = f'20{match.group(1)}-20{match.group(2)}'
+            years.setdefault(year, []).append(str(path))
+    return dict(sorted(years.items()))
+
+
+def cycle_years(cycles=PRUNING_CYCLES):
+    """
+    Read the pruning cycle schedule and map every cycle code ("1", "2A",
+    "3B", "5C", ...) to the earliest fiscal year it is pruned in.
+    """
+    schedule = pd.read_csv(cycles, dtype=str)
+    years = {}
+    for row in schedule.itertuples(index=False):
+        start, end = row[0].upper().replace('FY', '').split('-')
+        for code in row[1:]:
+            years.setdefault(code.strip().upper(), f'20{start}-20{end}')
+    return years
+
+
+@util.stage
+def pruning_year_lookup(pruning_dir=PRUNING_DIR, cycles=PRUNING_CYCLES):
+    """
+    Build a series mapping every SEGMENT to the fiscal year it is pruned in.
+
+    A segment found in a fiscal year's pruning shapefiles gets the earliest
+    of those years. Any other segment falls back to the cycle schedule: its
+    CYCLE_NO on the planting layers is looked up in `cycles`. Segments
+    with neither stay out of the lookup.
+
+    New fiscal years are picked up by dropping their shapefiles into
+    `pruning_dir`.
+    """
+    frames = [
+        load_dataset(name)[['SEGMENT']].assign(pruning_year=year)
+        for year, names in pruning_files(pruning_dir).items()
+        for name in names
+    ]
+
+    schedule = cycle_years(cycles)
+    for name in [PLANTING_STREETS, PLANTING_MEDIANS]:
+        segments = load_dataset(name)[['SEGMENT', 'CYCLE_NO']].dropna()
+        codes = segments['CYCLE_NO'].str.strip().str.upper()
+        # the annual cycle is "1" in the schedule but also "1A" on the layers
+        codes = codes.where(~codes.str.startswith('1'), '1')
+        frames.append(segments[['SEGMENT']].assign(pruning_year=codes.map(schedule)).dropna())
+
+    lookup = pd.concat(frames, sort=False).drop_duplicates('SEGMENT')
+    return lookup.set_index('SEGMENT')['pruning_year']
+
+
+@util.stage
+def pruning_for_trees(trees, layers=None):
     """
     Match pruning year for a trees dataframe.
 
@@ -113,57 +357,323 @@ def pruning_for_trees(trees):
     but it assumes that planting_for_trees has already been run, as it
     relies on the street segment having been identified.
 
+    `layers` are the reference layers from `load_reference_layers`, which
+    are loaded when not given.
+
     Returns a dataframe with a "pruning_year" column.
     """
-    years = {"1718": "2017-2018", "1819": "2018-2019", "1920": "2019-2020"}
-    for year in years:
-        name_streets = f"data/pruning/pruning{year}_streets.shp"
-        name_medians = f"data/pruning/pruning{year}_medians.shp"
-        pruning = pd.concat([load_dataset(name_streets), load_dataset(name_medians)])
-        pruning[year] = years[year]
+    if layers is None:
+        layers = load_reference_layers()
+    trees = trees.assign(pruning_year=trees['SEGMENT'].map(layers['pruning_years']))
+    trees = pd.DataFrame(trees).drop(columns=['geometry', 'geohash', 'POINTS'], errors='ignore')
+    zones = layers.get('pruning_zone_index') or zone_index.ZoneIndex.build(layers['pruning_zones'])
+
+    with util.profile('pruning_for_trees.zone_lookup', rows_in=len(trees)):
+        positions, tree_zones = zones.lookup(trees['latitude'], trees['longitude'])
+    # like the spatial join this replaces, a tree in no zone is kept with no
+    # zone and a tree in overlapping zones is repeated once for each
+    unmatched = np.ones(len(trees), dtype=bool)
+    unmatched[positions] = False
+    rows = np.concatenate([positions, np.nonzero(unmatched)[0]])
+    order = np.argsort(rows, kind='stable')
+    tree_zones = np.concatenate([tree_zones, np.zeros(unmatched.sum(), dtype=np.int64)])[order]
+
+    trees = trees.iloc[rows[order]]
+    if unmatched.any():
+        tree_zones = np.where(unmatched[rows[order]], np.nan, tree_zones)
+    trees.insert(0, 'pruning_zone', tree_zones)
+    return trees
+
+
+@util.stage
+def vacant_sites_for_trees(trees, sites):
+    """
+    Add the nearest vacant tree site to each tree: its type ("street" or
+    "median"), its coordinates and its distance from the tree in feet.
+    Trees without coordinates get none.
+
+    `sites` is the index from `load_vacant_sites`.
+    """
+    positions, items, distances = sites.nearest(trees['latitude'], trees['longitude'])
+    found = sites.layer.iloc[items]
+    values = {
+        'vacant_site_type': found['vacant_site_type'].to_numpy(),
+        'vacant_site_latitude': found.geometry.y.to_numpy(),
+        'vacant_site_longitude': found.geometry.x.to_numpy(),
+        'vacant_site_distance_ft': np.round(distances, 1),
+    }
+    return trees.assign(**{
+        name: pd.Series(column, index=positions).reindex(np.arange(len(trees))).to_numpy()
+        for name, column in values.items()
+    })
+
+
+@util.stage
+def enrich_trees(trees, layers, matcher='geohash', max_distance=None):
+    """
+    Run `planting_for_trees` and `pruning_for_trees` (and
+    `vacant_sites_for_trees`, when the layers have the vacant sites) over a
+    dataframe of trees and return the records as they are written out by
+    this stage.
+    """
+    trees = planting_for_trees(trees, matcher=matcher, max_distance=max_distance, layers=layers)
+    trees = pruning_for_trees(trees, layers=layers)
+    if 'vacant_sites' in layers:
+        trees = vacant_sites_for_trees(trees, layers['vacant_sites'])
+    rename_columns = {
+        "SEGMENT": "segment",
+    }
+    return pd.DataFrame(trees.rename(columns=rename_columns))
 
-        trees = trees.merge(pruning[["SEGMENT", year]], on="SEGMENT", how="left")
 
-    def collapse_years(tree):
-        for year in years:
-            if not pd.isnull(tree[year]):
-                return tree[year]
+_worker_layers = None
 
-        return tree[year]
 
-    trees = gpd.GeoDataFrame(
-        trees,
-        geometry=gpd.points_from_xy(trees['longitude'], trees['latitude']),
-        crs={'init': 'epsg:4326'}
+def _init_worker(densify, vacant_sites):
+    global _worker_layers
+    # forked workers already have the parent's layers, spawned ones read
+    # them back from the reference cache
+    if _worker_layers is None:
+        _worker_layers = load_reference_layers(densify=densify, vacant_sites=vacant_sites)
+
+
+def _enrich_partition(trees, matcher, max_distance):
+    return enrich_trees(trees, _worker_layers, matcher=matcher, max_distance=max_distance)
+
+
+def reference_pool(workers, layers=None, densify=None, vacant_sites=False):
+    """
+    Start a process pool for `enrich_trees_parallel`.
+
+    Every worker holds its own copy of the reference layers for the life
+    of the pool: where processes are forked they inherit `layers` from
+    this process, otherwise they load them from the reference cache. The
+    layers are never pickled along with the tasks.
+    """
+    global _worker_layers
+    _worker_layers = layers
+    context = None
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(densify, vacant_sites)
     )
 
-    trees["pruning_year"] = trees.apply(collapse_years, axis=1)
-    trees = trees.drop([y for y in years], axis=1)
 
-    pruning_zones = load_dataset("data/pruning/pruning_zones.shp").rename(columns={'Id': 'pruning_zone'})
-    trees = gpd.sjoin(pruning_zones, trees, how='right', op='contains').drop(
-        columns=['index_left', 'Shape_Leng', 'Shape_Area', 'geometry', 'geohash', 'POINTS']
+def partition_trees(trees, partitions, precision=TILE_PRECISION):
+    """
+    Split the trees into at most `partitions` dataframes made of whole
+    geohash tiles, balancing the number of trees in each.
+    """
+    tiles = pd.Series(fast_geohash.encode(trees['latitude'], trees['longitude'], precision=precision))
+    loads = np.zeros(partitions)
+    assignment = {}
+    for tile, count in tiles.value_counts().items():
+        assignment[tile] = loads.argmin()
+        loads[assignment[tile]] += count
+    groups = tiles.map(assignment).to_numpy()
+    return [trees[groups == i] for i in range(partitions) if (groups == i).any()]
+
+
+@util.stage
+def enrich_trees_parallel(trees, pool, partitions, matcher='geohash', max_distance=None):
+    """
+    Run `enrich_trees` over spatial partitions of the trees on a pool from
+    `reference_pool`, and return the same dataframe the serial run would.
+
+    Each worker matches its trees against the complete reference layers,
+    so trees on the edge of a tile still see every segment around them
+    and no halo of neighbouring trees is needed.
+    """
+    trees = trees.assign(_position=np.arange(len(trees)))
+    futures = [
+        pool.submit(_enrich_partition, partition, matcher, max_distance)
+        for partition in partition_trees(trees, partitions)
+    ]
+    enriched = pd.concat([future.result() for future in futures], sort=False)
+    return _restore_order(enriched)
+
+
+def _restore_order(enriched):
+    """
+    Sort trees enriched in pieces into the order `enrich_trees` would
+    have returned them in, using the "_position" they had in its input.
+    """
+    # enrich_trees puts the median trees first, each group in input order
+    median = (enriched['location_description'].astype(str).str.lower() == 'median').to_numpy()
+    order = np.lexsort((enriched['_position'].to_numpy(), ~median))
+    return enriched.iloc[order].drop(columns='_position').reset_index(drop=True)
+
+
+def reference_key(vacant_sites=False, **options):
+    """
+    Fingerprint every reference file used for enrichment along with the
+    options used to match against them.
+    """
+    names = [PLANTING_STREETS, PLANTING_MEDIANS, PRUNING_ZONES, PRUNING_CYCLES]
+    names += [name for names in pruning_files().values() for name in names]
+    if vacant_sites:
+        names += list(VACANT_SITES.values())
+    digest = hashlib.sha256()
+    for name in names:
+        digest.update(reference_cache.cache_key(name, 'epsg:4326', **options).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def record_hashes(trees):
+    """
+    Hash the fields of each tree that enrichment depends on.
+    """
+    # hashed as they read from JSON, so the hashes don't depend on the dtypes
+    return pd.util.hash_pandas_object(
+        tree_io.untyped(trees[HASHED_COLUMNS]).astype(str), index=False
+    ).to_numpy()
+
+
+def read_state(state_file, key):
+    """
+    Load the state left by the previous incremental run, or None if there
+    is none, it can't be read or it was made against other reference data.
+    """
+    if not Path(state_file).exists():
+        return None
+    try:
+        table = pq.read_table(state_file)
+    except (pa.ArrowInvalid, OSError) as e:
+        util.log(f'== Ignoring unreadable state file {state_file}: {e}')
+        return None
+    if (table.schema.metadata or {}).get(b'reference_key') != key.encode('utf-8'):
+        return None
+    return table.to_pandas()
+
+
+def write_state(state_file, trees, key, enriched_columns=ENRICHED_COLUMNS):
+    state = trees[['tree_id'] + enriched_columns].assign(record_hash=record_hashes(trees))
+    table = pa.Table.from_pandas(state, preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, b'reference_key': key.encode('utf-8')})
+    state_file = Path(state_file)
+    state_file.parent.mkdir(parents=True, exist_ok=True)
+    with util.atomic_write(state_file) as tmp:
+        pq.write_table(table, tmp)
+
+
+@util.stage
+def enrich_trees_incremental(trees, enrich, state_file, key, enriched_columns=ENRICHED_COLUMNS):
+    """
+    Enrich only the trees that are new or have changed since the last run,
+    reusing the previous results for the rest, and save the new state.
+
+    `enrich` is called with the trees that need enriching, and `key` is the
+    `reference_key` of this run; state from a run with another key is
+    thrown away. `enriched_columns` are the columns `enrich` adds, with
+    "pruning_zone" first. Trees that have gone from the input are dropped
+    from the state. Returns the same dataframe a full run of `enrich` would.
+    """
+    trees = trees.assign(_position=np.arange(len(trees)))
+    hashes = record_hashes(trees)
+    previous = read_state(state_file, key)
+
+    reuse = np.zeros(len(trees), dtype=bool)
+    removed = 0
+    if previous is not None:
+        # a tree in overlapping pruning zones has a row for each, all with its hash
+        known = previous.drop_duplicates('tree_id').set_index('tree_id')['record_hash']
+        reuse = known.astype(object).reindex(trees['tree_id']).to_numpy() == hashes
+        removed = (~known.index.isin(trees['tree_id'])).sum()
+
+    columns = ['pruning_zone'] + list(trees.columns) + enriched_columns[1:]
+    pieces = []
+    if (~reuse).any():
+        pieces.append(enrich(trees[~reuse])[columns])
+    if reuse.any():
+        # every row of each reused tree, in the order the state has them
+        reused = trees[reuse].drop(columns=enriched_columns, errors='ignore').merge(
+            previous[['tree_id'] + enriched_columns], on='tree_id', how='inner'
+        )
+        pieces.append(reused[columns])
+    enriched = _restore_order(pd.concat(pieces, sort=False)) if pieces else trees.drop(columns='_position')
+
+    # zones are integer ids, which pandas only keeps as ints when none are missing
+    if enriched['pruning_zone'].notna().all():
+        enriched['pruning_zone'] = enriched['pruning_zone'].astype('int64')
+
+    util.log(
+        f'== Incremental enrichment: {reuse.sum()} reused, {(~reuse).sum()} recomputed, {removed} removed'
     )
-    return trees
+    write_state(state_file, enriched, key, enriched_columns)
+    return enriched
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Adds planting and pruning data to the trees JSON.')
+    parser.add_argument('infile', nargs='?', default='-',
+        help='trees file. if not specified read JSON from stdin')
+    parser.add_argument('outfile', nargs='?', default='-',
+        help='output file. if not specified write JSON to stdout')
+    parser.add_argument('-i', '--input-format', choices=tree_io.FORMATS,
+        help='format of infile. defaults to the one its extension implies, or json')
+    parser.add_argument('-o', '--output-format', choices=tree_io.FORMATS,
+        help='format of outfile. defaults to the one its extension implies, or json '
+             '(ndjson with --stream)')
+    parser.add_argument('-m', '--matcher', choices=MATCHERS, default='geohash',
+        help='how trees are matched to street segments')
+    parser.add_argument('-d', '--max-distance', type=float, default=None,
+        help='with --matcher nearest, leave trees further than this many feet from any segment unmatched')
+    parser.add_argument('--densify', type=float, default=None,
+        help='with --matcher geohash, add a vertex to the segments at least every this many feet')
+    parser.add_argument('--vacant-sites', action='store_true',
+        help='also add the nearest vacant tree site to each tree, and its distance in feet')
+    parser.add_argument('-s', '--stream', action='store_true',
+        help='read the trees in chunks and write each enriched chunk as soon as it is done')
+    parser.add_argument('-c', '--chunk-size', type=int, default=tree_io.DEFAULT_CHUNK_SIZE,
+        help=f'with --stream, the number of trees per chunk. defaults to {tree_io.DEFAULT_CHUNK_SIZE}')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+        help='number of processes to enrich the trees with. defaults to 1, which runs in this process')
+    parser.add_argument('--state-file',
+        help='only enrich trees that are new or changed since the run that wrote this state file, '
+             'reusing its results for the rest')
+
+    args = parser.parse_args()
+    if args.state_file and args.stream:
+        parser.error('--state-file can not be combined with --stream')
+    return args
 
 
 if __name__ == "__main__":
-    import sys
-
-    # Load the trees dataset.
-    infile = sys.stdin
-    outfile = sys.stdout
-    if len(sys.argv) > 1:
-        infile = open(sys.argv[1], 'r')
-    if len(sys.argv) > 2:
-        outfile = open(sys.argv[2], 'w')
-
-    trees = pd.read_json(infile)
-    trees = planting_for_trees(trees)
-    trees = pruning_for_trees(trees)
-    rename_columns = {
-        "SEGMENT": "segment",
-    }
-    trees = trees.rename(columns=rename_columns)
-    tmp = pd.DataFrame(trees).to_json(orient="records", indent=2)
-    outfile.write(tmp)
+    args = parse_args()
+    layers = load_reference_layers(densify=args.densify, vacant_sites=args.vacant_sites)
+
+    if args.workers > 1:
+        pool = reference_pool(args.workers, layers=layers, densify=args.densify, vacant_sites=args.vacant_sites)
+
+        def enrich(trees):
+            return enrich_trees_parallel(
+                trees, pool, args.workers * 4, matcher=args.matcher, max_distance=args.max_distance
+            )
+    else:
+        def enrich(trees):
+            return enrich_trees(trees, layers, matcher=args.matcher, max_distance=args.max_distance)
+
+    if args.stream:
+        output_format = tree_io.format_for(args.outfile, args.output_format, default='ndjson')
+        with tree_io.TreeWriter(args.outfile, output_format) as writer:
+            for chunk in tree_io.iter_trees(args.infile, args.chunk_size, args.input_format):
+                writer.write(enrich(chunk))
+    else:
+        # Load the trees dataset.
+        with util.profile('read_trees') as record:
+            trees = tree_io.read_trees(args.infile, args.input_format)
+            record['rows_out'] = len(trees)
+        if args.state_file:
+            key = reference_key(
+                vacant_sites=args.vacant_sites,
+                matcher=args.matcher,
+                max_distance=args.max_distance,
+                densify=args.densify
+            )
+            enriched_columns = ENRICHED_COLUMNS + (VACANT_SITE_COLUMNS if args.vacant_sites else [])
+            trees = enrich_trees_incremental(trees, enrich, args.state_file, key, enriched_columns)
+        else:
+            trees = enrich(trees)
+        with util.profile('write_trees', rows_in=len(trees)):
+            tree_io.write_trees(trees, args.outfile, args.output_format)
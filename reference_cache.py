@@ -0,0 +1,155 @@
+"""
+On-disk cache for the reference layers loaded by `pruning_planting.load_dataset`.
+
+Reading the shapefiles, reprojecting them and exploding them into points
+is the slowest part of loading the reference data, but the shapefiles
+only change about once a year. This stores the processed layers as
+(Geo)Parquet, keyed on the contents of the source files, the target CRS and
+the loading options, so an unchanged layer is read straight back.
+
+Entries for a source that no longer match its key are replaced on the next
+load, and the least recently used entries are evicted once the cache grows
+past REFERENCE_CACHE_MAX_BYTES.
+
+The cache can be warmed or cleared from the command line:
+
+```
+python reference_cache.py warm
+python reference_cache.py clear
+```
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import geopandas as gpd
+import pandas as pd
+import pyarrow.parquet as pq
+
+import util
+
+
+CACHE_VERSION = 1
+CACHE_DIR = os.environ.get('REFERENCE_CACHE_DIR', 'tmp/reference_cache')
+MAX_BYTES = int(os.environ.get('REFERENCE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+
+def source_files(name):
+    """
+    All the files that make up a dataset, e.g. the .shp, .shx, .dbf and
+    .prj files of a shapefile.
+    """
+    path = Path(name)
+    return sorted(p for p in path.parent.glob(path.stem + '.*') if p.is_file())
+
+
+def _describe(name, crs, options):
+    return json.dumps(
+        {'version': CACHE_VERSION, 'name': str(Path(name)), 'crs': str(crs), 'options': options},
+        sort_keys=True, default=str
+    ).encode('utf-8')
+
+
+def cache_key(name, crs, **options):
+    """
+    Hash the contents of the dataset's files together with the CRS and
+    any options that change how the dataset is processed.
+    """
+    digest = hashlib.sha256()
+    digest.update(_describe(name, crs, options))
+    for path in source_files(name):
+        digest.update(path.name.encode('utf-8'))
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def _entry_prefix(name, crs, options):
+    # one slot per dataset and set of options; only the key within it changes
+    slot = hashlib.sha256(_describe(name, crs, options)).hexdigest()[:8]
+    return f'{Path(name).stem}-{slot}-'
+
+
+def cached(name, crs, loader, cache_dir=None, max_bytes=None, **options):
+    """
+    Return the processed dataset for `name`, calling `loader()` to build
+    it and storing the result if there is no valid cache entry.
+    """
+    cache_dir = Path(cache_dir or CACHE_DIR)
+    prefix = _entry_prefix(name, crs, options)
+    entry = cache_dir / f'{prefix}{cache_key(name, crs, **options)[:16]}.parquet'
+    try:
+        os.utime(entry)
+        if b'geo' in (pq.read_schema(entry).metadata or {}):
+            return gpd.read_parquet(entry)
+        return pd.read_parquet(entry)
+    except FileNotFoundError:
+        # not cached yet, or evicted by another process since
+        pass
+
+    frame = loader()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # anything else cached for this source was built from other contents
+    for stale in cache_dir.glob(f'{prefix}*.parquet'):
+        if stale != entry:
+            stale.unlink(missing_ok=True)
+    # other processes may be building the same entry at once
+    with util.atomic_write(entry) as tmp:
+        frame.to_parquet(tmp)
+    evict(cache_dir, MAX_BYTES if max_bytes is None else max_bytes)
+    return frame
+
+
+def evict(cache_dir=None, max_bytes=MAX_BYTES):
+    """
+    Remove the least recently used entries until the cache is no larger
+    than `max_bytes`.
+    """
+    entries = []
+    for entry in Path(cache_dir or CACHE_DIR).glob('*.parquet'):
+        try:
+            entries.append((entry.stat(), entry))
+        except FileNotFoundError:
+            # removed by another process
+            continue
+    entries.sort(key=lambda item: item[0].st_mtime)
+    total = sum(stat.st_size for stat, _ in entries)
+    for stat, entry in entries:
+        if total <= max_bytes:
+            break
+        total -= stat.st_size
+        entry.unlink(missing_ok=True)
+
+
+def clear(cache_dir=None):
+    """
+    Remove every cached layer.
+    """
+    for entry in Path(cache_dir or CACHE_DIR).glob('*.parquet'):
+        entry.unlink(missing_ok=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Warm or clear the cache of processed reference layers.')
+    parser.add_argument('action', choices=['warm', 'clear'],
+        help='warm loads every reference layer into the cache, clear empties it')
+    parser.add_argument('-c', '--cache-dir', default=CACHE_DIR,
+        help=f'cache directory. defaults to {CACHE_DIR}')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    # pruning_planting imports this module again, so pass the directory on
+    os.environ['REFERENCE_CACHE_DIR'] = args.cache_dir
+
+    if args.action == 'clear':
+        clear(args.cache_dir)
+    else:
+        import pruning_planting
+        pruning_planting.warm_cache()
@@ -0,0 +1,139 @@
+"""
+Batched spatial queries against a reference layer.
+
+A `ReferenceIndex` projects a layer (street segments, vacant tree sites,
+pruning zones...) into PROJECTED_CRS, which is in feet, and bulk-loads it
+into an STRtree once. It then answers queries for whole arrays of tree
+coordinates in one call:
+
+- `nearest`: the k nearest features of every tree, optionally only those
+  within `max_distance` feet;
+- `within`: every feature within `radius` feet of every tree.
+
+Both return matching (tree position, feature position, distance) arrays,
+ordered by tree and then by distance, so they can be joined back onto the
+trees and the layer with plain numpy indexing.
+
+```
+sites = ReferenceIndex(vacant_sites)
+trees_idx, site_idx, distances = sites.nearest(trees['latitude'], trees['longitude'], k=3)
+```
+"""
+
+import numpy as np
+import pyproj
+import shapely
+
+
+PROJECTED_CRS = 'epsg:2229'
+
+
+def _empty():
+    return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), np.zeros(0)
+
+
+def _ordered(points, items, distances):
+    order = np.lexsort((items, distances, points))
+    return points[order], items[order], distances[order]
+
+
+class ReferenceIndex(object):
+    """
+    Spatial index of one reference layer (a geodataframe in any CRS).
+    """
+
+    def __init__(self, layer):
+        self.layer = layer.reset_index(drop=True)
+        self.geometries = self.layer.to_crs(PROJECTED_CRS).geometry.to_numpy()
+        self.tree = shapely.STRtree(self.geometries)
+        self.coordinates = None
+        if len(self.geometries) and (shapely.get_type_id(self.geometries) == shapely.GeometryType.POINT).all():
+            self.coordinates = shapely.get_coordinates(self.geometries)
+        self.transformer = pyproj.Transformer.from_crs('epsg:4326', PROJECTED_CRS, always_xy=True)
+
+        # the distance between neighbouring features if they were spread
+        # evenly, which is where the k nearest search starts
+        west, south, east, north = shapely.total_bounds(self.geometries)
+        self.spacing = max(np.sqrt((east - west) * (north - south) / max(len(self.geometries), 1)), 1.0)
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def _points(self, latitudes, longitudes):
+        lats = np.asarray(latitudes, dtype=np.float64)
+        lons = np.asarray(longitudes, dtype=np.float64)
+        valid = np.nonzero(np.isfinite(lats) & np.isfinite(lons))[0]
+        x, y = self.transformer.transform(lons[valid], lats[valid])
+        return valid, shapely.points(x, y)
+
+    def _distances(self, points, items):
+        if self.coordinates is None:
+            return shapely.distance(points, self.geometries[items])
+        # a layer of points: no need to go through GEOS
+        x, y = self.coordinates[items].T
+        return np.hypot(shapely.get_x(points) - x, shapely.get_y(points) - y)
+
+    def nearest(self, latitudes, longitudes, k=1, max_distance=None):
+        """
+        The `k` nearest features of every point, closest first. Points with
+        missing coordinates get none, and with `max_distance` (in feet)
+        features further away are left out. Ties are broken by the order of
+        the layer.
+
+        :return: (point positions, feature positions, distances in feet)
+        """
+        valid, points = self._points(latitudes, longitudes)
+        if len(points) == 0 or len(self) == 0 or k < 1:
+            return _empty()
+
+        found, items = self.tree.query_nearest(points, max_distance=max_distance)
+        if len(found) == 0:
+            # every point is further than max_distance from the layer
+            return _empty()
+        distances = self._distances(points[found], items)
+        found, items, distances = _ordered(found, items, distances)
+        first = np.r_[True, found[1:] != found[:-1]]
+        if k == 1:
+            return valid[found[first]], items[first], distances[first]
+
+        # grow a search radius around each point, from its nearest feature,
+        # until it takes in k features, which are then its k nearest
+        k = min(k, len(self))
+        pending = found[first]
+        radius = distances[first] + self.spacing * np.sqrt(k)
+        results = []
+        while len(pending):
+            if max_distance is not None:
+                radius = np.minimum(radius, max_distance)
+            query_idx, candidates = self.tree.query(points[pending], predicate='dwithin', distance=radius)
+            counts = np.bincount(query_idx, minlength=len(pending))
+            done = counts >= k
+            if max_distance is not None:
+                done |= radius >= max_distance
+
+            keep = done[query_idx]
+            point_idx = pending[query_idx[keep]]
+            candidates = candidates[keep]
+            distances = self._distances(points[point_idx], candidates)
+            point_idx, candidates, distances = _ordered(point_idx, candidates, distances)
+            # the rank of each candidate among its point's candidates
+            starts = np.searchsorted(point_idx, point_idx, side='left')
+            nearest = np.arange(len(point_idx)) - starts < k
+            results.append((point_idx[nearest], candidates[nearest], distances[nearest]))
+
+            pending, radius = pending[~done], radius[~done] * 2
+
+        point_idx, candidates, distances = (np.concatenate(parts) for parts in zip(*results))
+        return _ordered(valid[point_idx], candidates, distances)
+
+    def within(self, latitudes, longitudes, radius):
+        """
+        Every feature within `radius` feet of every point, closest first.
+
+        :return: (point positions, feature positions, distances in feet)
+        """
+        valid, points = self._points(latitudes, longitudes)
+        if len(points) == 0 or len(self) == 0:
+            return _empty()
+        point_idx, items = self.tree.query(points, predicate='dwithin', distance=radius)
+        return _ordered(valid[point_idx], items, self._distances(points[point_idx], items))
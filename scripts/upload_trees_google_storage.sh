@@ -14,6 +14,20 @@ function upload_google_cloud() {
   gsutil setmeta -h "Cache-Control:public, max-age=43200" gs://public-tree-map/data/map.json
   gsutil -m setmeta -h "Cache-Control:public, max-age=43200" gs://public-tree-map/data/trees/*.json
   gsutil -m rsync -r -c build/img gs://public-tree-map/img
+  if [[ -f build/data/shards/manifest.json ]]; then
+    # shard names include a hash of their contents, so only the shards the
+    # uploaded manifest doesn't have are copied, existing objects are never
+    # overwritten and they can be cached for good
+    changed="$(python -c 'import json, sys; print("\n".join(json.load(sys.stdin)["changed"]))' \
+      < build/data/shards/manifest.json)"
+    if [[ -n "${changed}" ]]; then
+      echo "${changed}" \
+        | sed 's|^|build/data/shards/|' \
+        | gsutil -m -h "Cache-Control:public, max-age=31536000, immutable" cp -n -I gs://public-tree-map/data/shards/
+    fi
+    gsutil -h "Cache-Control:public, max-age=43200" cp build/data/shards/index.json build/data/shards/manifest.json \
+      gs://public-tree-map/data/shards/
+  fi
 }
 
 GCLOUD_SERVICE_KEY="${1:-}"
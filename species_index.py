@@ -0,0 +1,256 @@
+"""
+Species attributes for trees from any inventory, matched on normalized names.
+
+parse-trees.js joins data/species_attributes.csv onto the Santa Monica
+trees on the exact botanical name. The Stiles inventories spell names in
+their own ways ("Platanus X Hispanica 'Bloodgood'", "Ficus Spp",
+"JACARANDA"), so here both sides are normalized first:
+
+- lower case, with runs of whitespace collapsed;
+- cultivar quotes (' " ‘ ’ “ ”) all become a single quote;
+- the hybrid marker ("×", "x" or "X" between words) becomes "x";
+- "sp", "sp.", "spp", "spp." and "species" become "spp".
+
+The index maps every normalized botanical name, Santa Monica name and
+synonym of a species (and, separately, its common name) to its attributes.
+It is built once and kept in the reference cache next to other reference
+data. A dataframe of trees is then enriched with one hash join over its
+distinct names: on the botanical name, then on the botanical name without
+its cultivar, then on the common name.
+
+Trees that match nothing can be listed like find_missing_species.py lists
+rows with unknown species ids:
+
+```
+python species_index.py data/stiles_data/all/trees.parquet -o missing_species.csv
+```
+"""
+
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+import reference_cache
+import tree_io
+import util
+
+
+SPECIES_ATTRIBUTES = 'data/species_attributes.csv'
+VERSION = 1
+# species_attributes.csv column -> tree field, as parse-trees.js names them,
+# and the value parse-trees.js gives trees of unknown species
+ATTRIBUTES = {
+    'Species ID': 'species_id',
+    'family_botanical_name': 'family_name_botanical',
+    'family_common_name': 'family_name_common',
+    'shade_production': 'shade_production',
+    'Irrigation_Requirements': 'irrigation_requirements',
+    'form': 'form',
+    'type': 'type',
+    'native': 'nativity',
+    'simplified_IUCN_status': 'iucn_status',
+    'Cal_IPC_rating': 'ipc_rating',
+    'CAL_IPC_url': 'ipc_url',
+    'EOL_ID': 'eol_id',
+    'EOL_overview_URL': 'eol_url',
+}
+DEFAULTS = {
+    'species_id': pd.NA,
+    'family_name_botanical': 'Unknown',
+    'family_name_common': 'Unknown',
+    'shade_production': 'Unknown',
+    'irrigation_requirements': 'Unknown',
+    'form': 'Unknown',
+    'type': 'Unknown',
+    'nativity': 'Unknown',
+    'iucn_status': 'Unknown',
+    'ipc_rating': 'Unknown',
+    'ipc_url': '',
+    'eol_id': -1,
+    'eol_url': '',
+}
+SPECIES_COLUMNS = list(ATTRIBUTES.values())
+
+
+def normalize_names(names):
+    """
+    Normalize a series of botanical or common names for matching.
+    Missing names stay missing.
+    """
+    return (
+        names.astype('string')
+        .str.lower()
+        .str.replace(r'[‘’“”"`]', "'", regex=True)
+        .str.replace('×', ' x ', regex=False)
+        .str.replace(r'(^|\s)(?:spp?\.?|species)(?=\s|$)', r'\1spp', regex=True)
+        .str.replace(r'\s+', ' ', regex=True)
+        .str.strip()
+    )
+
+
+def without_cultivar(names):
+    """
+    Drop the quoted cultivar from normalized names: "ulmus parvifolia
+    'drake'" is "ulmus parvifolia".
+    """
+    return names.str.replace(r"\s*'[^']*'?", '', regex=True).str.strip()
+
+
+def build_index(species_attributes_csv=SPECIES_ATTRIBUTES):
+    """
+    A dataframe with one row for every normalized name of every species in
+    species_attributes.csv: its `key`, its `kind` ("botanical" or
+    "common") and the species' attributes, named as the tree fields are.
+    Where two species share a name, the first one in the file keeps it.
+    """
+    species = pd.read_csv(species_attributes_csv, dtype=str, keep_default_na=False)
+    attributes = species[list(ATTRIBUTES)].rename(columns=ATTRIBUTES)
+
+    # the botanical names come first, so they win over synonyms
+    names = [species['botanical_name'], species['sm_botanical_name']]
+    synonyms = species['botanical_synonyms'].str.split(';').explode()
+    names.append(synonyms[synonyms.str.strip() != ''])
+    botanical = pd.concat(names)
+    common = species['common_name']
+
+    keys = pd.concat([
+        pd.DataFrame({'key': normalize_names(botanical), 'kind': 'botanical', 'row': botanical.index}),
+        pd.DataFrame({'key': normalize_names(common), 'kind': 'common', 'row': common.index}),
+    ], ignore_index=True)
+    keys = keys[keys['key'].fillna('') != ''].drop_duplicates(['kind', 'key'])
+    index = pd.concat(
+        [keys[['key', 'kind']].reset_index(drop=True), attributes.iloc[keys['row']].reset_index(drop=True)], axis=1
+    )
+    return index.astype({'key': str})
+
+
+class SpeciesIndex(object):
+    """
+    Looks up the species attributes of trees by their normalized names.
+    """
+
+    def __init__(self, index):
+        attributes = index[SPECIES_COLUMNS].replace('', np.nan)
+        for name in ['species_id', 'eol_id']:
+            attributes[name] = pd.to_numeric(attributes[name], errors='coerce').astype('Int64')
+        # the last row is what trees of unknown species get
+        self.attributes = pd.concat([attributes, pd.DataFrame([{}])], ignore_index=True)
+        self.attributes = self.attributes.fillna(DEFAULTS)
+        for name in ['species_id', 'eol_id']:
+            self.attributes[name] = self.attributes[name].astype('Int64')
+
+        kinds = index['kind'].to_numpy()
+        self.botanical = pd.Index(index['key'][kinds == 'botanical'].to_numpy())
+        self.botanical_rows = np.nonzero(kinds == 'botanical')[0]
+        self.common = pd.Index(index['key'][kinds == 'common'].to_numpy())
+        self.common_rows = np.nonzero(kinds == 'common')[0]
+
+    @classmethod
+    def load(cls, species_attributes_csv=SPECIES_ATTRIBUTES):
+        """
+        The index of species_attributes.csv, from the reference cache.
+        """
+        index = reference_cache.cached(
+            species_attributes_csv,
+            None,
+            lambda: build_index(species_attributes_csv),
+            species_index=VERSION
+        )
+        return cls(index)
+
+    def _rows(self, names, keys, rows, cultivars=False):
+        # normalize and look up each distinct name once, then spread the
+        # results to the trees
+        codes, distinct = pd.factorize(names)
+        normalized = normalize_names(pd.Series(np.asarray(distinct), dtype=object))
+        found = keys.get_indexer(normalized.to_numpy(dtype=object, na_value=None))
+        if cultivars:
+            missing = found < 0
+            found[missing] = keys.get_indexer(
+                without_cultivar(normalized[missing]).to_numpy(dtype=object, na_value=None)
+            )
+        found = np.where(found >= 0, rows[np.maximum(found, 0)], -1)
+        # missing names have code -1, which picks the -1 on the end
+        return np.append(found, -1)[codes]
+
+    @util.stage(rows_in='trees')
+    def lookup(self, trees):
+        """
+        The position in `self.attributes` of each tree's species, or -1 for
+        trees whose names match no species.
+        """
+        rows = np.full(len(trees), -1)
+        if 'name_botanical' in trees.columns:
+            rows = self._rows(trees['name_botanical'], self.botanical, self.botanical_rows, cultivars=True)
+        if 'name_common' in trees.columns:
+            missing = rows < 0
+            rows[missing] = self._rows(trees['name_common'][missing], self.common, self.common_rows)
+        return rows
+
+    def enrich(self, trees):
+        """
+        Add the species attributes (SPECIES_COLUMNS) to a dataframe of trees
+        with "name_botanical" and/or "name_common" columns. Trees of unknown
+        species get the same defaults parse-trees.js gives them.
+        """
+        rows = self.lookup(trees)
+        found = self.attributes.iloc[np.where(rows >= 0, rows, len(self.attributes) - 1)]
+        return trees.assign(**{name: found[name].to_numpy() for name in SPECIES_COLUMNS})
+
+    def unmatched(self, trees):
+        """
+        The trees whose names match no species.
+        """
+        return trees[self.lookup(trees) < 0]
+
+
+@util.stage
+def stream_unmatched(trees_source, index, outfile, chunk_size=tree_io.DEFAULT_CHUNK_SIZE, input_format=None):
+    """
+    Write the trees in `trees_source` whose names match no species to
+    outfile as csv, a chunk at a time.
+
+    :return: dict of city to (number of rows, set of unmatched names) found in it
+    """
+    counts = {}
+    header = True
+    for chunk in tree_io.iter_trees(trees_source, chunk_size, input_format, compact=False):
+        unmatched = index.unmatched(chunk)
+        unmatched.to_csv(outfile, index=False, header=header)
+        header = False
+        # a tree is reported under its botanical name, or its common name if it has none
+        names = unmatched.reindex(columns=['name_botanical', 'name_common']).bfill(axis=1).iloc[:, 0]
+        cities = unmatched['city'].fillna('') if 'city' in unmatched.columns else pd.Series('', index=unmatched.index)
+        for city, city_names in names.groupby(cities, sort=False):
+            rows, missing = counts.get(city, (0, set()))
+            counts[city] = (rows + len(city_names), missing | set(city_names.dropna()))
+    return counts
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Finds trees whose names match no species in species_attributes.csv.')
+    parser.add_argument('infile', nargs='?', default='-',
+        help='trees file. if not specified read JSON from stdin')
+    parser.add_argument('-i', '--input-format', choices=tree_io.FORMATS,
+        help='format of infile. defaults to the one its extension implies, or json')
+    parser.add_argument('-s', '--species-attributes-csv', default=SPECIES_ATTRIBUTES,
+        help='file path for species_attributes.csv')
+    parser.add_argument('-o', '--output-file', help='output file as csv. if not specified output csv to stdout')
+    parser.add_argument('-c', '--chunk-size', type=int, default=tree_io.DEFAULT_CHUNK_SIZE,
+        help=f'the number of trees read at a time. defaults to {tree_io.DEFAULT_CHUNK_SIZE}')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    index = SpeciesIndex.load(args.species_attributes_csv)
+    outfile = open(args.output_file, 'w', newline='') if args.output_file else sys.stdout
+    counts = stream_unmatched(args.infile, index, outfile, args.chunk_size, args.input_format)
+    if outfile is not sys.stdout:
+        outfile.close()
+    for city, (rows, names) in counts.items():
+        print(f'{city or args.infile}: {rows} rows with {len(names)} missing species names', file=sys.stderr)
@@ -0,0 +1,31 @@
+import pruning_planting
+from benchmarks import run, synthetic
+
+
+def test_synthetic_layers_enrich():
+    layers = synthetic.synthetic_layers(200)
+    trees = synthetic.synthetic_trees(500)
+
+    enriched = pruning_planting.enrich_trees(trees, layers)
+    assert len(enriched) == 500
+    assert enriched['segment'].notna().all()
+    assert set(enriched['pruning_zone']) <= {1, 2, 3}
+
+
+def test_compare():
+    baseline = {'results': [
+        {'stage': 'enrich_trees', 'size': 10000, 'wall_s': 1.0},
+        {'stage': 'geohash', 'size': 10000, 'wall_s': 1.0},
+        {'stage': 'geohash', 'size': 1000, 'wall_s': 0.002},
+    ]}
+    results = {'results': [
+        {'stage': 'enrich_trees', 'size': 10000, 'wall_s': 1.2},
+        {'stage': 'geohash', 'size': 10000, 'wall_s': 1.5},
+        {'stage': 'geohash', 'size': 100000, 'wall_s': 9.0},
+        # twice as slow, but only by a millisecond
+        {'stage': 'geohash', 'size': 1000, 'wall_s': 0.004},
+    ]}
+    assert run.compare(results, baseline, tolerance=0.25) == [('geohash', 10000, 1.0, 1.5)]
+    assert run.compare(results, baseline, tolerance=0.25, min_slowdown=0.001) == [
+        ('geohash', 10000, 1.0, 1.5), ('geohash', 1000, 0.002, 0.004)
+    ]
@@ -0,0 +1,100 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import dedupe_trees
+import species_index
+
+
+def brute_force_pairs(x, y, distance):
+    dx = x[:, None] - x[None, :]
+    dy = y[:, None] - y[None, :]
+    i, j = np.nonzero(np.triu(np.hypot(dx, dy) <= distance, k=1))
+    return set(zip(i.tolist(), j.tolist()))
+
+
+def test_candidate_pairs_cover_every_close_pair():
+    rng = np.random.default_rng(0)
+    x = rng.uniform(0, 200, 500)
+    y = rng.uniform(-100, 100, 500)
+
+    candidates = []
+    for i, j in dedupe_trees.candidate_pairs(x, y, 10.0):
+        candidates.extend((min(a, b), max(a, b)) for a, b in zip(i.tolist(), j.tolist()))
+
+    # every close pair is a candidate, and none is a candidate twice
+    assert brute_force_pairs(x, y, 10.0) <= set(candidates)
+    assert len(candidates) == len(set(candidates))
+
+
+def test_dedupe_trees_keeps_the_priority_source():
+    trees = pd.DataFrame([
+        # about 3 feet apart, same species: a duplicate
+        {'tree_id': 0, 'city': 'los-angeles-county', 'name_botanical': 'Quercus agrifolia',
+         'latitude': 34.1000000, 'longitude': -118.1000000},
+        {'tree_id': 1, 'city': 'arcadia', 'name_botanical': 'QUERCUS AGRIFOLIA ',
+         'latitude': 34.1000080, 'longitude': -118.1000000},
+        # just as close, but a different species
+        {'tree_id': 2, 'city': 'los-angeles-county', 'name_botanical': 'Platanus racemosa',
+         'latitude': 34.2000000, 'longitude': -118.2000000},
+        {'tree_id': 3, 'city': 'arcadia', 'name_botanical': 'Quercus agrifolia',
+         'latitude': 34.2000080, 'longitude': -118.2000000},
+        # same source
+        {'tree_id': 4, 'city': 'arcadia', 'name_botanical': None,
+         'latitude': 34.3000000, 'longitude': -118.3000000},
+        {'tree_id': 5, 'city': 'arcadia', 'name_botanical': None,
+         'latitude': 34.3000080, 'longitude': -118.3000000},
+        # no species on one side, and too far apart on the other
+        {'tree_id': 6, 'city': 'los-angeles-city', 'name_botanical': None,
+         'latitude': 34.3000030, 'longitude': -118.3000000},
+        {'tree_id': 7, 'city': 'los-angeles-city', 'name_botanical': 'Quercus agrifolia',
+         'latitude': 34.1001000, 'longitude': -118.1000000},
+    ])
+
+    deduped, report = dedupe_trees.dedupe_trees(trees, max_distance=10, priority=['arcadia'])
+
+    assert deduped['tree_id'].tolist() == [1, 2, 3, 4, 5, 7]
+    assert report[['tree_id', 'source', 'duplicate_of', 'duplicate_of_source']].values.tolist() == [
+        [0, 'los-angeles-county', 1, 'arcadia'],
+        [6, 'los-angeles-city', 4, 'arcadia'],
+    ]
+    assert (report['distance_ft'] < 10).all()
+
+
+def test_dedupe_trees_matches_common_names_and_pairs_one_to_one():
+    index = species_index.SpeciesIndex(species_index.build_index())
+    trees = pd.DataFrame([
+        # only a common name on the LA City side
+        {'tree_id': 0, 'city': 'arcadia', 'name_botanical': 'Quercus agrifolia', 'name_common': None,
+         'latitude': 34.1000000, 'longitude': -118.1000000},
+        {'tree_id': 1, 'city': 'los-angeles-city', 'name_botanical': None, 'name_common': 'Oak',
+         'latitude': 34.1000080, 'longitude': -118.1000000},
+        # a common name that is the species' own
+        {'tree_id': 2, 'city': 'arcadia', 'name_botanical': 'Jacaranda mimosifolia', 'name_common': 'Blue Jacaranda',
+         'latitude': 34.2000000, 'longitude': -118.2000000},
+        {'tree_id': 3, 'city': 'los-angeles-city', 'name_botanical': None, 'name_common': 'JACARANDA',
+         'latitude': 34.2000080, 'longitude': -118.2000000},
+        # common names that don't match
+        {'tree_id': 4, 'city': 'arcadia', 'name_botanical': 'Quercus agrifolia', 'name_common': 'Coast Live Oak',
+         'latitude': 34.3000000, 'longitude': -118.3000000},
+        {'tree_id': 5, 'city': 'los-angeles-city', 'name_botanical': None, 'name_common': 'Elm',
+         'latitude': 34.3000080, 'longitude': -118.3000000},
+        # one arcadia tree and two county trees near it: only the nearest goes
+        {'tree_id': 6, 'city': 'arcadia', 'name_botanical': None, 'name_common': 'Palm',
+         'latitude': 34.4000000, 'longitude': -118.4000000},
+        {'tree_id': 7, 'city': 'los-angeles-county', 'name_botanical': None, 'name_common': 'Palm',
+         'latitude': 34.4000150, 'longitude': -118.4000000},
+        {'tree_id': 8, 'city': 'los-angeles-county', 'name_botanical': None, 'name_common': 'Palm',
+         'latitude': 34.3999950, 'longitude': -118.4000000},
+        # no coordinates
+        {'tree_id': 9, 'city': 'los-angeles-county', 'name_botanical': None, 'name_common': 'Palm',
+         'latitude': np.nan, 'longitude': np.nan},
+    ])
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)
+        deduped, report = dedupe_trees.dedupe_trees(trees, max_distance=10, priority=['arcadia'], species=index)
+
+    assert report[['tree_id', 'duplicate_of']].values.tolist() == [[1, 0], [3, 2], [8, 6]]
+    assert deduped['tree_id'].tolist() == [0, 2, 4, 5, 6, 7, 9]
@@ -0,0 +1,40 @@
+import geohash
+import numpy as np
+import pytest
+
+import fast_geohash
+
+
+def test_encode_matches_python_geohash():
+    rng = np.random.default_rng(0)
+    latitudes = np.append(rng.uniform(-90, 90, 5000), [0.0, -90.0, 34.0120862991971])
+    longitudes = np.append(rng.uniform(-180, 180, 5000), [0.0, -180.0, -118.49230773747])
+
+    for precision in [1, 6, 9, 12]:
+        expected = [geohash.encode(lat, lon, precision=precision) for lat, lon in zip(latitudes, longitudes)]
+        assert fast_geohash.encode(latitudes, longitudes, precision=precision).tolist() == expected
+
+
+@pytest.mark.filterwarnings('error')
+def test_encode_missing_coordinates():
+    latitudes = [34.0120862991971, np.nan, 34.01, np.inf]
+    longitudes = [-118.49230773747, -118.49, np.nan, -118.49]
+
+    hashes = fast_geohash.encode(latitudes, longitudes, precision=9)
+    assert hashes.tolist() == [geohash.encode(latitudes[0], longitudes[0], precision=9), '', '', '']
+    assert fast_geohash.truncate(hashes, 4).tolist() == [hashes[0][:4], '', '', '']
+    with pytest.raises(ValueError):
+        fast_geohash.encode_codes(latitudes, longitudes, precision=9)
+
+
+def test_decode_matches_python_geohash():
+    hashes = fast_geohash.encode([34.0120862991971, -12.5], [-118.49230773747, 77.25], precision=9)
+    latitudes, longitudes = fast_geohash.decode(hashes)
+
+    for hashcode, lat, lon in zip(hashes, latitudes, longitudes):
+        assert geohash.decode(hashcode) == (lat, lon)
+
+
+def test_truncate():
+    hashes = fast_geohash.encode([34.01, 34.02], [-118.49, -118.48], precision=9)
+    assert fast_geohash.truncate(hashes, 4).tolist() == [h[:4] for h in hashes]
@@ -0,0 +1,67 @@
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import fetch
+
+
+BODY = b'Tree ID,Species ID\n1,75\n2,56\n' * 100
+
+
+class InventoryHandler(BaseHTTPRequestHandler):
+    """
+    Serves BODY with an ETag, gzipped when asked, and answers conditional
+    requests for the current ETag with 304.
+    """
+    etag = '"v1"'
+    statuses = []
+
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == self.etag:
+            self.statuses.append(304)
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = BODY
+        self.send_response(200)
+        self.send_header('ETag', self.etag)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.statuses.append(200)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_fetch_conditional_and_offline(tmp_path):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), InventoryHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f'http://127.0.0.1:{server.server_port}/resource/inventory.csv?$limit=50000'
+
+    try:
+        first = fetch.fetch(url, cache_dir=tmp_path)
+        assert first.suffix == '.csv'
+        assert first.read_bytes() == BODY
+
+        assert fetch.fetch(url, cache_dir=tmp_path) == first
+        assert InventoryHandler.statuses == [200, 304]
+        assert first.read_bytes() == BODY
+
+        InventoryHandler.etag = '"v2"'
+        fetch.fetch(url, cache_dir=tmp_path)
+        assert InventoryHandler.statuses == [200, 304, 200]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # the server is gone, so the cached copy is used
+    assert fetch.fetch(url, cache_dir=tmp_path, timeout=1).read_bytes() == BODY
+
+
+def test_fetch_passes_local_paths_through(tmp_path):
+    assert fetch.fetch(str(tmp_path / 'trees.csv')) == tmp_path / 'trees.csv'
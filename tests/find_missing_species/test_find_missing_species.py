@@ -1,8 +1,9 @@
+import io
 import os.path
 import pandas as pd
 
 from tests import get_script_dir
-from find_missing_species import species_id_col_name, filter_new_species_ids
+from find_missing_species import species_id_col_name, filter_new_species_ids, stream_new_species_ids
 
 
 def test_find_missing_species():
@@ -15,4 +16,23 @@ def test_find_missing_species():
     print(tree_inventory_df[species_id_col_name].head(10))
     results = filter_new_species_ids(tree_inventory_df, species_df)
 
-    assert tree_inventory_df[tree_inventory_df[species_id_col_name] == 56].equals(results)
\ No newline at end of file
+    assert tree_inventory_df[tree_inventory_df[species_id_col_name] == 56].equals(results)
+
+def test_stream_new_species_ids_matches_filter(tmp_path):
+    csv_file_name = os.path.join(get_script_dir(__file__), 'tree_inventory.csv')
+    gzip_file_name = str(tmp_path / 'tree_inventory.csv.gz')
+    pd.read_csv(csv_file_name, dtype=str).to_csv(gzip_file_name, index=False)
+
+    species_df = pd.DataFrame({species_id_col_name: [75, 80, 46, 1434]})
+    expected = filter_new_species_ids(pd.read_csv(csv_file_name), species_df)
+
+    outfile = io.StringIO()
+    counts = stream_new_species_ids(
+        [csv_file_name, gzip_file_name], pd.Index(species_df[species_id_col_name]), outfile, chunk_size=3
+    )
+    results = pd.read_csv(io.StringIO(outfile.getvalue()))
+
+    assert counts == {csv_file_name: (1, {'56'}), gzip_file_name: (1, {'56'})}
+    # the streamed rows are written as they appear in the inventory, so integer
+    # columns aren't turned into floats by missing values elsewhere in the file
+    pd.testing.assert_frame_equal(results, pd.concat([expected, expected], ignore_index=True), check_dtype=False)
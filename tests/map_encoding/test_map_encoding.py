@@ -0,0 +1,54 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+import map_encoding
+import map_tiles
+
+
+def test_round_trip():
+    rng = np.random.default_rng(0)
+    trees = pd.DataFrame({
+        'tree_id': rng.permutation(500),
+        'name_common': rng.choice(['Palm', 'Oak', 'Ficus'], 500),
+        'name_botanical': rng.choice(['Washingtonia robusta', 'Quercus agrifolia', None], 500),
+        'latitude': rng.uniform(34.00, 34.05, 500),
+        'longitude': rng.uniform(-118.52, -118.47, 500),
+        'heritage': rng.random(500) < 0.05,
+        'height_min_ft': 15,
+    })
+
+    encoded = json.dumps(map_encoding.encode(trees), separators=(',', ':'))
+    decoded = map_encoding.decode(json.loads(encoded))
+
+    expected = json.loads(map_tiles.map_data(trees).to_json(orient='records'))
+    assert len(encoded) < len(json.dumps(expected, indent=2)) / 3
+    assert len(decoded) == len(expected)
+
+    by_id = {tree['tree_id']: tree for tree in decoded}
+    for tree in expected:
+        result = by_id[tree['tree_id']]
+        assert result.keys() == tree.keys()
+        for field in ['latitude', 'longitude']:
+            assert abs(result[field] - tree[field]) <= 10 ** -map_encoding.PRECISION
+            result[field] = tree[field]
+        assert result == tree
+
+
+def test_missing_coordinates():
+    trees = pd.DataFrame({
+        'tree_id': [1, 2, 3, 4],
+        'name_common': ['Palm', 'Oak', 'Palm', 'Oak'],
+        'latitude': [34.0101, np.nan, 34.0102, np.nan],
+        'longitude': [-118.4901, -118.4902, np.nan, np.nan],
+        'heritage': False,
+    })
+
+    encoded = map_encoding.encode(trees)
+    for name in map_encoding.COORDINATES:
+        assert max(abs(value) for value in encoded['columns'][name]['values'][1:]) < 10 ** 6
+    decoded = {tree['tree_id']: tree for tree in map_encoding.decode(json.loads(json.dumps(encoded)))}
+
+    assert [decoded[tree_id]['latitude'] for tree_id in [1, 2, 3, 4]] == [34.0101, None, 34.0102, None]
+    assert [decoded[tree_id]['longitude'] for tree_id in [1, 2, 3, 4]] == [-118.4901, -118.4902, None, None]
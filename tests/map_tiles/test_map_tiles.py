@@ -0,0 +1,64 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+import map_tiles
+
+
+def test_tile_xy_and_bounds():
+    # Santa Monica pier
+    x, y = map_tiles.tile_xy([34.0083], [-118.4988], 16)
+    assert (x[0], y[0]) == (11195, 26177)
+
+    west, south, east, north = map_tiles.tile_bounds(16, x[0], y[0])
+    assert west <= -118.4988 < east
+    assert south <= 34.0083 < north
+
+
+def test_write_tiles(tmp_path):
+    rng = np.random.default_rng(0)
+    trees = pd.DataFrame({
+        'tree_id': np.arange(300),
+        'name_common': 'Palm',
+        'latitude': rng.uniform(34.00, 34.05, 300),
+        'longitude': rng.uniform(-118.52, -118.47, 300),
+        'height_min_ft': 15,
+    })
+
+    manifest = map_tiles.write_tiles(trees, tmp_path, min_zoom=12, max_zoom=15)
+
+    for zoom in range(12, 16):
+        tiles = [tile for tile in manifest['tiles'] if tile['z'] == zoom]
+        assert sum(tile['count'] for tile in tiles) == 300
+
+        counted = 0
+        for tile in tiles:
+            with open(tmp_path / str(zoom) / str(tile['x']) / f'{tile["y"]}.json') as f:
+                payload = json.load(f)
+            if zoom == 15:
+                assert set(payload['trees'][0]) == {'tree_id', 'name_common', 'latitude', 'longitude'}
+                counted += len(payload['trees'])
+            else:
+                assert len(payload['clusters']) <= 4 ** map_tiles.CLUSTER_BITS
+                counted += sum(cluster['count'] for cluster in payload['clusters'])
+        assert counted == 300
+
+    with open(tmp_path / 'manifest.json') as f:
+        assert json.load(f) == manifest
+
+
+def test_trees_without_coordinates_are_left_out(tmp_path):
+    trees = pd.DataFrame({
+        'tree_id': [1, 2, 3, 4],
+        'latitude': [34.0083, np.nan, 34.0084, None],
+        'longitude': [-118.4988, -118.4988, np.nan, None],
+    })
+
+    manifest = map_tiles.write_tiles(trees, tmp_path, min_zoom=14, max_zoom=16)
+
+    for tile in manifest['tiles']:
+        assert 0 <= tile['x'] < 2 ** tile['z'] and 0 <= tile['y'] < 2 ** tile['z']
+    assert [tile['count'] for tile in manifest['tiles']] == [1, 1, 1]
+    with open(tmp_path / '16' / '11195' / '26177.json') as f:
+        assert [tree['tree_id'] for tree in json.load(f)['trees']] == [1]
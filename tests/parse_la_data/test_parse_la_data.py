@@ -0,0 +1,130 @@
+import json
+import os.path
+import sys
+
+import pandas as pd
+import pytest
+
+from tests import get_script_dir
+
+sys.path.insert(0, os.path.join(get_script_dir(__file__), '..', '..', 'data', 'stiles_data'))
+import parse_la_data  # noqa: E402
+import reference_cache  # noqa: E402
+
+
+def write_city(root, city, features):
+    city_dir = root / city
+    city_dir.mkdir()
+    collection = {
+        'type': 'FeatureCollection',
+        'features': [
+            {'type': 'Feature', 'properties': properties, 'geometry': {'type': 'Point', 'coordinates': [x, y]}}
+            for properties, (x, y) in features
+        ]
+    }
+    with open(city_dir / f'{city}.geojson', 'w') as f:
+        json.dump(collection, f)
+
+
+def test_parse_all_combines_cities_and_isolates_failures(tmp_path, capsys):
+    write_city(tmp_path, 'arcadia', [
+        ({'TREE_ID': 7, 'COM_NAME': 'CAMPHOR', 'ADDR': '1 MAIN ST ARCADIA CA'}, (-118.03, 34.13)),
+        ({'TREE_ID': 8, 'COM_NAME': 'OAK', 'ADDR': '2 MAIN ST ARCADIA CA'}, (-118.04, 34.14)),
+    ])
+    write_city(tmp_path, 'los-angeles-city', [({'species': 'JACARANDA'}, (-118.3, 34.05))])
+    # missing every column the parser needs
+    write_city(tmp_path, 'alhambra', [({'unexpected': 1}, (-118.1, 34.09))])
+    (tmp_path / 'all').mkdir()
+
+    trees = parse_la_data.StilesDataParser(tmp_path).parse_all(workers=2)
+
+    assert list(trees.columns) == parse_la_data.COMMON_COLUMNS
+    assert trees['tree_id'].tolist() == [0, 1, 2]
+    assert trees['city'].tolist() == ['arcadia', 'arcadia', 'los-angeles-city']
+    assert trees['source_tree_id'][:2].tolist() == ['7', '8']
+    assert pd.isna(trees['source_tree_id'][2])
+    assert trees['name_common'].tolist() == ['Camphor', 'Oak', 'Jacaranda']
+    assert trees['latitude'].tolist() == [34.13, 34.14, 34.05]
+    assert pd.isna(trees['height_min_ft']).all()
+
+    report = capsys.readouterr().err
+    assert 'alhambra: failed' in report
+    assert 'arcadia: 2 trees' in report
+
+
+def test_city_schema_reads_only_referenced_columns(tmp_path):
+    write_city(tmp_path, 'new-city', [
+        ({'ID': 1, 'SPP': 'RED GUM', 'NUM': 12, 'ST': 'ELM AVE', 'HT': '15-30', 'NOTES': 'unused'}, (-118.2, 34.0)),
+        ({'ID': 2, 'SPP': 'OAK', 'NUM': 14, 'ST': 'ELM AVE', 'HT': '60+', 'NOTES': 'unused'}, (-118.3, 34.1)),
+    ])
+    schema = {
+        'columns': {'tree_id': 'ID'},
+        'title': {'name_common': 'SPP'},
+        'address': ('NUM', 'ST'),
+        'categories': {'HT': ('height_min_feet', 'height_max_feet', parse_la_data.HEIGHT_CATEGORIES)},
+    }
+    city_parser = parse_la_data.CityParser(tmp_path / 'new-city', schema)
+
+    assert 'NOTES' not in city_parser.read_df().columns
+    df = city_parser.get_maximal_df()
+    assert df.to_dict('list') == {
+        'tree_id': [1, 2],
+        'name_common': ['Red Gum', 'Oak'],
+        'address': ['12 Elm Ave', '14 Elm Ave'],
+        'height_min_feet': [15, 60],
+        'height_max_feet': [30, -1],
+        'city': ['new-city', 'new-city'],
+        'latitude': [34.0, 34.1],
+        'longitude': [-118.2, -118.3],
+    }
+
+
+def test_iter_chunks_matches_get_maximal_df(tmp_path):
+    write_city(tmp_path, 'arcadia', [
+        ({'TREE_ID': i, 'COM_NAME': 'CAMPHOR', 'ADDR': f'{i} MAIN ST ARCADIA CA'}, (-118.03 - i / 100, 34.13))
+        for i in range(5)
+    ])
+    city_parser = parse_la_data.CityParser(tmp_path / 'arcadia')
+
+    chunks = list(city_parser.iter_chunks(chunk_size=2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    pd.testing.assert_frame_equal(
+        pd.concat(chunks, ignore_index=True), city_parser.get_maximal_df(), check_dtype=False
+    )
+
+    output = tmp_path / 'all' / 'trees.parquet'
+    assert parse_la_data.StilesDataParser(tmp_path).write_all(output, workers=1, chunk_size=2) == 5
+    trees = pd.read_parquet(output)
+    assert list(trees.columns) == parse_la_data.COMMON_COLUMNS
+    assert trees['tree_id'].tolist() == list(range(5))
+
+
+def test_cat_parser():
+    cats = ['1-15', '16-30', '>60', '------', '']
+    df = pd.DataFrame({'HEIGHT': [' 16-30', '>60', '------', '1-15', None, '']})
+
+    df = parse_la_data.CityParser.cat_parser(df, 'height_min', 'height_max', 'HEIGHT', cats)
+    assert df['height_min'].tolist() == [16, 60, -1, 1, -1, -1]
+    assert df['height_max'].tolist() == [30, -1, -1, 15, -1, -1]
+
+    unknown = pd.DataFrame({'HEIGHT': ['1-15', '16-30', '31-45', '46-60', '>60', '100+']})
+    with pytest.raises(RuntimeError):
+        parse_la_data.CityParser.cat_parser(unknown, 'height_min', 'height_max', 'HEIGHT', cats)
+
+
+def test_workers_share_species_index_on_cold_cache(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(reference_cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    for city in ['los-angeles-city', 'los-angeles-county', 'arcadia']:
+        write_city(tmp_path, city, [({'species': 'JACARANDA', 'SPECIES': 'JACARANDA', 'COM_NAME': 'JACARANDA',
+                                      'DIAMETER': 12, 'TREE_ID': 1, 'ADDR': '1 MAIN ST ARCADIA CA'}, (-118.3, 34.05))])
+
+    trees = parse_la_data.StilesDataParser(tmp_path).parse_all(workers=3)
+    assert 'failed' not in capsys.readouterr().err
+    assert len(trees) == 3
+    assert trees['family_name_botanical'].tolist() == ['Bignoniaceae'] * 3
+
+    reference_cache.clear(tmp_path / 'cache')
+    output = tmp_path / 'all' / 'trees.parquet'
+    assert parse_la_data.StilesDataParser(tmp_path).write_all(output, workers=3) == 3
+    assert 'failed' not in capsys.readouterr().err
+    assert len(list((tmp_path / 'cache').glob('*.parquet'))) == 1
@@ -0,0 +1,218 @@
+import geopandas as gpd
+import pandas as pd
+import pytest
+from shapely.geometry import LineString, MultiLineString
+
+from benchmarks.synthetic import synthetic_layers, synthetic_trees
+from pruning_planting import (
+    cycle_years, enrich_trees, enrich_trees_incremental, enrich_trees_parallel, explode_lines,
+    match_trees_nearest_segment, partition_trees, pruning_files, pruning_year_lookup, read_state, reference_pool
+)
+import reference_cache
+from reference_index import ReferenceIndex
+from zone_index import ZoneIndex
+
+
+def test_match_trees_nearest_segment():
+    segments = gpd.GeoDataFrame(
+        {'SEGMENT': ['1', '2']},
+        geometry=[
+            LineString([(-118.490, 34.010), (-118.480, 34.010)]),
+            LineString([(-118.490, 34.020), (-118.480, 34.020)]),
+        ],
+        crs='epsg:4326'
+    )
+    trees = pd.DataFrame({
+        'tree_id': [1, 2, 3],
+        'latitude': [34.0101, 34.0195, 34.0130],
+        'longitude': [-118.485, -118.489, -118.600],
+    })
+
+    results = match_trees_nearest_segment(segments, trees)
+    assert results['SEGMENT'].tolist() == ['1', '2', '1']
+
+    # the third tree is miles away from both segments
+    results = match_trees_nearest_segment(segments, trees, max_distance=500)
+    assert results['SEGMENT'].tolist()[:2] == ['1', '2']
+    assert pd.isnull(results['SEGMENT'].iloc[2])
+
+    # an index built once can be matched against again and again
+    index = ReferenceIndex(segments)
+    for _ in range(2):
+        results = match_trees_nearest_segment(index, trees.assign(latitude=[34.0101, None, 34.0130]))
+        assert results['SEGMENT'].tolist()[::2] == ['1', '1']
+        assert pd.isnull(results['SEGMENT'].iloc[1])
+
+    # no tree is within range of any segment
+    results = match_trees_nearest_segment(index, trees.iloc[2:], max_distance=500)
+    assert results['SEGMENT'].isnull().all()
+
+
+def test_explode_lines():
+    lines = gpd.GeoDataFrame(
+        {'SEGMENT': ['1', '2']},
+        geometry=[
+            LineString([(0, 0), (100, 0)]),
+            MultiLineString([[(0, 10), (10, 10)], [(20, 10), (30, 10)]]),
+        ],
+        crs='epsg:2229'
+    )
+
+    points = explode_lines(lines)
+    assert points['SEGMENT'].tolist() == ['1', '1', '2', '2', '2', '2']
+    assert list(points.columns) == ['SEGMENT', 'longitude', 'latitude', 'geohash']
+
+    points = explode_lines(lines, densify=25)
+    assert points['SEGMENT'].tolist().count('1') == 5
+
+
+def test_cycle_years():
+    years = cycle_years()
+    assert years['1'] == '2019-2020'
+    assert years['5B'] == '2019-2020'
+    assert years['5C'] == '2020-2021'
+    assert years['5A'] == '2023-2024'
+
+
+def test_pruning_files():
+    years = pruning_files()
+    assert list(years)[:3] == ['2017-2018', '2018-2019', '2019-2020']
+    assert sorted(years['2017-2018']) == [
+        'data/pruning/pruning1718_medians.shp',
+        'data/pruning/pruning1718_streets.shp',
+    ]
+
+
+def test_pruning_year_lookup(monkeypatch, tmp_path):
+    monkeypatch.setattr(reference_cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    streets = gpd.read_file('data/planting/TreePlanting_Streets.shp').set_index('SEGMENT')
+    five_b = streets.index[streets['CYCLE_NO'] == '5B']
+    five_c = streets.index[streets['CYCLE_NO'] == '5C']
+
+    # the first 5B segment is pruned in 2030-2031, whatever its cycle says
+    pruning_dir = tmp_path / 'pruning'
+    pruning_dir.mkdir()
+    gpd.GeoDataFrame(
+        {'SEGMENT': [five_b[0]]}, geometry=[streets.geometry[five_b[0]]], crs='epsg:2229'
+    ).to_file(pruning_dir / 'pruning3031_streets.shp')
+    # 5C isn't on the schedule
+    cycles = tmp_path / 'cycles.csv'
+    cycles.write_text('FY,3 Year,5 Year\nFY19-20,3a,5b\n')
+
+    years = pruning_year_lookup(pruning_dir, cycles)
+    assert years[five_b[0]] == '2030-2031'
+    assert (years[five_b[1:]] == '2019-2020').all()
+    assert not five_c.isin(years.index).any()
+
+    trees = pd.DataFrame({'SEGMENT': [five_b[0], five_b[1], five_c[0], 'no such segment']})
+    assert trees['SEGMENT'].map(years).tolist()[:2] == ['2030-2031', '2019-2020']
+    assert trees['SEGMENT'].map(years)[2:].isnull().all()
+
+
+def test_partition_trees():
+    trees = pd.DataFrame({
+        'tree_id': range(6),
+        'latitude': [34.01, 34.01, 34.01, 35.5, 35.5, 36.9],
+        'longitude': [-118.49, -118.49, -118.49, -117.0, -117.0, -116.1],
+    })
+
+    partitions = partition_trees(trees, 2)
+    assert sorted(partition['tree_id'].tolist() for partition in partitions) == [[0, 1, 2], [3, 4, 5]]
+    assert len(partition_trees(trees, 10)) == 3
+
+
+@pytest.mark.parametrize('matcher', ['geohash', 'nearest'])
+def test_enrich_trees_parallel_matches_serial(matcher):
+    layers = synthetic_layers(200)
+    trees = synthetic_trees(1000)
+
+    with reference_pool(2, layers=layers) as pool:
+        parallel = enrich_trees_parallel(trees, pool, 6, matcher=matcher)
+    serial = enrich_trees(trees.copy(), layers, matcher=matcher)
+
+    assert len(partition_trees(trees, 6)) > 1
+    pd.testing.assert_frame_equal(parallel, serial)
+
+
+@pytest.fixture
+def incremental():
+    layers = synthetic_layers(200)
+    calls = []
+
+    def enrich(trees):
+        calls.append(sorted(trees['tree_id']))
+        return enrich_trees(trees.copy(), layers)
+
+    return layers, enrich, calls
+
+
+def test_enrich_trees_incremental_reuses_unchanged_trees(tmp_path, incremental):
+    layers, enrich, calls = incremental
+    state_file = tmp_path / 'state.parquet'
+    trees = synthetic_trees(300)
+
+    first = enrich_trees_incremental(trees, enrich, state_file, 'key')
+    assert calls == [list(range(300))]
+    pd.testing.assert_frame_equal(first, enrich_trees(trees.copy(), layers))
+
+    # move two trees, drop two and add one
+    changed = trees.copy()
+    changed.loc[[5, 17], 'latitude'] += 0.001
+    changed = changed.drop(index=[40, 41])
+    added = synthetic_trees(1, seed=1).assign(tree_id=1000)
+    changed = pd.concat([changed, added], ignore_index=True)
+
+    second = enrich_trees_incremental(changed, enrich, state_file, 'key')
+    assert calls[1] == [5, 17, 1000]
+    pd.testing.assert_frame_equal(second, enrich_trees(changed.copy(), layers))
+
+    state = read_state(state_file, 'key')
+    assert sorted(state['tree_id']) == sorted(changed['tree_id'])
+
+    # nothing changed
+    enrich_trees_incremental(changed, enrich, state_file, 'key')
+    assert len(calls) == 2
+
+
+def test_enrich_trees_incremental_overlapping_zones(tmp_path, incremental):
+    layers, enrich, calls = incremental
+    state_file = tmp_path / 'state.parquet'
+    # zone 2 also takes in all of zone 1
+    zones = layers['pruning_zones'].copy()
+    zones.loc[1, 'geometry'] = zones.geometry[1].union(zones.geometry[0])
+    layers['pruning_zones'] = zones
+    layers['pruning_zone_index'] = ZoneIndex.build(zones)
+    trees = synthetic_trees(300)
+
+    # trees in zone 1 are repeated, once for each zone
+    expected = enrich_trees(trees.copy(), layers).reset_index(drop=True)
+    assert len(expected) > len(trees)
+    for _ in range(2):
+        result = enrich_trees_incremental(trees, enrich, state_file, 'key')
+        pd.testing.assert_frame_equal(result, expected)
+    assert len(calls) == 1
+
+
+def test_enrich_trees_incremental_recomputes_everything(tmp_path, incremental):
+    layers, enrich, calls = incremental
+    state_file = tmp_path / 'state.parquet'
+    trees = synthetic_trees(100)
+    expected = enrich_trees(trees.copy(), layers)
+
+    # no state yet
+    enrich_trees_incremental(trees, enrich, state_file, 'key')
+    # the reference data changed
+    result = enrich_trees_incremental(trees, enrich, state_file, 'other key')
+    pd.testing.assert_frame_equal(result, expected)
+    assert read_state(state_file, 'key') is None
+    # the state file was deleted
+    state_file.unlink()
+    result = enrich_trees_incremental(trees, enrich, state_file, 'other key')
+    pd.testing.assert_frame_equal(result, expected)
+    # the state file is corrupt
+    state_file.write_bytes(state_file.read_bytes()[:100])
+    assert read_state(state_file, 'other key') is None
+    result = enrich_trees_incremental(trees, enrich, state_file, 'other key')
+    pd.testing.assert_frame_equal(result, expected)
+
+    assert calls == [list(range(100))] * 4
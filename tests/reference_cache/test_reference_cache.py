@@ -0,0 +1,58 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+import pandas as pd
+from shapely.geometry import Point
+
+import reference_cache
+
+
+def test_cache_is_invalidated_when_source_changes(tmp_path):
+    source = tmp_path / 'layer.geojson'
+    cache_dir = tmp_path / 'cache'
+    calls = []
+
+    def write_layer(value):
+        gpd.GeoDataFrame({'value': [value]}, geometry=[Point(0, 0)], crs='epsg:4326').to_file(source, driver='GeoJSON')
+
+    def loader():
+        calls.append(1)
+        return gpd.read_file(source)
+
+    write_layer(1)
+    assert reference_cache.cached(source, 'epsg:4326', loader, cache_dir=cache_dir)['value'].tolist() == [1]
+    assert reference_cache.cached(source, 'epsg:4326', loader, cache_dir=cache_dir)['value'].tolist() == [1]
+    assert len(calls) == 1
+
+    write_layer(2)
+    assert reference_cache.cached(source, 'epsg:4326', loader, cache_dir=cache_dir)['value'].tolist() == [2]
+    assert len(calls) == 2
+    assert len(list(cache_dir.glob('*.parquet'))) == 1
+
+
+def test_evict_keeps_cache_under_max_bytes(tmp_path):
+    for i in range(3):
+        (tmp_path / f'layer{i}-0-0.parquet').write_bytes(b'x' * 100)
+
+    reference_cache.evict(tmp_path, max_bytes=250)
+    assert len(list(tmp_path.glob('*.parquet'))) == 2
+
+
+def _build_concurrently(source, cache_dir):
+    frame = pd.DataFrame({'value': range(1000)})
+    for _ in range(5):
+        cached = reference_cache.cached(source, None, lambda: frame, cache_dir=cache_dir)
+    return cached['value'].sum()
+
+
+def test_concurrent_builds_of_the_same_entry(tmp_path):
+    source = tmp_path / 'species.csv'
+    source.write_text('value\n1\n')
+    cache_dir = tmp_path / 'cache'
+
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        sums = list(pool.map(_build_concurrently, [source] * 8, [cache_dir] * 8))
+
+    assert sums == [sum(range(1000))] * 8
+    assert len(list(cache_dir.glob('*.parquet'))) == 1
+    assert not list(cache_dir.glob('*.tmp'))
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+import pruning_planting
+import reference_index
+
+
+def brute_force(index, lats, lons):
+    valid, points = index._points(lats, lons)
+    distances = shapely.distance(points[:, None], index.geometries[None, :])
+    return valid, distances
+
+
+@pytest.fixture(scope='module')
+def sites():
+    return pruning_planting.load_vacant_sites()
+
+
+@pytest.fixture(scope='module')
+def queries():
+    rng = np.random.default_rng(0)
+    lats = rng.uniform(33.99, 34.06, 200)
+    lons = rng.uniform(-118.53, -118.43, 200)
+    lats[3] = np.nan
+    return lats, lons
+
+
+@pytest.mark.parametrize('k, max_distance', [(1, None), (3, None), (4, 250.0)])
+def test_nearest_matches_brute_force(sites, queries, k, max_distance):
+    lats, lons = queries
+    valid, distances = brute_force(sites, lats, lons)
+    positions, items, found = sites.nearest(lats, lons, k=k, max_distance=max_distance)
+
+    assert 3 not in positions
+    for row, position in enumerate(valid):
+        expected = np.sort(distances[row])[:k]
+        if max_distance is not None:
+            expected = expected[expected <= max_distance]
+        np.testing.assert_allclose(found[positions == position], expected)
+        np.testing.assert_allclose(distances[row, items[positions == position]], expected)
+
+
+def test_within_matches_brute_force(sites, queries):
+    lats, lons = queries
+    valid, distances = brute_force(sites, lats, lons)
+    positions, items, found = sites.within(lats, lons, 300.0)
+
+    for row, position in enumerate(valid):
+        assert set(items[positions == position]) == set(np.nonzero(distances[row] <= 300.0)[0])
+    assert (np.diff(found)[np.diff(positions) == 0] >= 0).all()
+
+
+def test_lines():
+    medians = pruning_planting.load_dataset(pruning_planting.PLANTING_MEDIANS)
+    index = reference_index.ReferenceIndex(medians)
+    lats, lons = np.array([34.02, 34.03]), np.array([-118.49, -118.47])
+    valid, distances = brute_force(index, lats, lons)
+    positions, items, found = index.nearest(lats, lons, k=2)
+    np.testing.assert_array_equal(positions, [0, 0, 1, 1])
+    np.testing.assert_allclose(found, np.sort(distances, axis=1)[:, :2].ravel())
+
+
+@pytest.mark.parametrize('k', [1, 3])
+def test_nearest_out_of_range(k):
+    medians = pruning_planting.load_dataset(pruning_planting.PLANTING_MEDIANS)
+    index = reference_index.ReferenceIndex(medians)
+
+    # miles from every median
+    positions, items, found = index.nearest([34.5], [-118.0], k=k, max_distance=100.0)
+    assert len(positions) == len(items) == len(found) == 0
+
+    positions, items, found = index.nearest([34.5, 34.02], [-118.0, -118.49], k=k, max_distance=5000.0)
+    assert set(positions) == {1}
+
+
+def test_vacant_sites_for_trees(sites):
+    trees = pd.DataFrame({'tree_id': [1, 2], 'latitude': [34.02, np.nan], 'longitude': [-118.49, np.nan]})
+    enriched = pruning_planting.vacant_sites_for_trees(trees, sites)
+    assert enriched['vacant_site_type'][0] in ('street', 'median')
+    assert enriched['vacant_site_distance_ft'][0] > 0
+    assert enriched.loc[1, pruning_planting.VACANT_SITE_COLUMNS].isna().all()
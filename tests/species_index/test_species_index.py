@@ -0,0 +1,47 @@
+import io
+
+import pandas as pd
+
+import species_index
+
+
+def test_normalize_names():
+    names = pd.Series([
+        "Platanus X Hispanica  'Bloodgood'", '×Chitalpa tashkentensis', 'Ficus sp.', 'FICUS SPP',
+        'Magnolia grandiflora “Little Gem”', None,
+    ])
+    assert species_index.normalize_names(names).tolist()[:5] == [
+        "platanus x hispanica 'bloodgood'",
+        'x chitalpa tashkentensis',
+        'ficus spp',
+        'ficus spp',
+        "magnolia grandiflora 'little gem'",
+    ]
+    assert pd.isna(species_index.normalize_names(names)[5])
+
+
+def test_enrich_and_unmatched(tmp_path):
+    index = species_index.SpeciesIndex(species_index.build_index())
+    trees = pd.DataFrame({
+        'tree_id': [1, 2, 3, 4, 5, 6],
+        'city': ['a', 'a', 'a', 'b', 'b', 'b'],
+        'name_botanical': [
+            "Ulmus Parvifolia 'Drake'", 'Ficus Spp', "Ulmus Parvifolia 'Unlisted'", None, 'Unknown tree', None,
+        ],
+        'name_common': ['', '', '', 'Drake Elm', 'Unknown', None],
+    })
+
+    enriched = index.enrich(trees)
+    assert list(enriched.columns) == list(trees.columns) + species_index.SPECIES_COLUMNS
+    # exact, spp., species of an unlisted cultivar and common name
+    assert enriched['species_id'][:4].tolist() == [462, 83, 32, 462]
+    assert enriched['family_name_botanical'][0] == 'Ulmaceae'
+    assert enriched['species_id'][4:].isna().all()
+    assert enriched['family_name_botanical'][4:].tolist() == ['Unknown', 'Unknown']
+    assert enriched['eol_id'][4:].tolist() == [-1, -1]
+
+    trees.to_parquet(tmp_path / 'trees.parquet')
+    outfile = io.StringIO()
+    counts = species_index.stream_unmatched(tmp_path / 'trees.parquet', index, outfile, chunk_size=4)
+    assert pd.read_csv(io.StringIO(outfile.getvalue()))['tree_id'].tolist() == [5, 6]
+    assert counts == {'b': (2, {'Unknown tree'})}
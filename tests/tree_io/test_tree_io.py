@@ -0,0 +1,90 @@
+import io
+import json
+
+import pandas as pd
+
+import tree_io
+
+
+TREES = [
+    {'tree_id': i, 'name_common': f'Tree [{i}], "the {i}th"', 'latitude': 34 + i / 8, 'longitude': -118.5}
+    for i in range(25)
+]
+
+
+def test_iter_raw_array_across_blocks():
+    infile = io.StringIO(json.dumps(TREES, indent=2))
+    assert infile.read(1) == '['
+
+    records = [json.loads(raw) for raw in tree_io.iter_raw_array(infile, block_size=16)]
+    assert records == TREES
+
+    infile.seek(1)
+    assert list(tree_io.iter_raw_array(infile, block_size=16, parse=True)) == TREES
+
+
+def test_iter_chunks_reads_arrays_and_ndjson_alike():
+    array = io.StringIO(json.dumps(TREES, indent=2))
+    ndjson = io.StringIO('\n'.join(json.dumps(tree) for tree in TREES) + '\n')
+
+    array_chunks = list(tree_io.iter_chunks(array, chunk_size=10))
+    ndjson_chunks = list(tree_io.iter_chunks(ndjson, chunk_size=10))
+
+    assert [len(chunk) for chunk in array_chunks] == [10, 10, 5]
+    pd.testing.assert_frame_equal(
+        pd.concat(array_chunks, ignore_index=True),
+        pd.concat(ndjson_chunks, ignore_index=True)
+    )
+    assert pd.concat(array_chunks, ignore_index=True).to_dict('records') == TREES
+
+
+def test_write_ndjson():
+    outfile = io.StringIO()
+    tree_io.write_ndjson(pd.DataFrame(TREES[:2]), outfile)
+    assert [json.loads(line) for line in outfile.getvalue().splitlines()] == TREES[:2]
+
+
+def test_binary_formats_round_trip(tmp_path):
+    trees = pd.DataFrame(TREES)
+    trees['heritageYear'] = [2004.0] + [None] * 24
+    trees['images'] = [['a.jpg', 'b.jpg']] + [[]] * 24
+
+    for name in ['trees.parquet', 'trees.arrow']:
+        with tree_io.TreeWriter(str(tmp_path / name)) as writer:
+            writer.write(trees[:10])
+            writer.write(trees[10:])
+
+        chunks = list(tree_io.iter_trees(str(tmp_path / name), chunk_size=10))
+        assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+        result = tree_io.read_trees(str(tmp_path / name))
+        assert json.loads(result.to_json(orient='records')) == json.loads(trees.to_json(orient='records'))
+
+
+def test_to_arrow_uses_tree_schema():
+    table = tree_io.to_arrow(pd.DataFrame({'tree_id': [1.0, None], 'note': ['a', 'b']}))
+    assert table.schema.field('tree_id').type == tree_io.TREE_SCHEMA.field('tree_id').type
+    assert table.column('tree_id').to_pylist() == [1, None]
+    assert table.schema.field('note').type == 'string'
+
+
+def test_typed_trees_write_the_same_json(tmp_path):
+    records = [
+        {'tree_id': 1, 'name_common': 'Palm', 'height_min_ft': '15', 'heritage': True, 'heritageYear': 2004,
+         'species_id': 7, 'latitude': '34.0254784674', 'longitude': -118.5},
+        {'tree_id': 2, 'name_common': None, 'height_min_ft': '30', 'heritage': False, 'heritageYear': None,
+         'species_id': 8, 'latitude': '34.1', 'longitude': -118.4},
+    ]
+    path = tmp_path / 'trees.json'
+    path.write_text(json.dumps(records, indent=2))
+
+    raw = tree_io.read_trees(str(path), compact=False)
+    trees = tree_io.read_trees(str(path))
+    assert isinstance(trees['name_common'].dtype, pd.CategoricalDtype)
+    assert str(trees['height_min_ft'].dtype) == 'Int16'
+    assert str(trees['heritageYear'].dtype) == 'Int16'
+    assert trees['latitude'].dtype == 'float64'
+
+    tree_io.write_trees(trees, str(tmp_path / 'typed.json'))
+    tree_io.write_trees(raw, str(tmp_path / 'raw.json'))
+    assert (tmp_path / 'typed.json').read_text() == (tmp_path / 'raw.json').read_text()
+    pd.testing.assert_frame_equal(tree_io.untyped(trees), raw)
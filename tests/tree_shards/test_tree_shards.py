@@ -0,0 +1,89 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import map_encoding
+import tree_shards
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def test_write_shards(tmp_path):
+    rng = np.random.default_rng(0)
+    trees = pd.DataFrame({
+        'tree_id': np.arange(500),
+        'name_common': 'Palm',
+        'latitude': rng.uniform(34.00, 34.05, 500),
+        'longitude': rng.uniform(-118.52, -118.47, 500),
+    })
+    trees.loc[7, ['latitude', 'longitude']] = np.nan
+
+    manifest = tree_shards.write_shards(trees, tmp_path)
+    assert sorted(manifest['changed']) == sorted(shard['file'] for shard in manifest['shards'].values())
+    assert manifest['shards']['unlocated']['count'] == 1
+    assert sum(shard['count'] for shard in manifest['shards'].values()) == 500
+
+    # every tree is in the shard the index points to
+    index = read_json(tmp_path / 'index.json')
+    tree_ids = map_encoding.decode_column(index['columns']['tree_id'], index['count'])
+    cells = map_encoding.decode_column(index['columns']['cell'], index['count'])
+    assert tree_ids == list(range(500))
+    for tree_id, cell in list(zip(tree_ids, cells))[::50]:
+        shard = read_json(tmp_path / manifest['shards'][cell]['file'])
+        assert [tree for tree in shard if tree['tree_id'] == tree_id][0]['name_common'] == 'Palm'
+
+    # unchanged trees give the same shards, and one changed tree one new shard
+    contents = {path.name: path.read_bytes() for path in tmp_path.glob('*.*.json')}
+    assert tree_shards.write_shards(trees.sample(frac=1, random_state=0), tmp_path)['changed'] == []
+    assert {path.name: path.read_bytes() for path in tmp_path.glob('*.*.json')} == contents
+
+    trees.loc[3, 'name_common'] = 'Oak'
+    manifest = tree_shards.write_shards(trees, tmp_path)
+    assert len(manifest['changed']) == 1 and len(manifest['removed']) == 1
+    assert not (tmp_path / manifest['removed'][0]).exists()
+    assert len(list(tmp_path.glob('*.*.json'))) == len(contents)
+
+
+def test_concurrent_writes(tmp_path):
+    rng = np.random.default_rng(0)
+    trees = pd.DataFrame({
+        'tree_id': np.arange(200),
+        'latitude': rng.uniform(34.00, 34.05, 200),
+        'longitude': rng.uniform(-118.52, -118.47, 200),
+    })
+
+    with ThreadPoolExecutor(4) as pool:
+        manifests = list(pool.map(lambda _: tree_shards.write_shards(trees, tmp_path), range(8)))
+
+    assert not list(tmp_path.glob('*.tmp'))
+    for manifest in manifests:
+        assert manifest['shards'] == manifests[0]['shards']
+    for shard in manifests[0]['shards'].values():
+        assert len(read_json(tmp_path / shard['file'])) == shard['count']
+
+
+def test_changed_against_uploaded_manifest(tmp_path):
+    rng = np.random.default_rng(0)
+    trees = pd.DataFrame({
+        'tree_id': np.arange(200),
+        'latitude': rng.uniform(34.00, 34.05, 200),
+        'longitude': rng.uniform(-118.52, -118.47, 200),
+    })
+    uploaded = tree_shards.write_shards(trees, tmp_path / 'uploaded')
+
+    # a fresh checkout has no manifest of its own: nothing uploaded means everything changed
+    nothing = tree_shards.read_previous_manifest(tmp_path / 'missing' / 'manifest.json')
+    manifest = tree_shards.write_shards(trees, tmp_path / 'fresh', previous=nothing)
+    assert sorted(manifest['changed']) == sorted(shard['file'] for shard in uploaded['shards'].values())
+
+    previous = tree_shards.read_previous_manifest(tmp_path / 'uploaded' / 'manifest.json')
+    # only the shard of the moved tree is missing from the bucket
+    trees.loc[3, 'latitude'] += 1e-9
+    manifest = tree_shards.write_shards(trees, tmp_path / 'checkout', previous=previous)
+    assert len(manifest['changed']) == 1 and len(manifest['removed']) == 1
+    assert manifest['removed'][0] in uploaded['changed']
@@ -0,0 +1,55 @@
+import json
+
+import pandas as pd
+import pytest
+
+import util
+
+
+def test_stage_disabled(monkeypatch):
+    monkeypatch.setattr(util, 'PROFILE', '')
+
+    def double(df):
+        return df * 2
+
+    assert util.stage(double) is double
+
+
+def test_stage_logs_json(monkeypatch, tmp_path):
+    log_file = tmp_path / 'log.txt'
+    monkeypatch.setattr(util, 'LOG_FILE', str(log_file))
+    monkeypatch.setattr(util, 'PROFILE', 'tracemalloc')
+    monkeypatch.setattr(util, 'TRACE_MEMORY', True)
+
+    @util.stage(rows_in='trees')
+    def head(layer, trees):
+        with util.profile('inner'):
+            pass
+        return trees.head(3)
+
+    assert len(head(pd.DataFrame({'a': range(2)}), trees=pd.DataFrame({'a': range(10)}))) == 3
+
+    inner, outer = [json.loads(line) for line in log_file.read_text().splitlines()]
+    assert inner['stage'] == 'inner'
+    assert outer['stage'] == 'test_stage_logs_json.<locals>.head'
+    assert (outer['rows_in'], outer['rows_out']) == (10, 3)
+    assert outer['peak_traced_mb'] >= inner['peak_traced_mb']
+    assert {'wall_s', 'cpu_s', 'max_rss_mb'} <= set(outer)
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / 'out.json'
+    path.write_text('old')
+    with util.atomic_write(path) as tmp:
+        with open(tmp, 'w') as f:
+            f.write('new')
+        assert path.read_text() == 'old'
+    assert path.read_text() == 'new'
+
+    with pytest.raises(RuntimeError):
+        with util.atomic_write(path) as tmp:
+            with open(tmp, 'w') as f:
+                f.write('half')
+            raise RuntimeError('failed')
+    assert path.read_text() == 'new'
+    assert [p.name for p in tmp_path.iterdir()] == ['out.json']
@@ -0,0 +1,47 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+import reference_cache
+import zone_index
+
+
+def pruning_zones():
+    zones = gpd.read_file('data/pruning/pruning_zones.shp').to_crs('epsg:4326')
+    return zones.rename(columns={'Id': 'pruning_zone'})
+
+
+def test_lookup_matches_sjoin():
+    zones = pruning_zones()
+    rng = np.random.default_rng(0)
+    lats = rng.uniform(33.99, 34.06, 20000)
+    lons = rng.uniform(-118.52, -118.44, 20000)
+    # the zone vertices are on their boundaries, and a few zones overlap
+    overlap = zones.geometry[0].intersection(zones.geometry[1]).representative_point()
+    vertices = shapely.get_coordinates(zones.geometry.to_numpy())
+    lats = np.concatenate([lats, vertices[:, 1], [overlap.y, np.nan]])
+    lons = np.concatenate([lons, vertices[:, 0], [overlap.x, np.nan]])
+
+    positions, found = zone_index.ZoneIndex.build(zones).lookup(lats, lons)
+
+    points = gpd.GeoDataFrame(
+        {'position': np.arange(len(lats))}, geometry=gpd.points_from_xy(lons, lats), crs='epsg:4326'
+    )
+    joined = gpd.sjoin(zones, points, how='right', predicate='contains').dropna(subset=['pruning_zone'])
+    np.testing.assert_array_equal(positions, joined['position'].to_numpy())
+    np.testing.assert_array_equal(found, joined['pruning_zone'].to_numpy().astype(np.int64))
+    assert (positions == len(lats) - 2).sum() == 2
+
+
+def test_cells_round_trip_through_cache(tmp_path):
+    zones = pruning_zones()
+    built = zone_index.build_cells(zones, max_precision=6)
+    cached = reference_cache.cached(
+        'data/pruning/pruning_zones.shp', 'epsg:4326', lambda: built, cache_dir=tmp_path, zone_cells=6
+    )
+    reread = reference_cache.cached(
+        'data/pruning/pruning_zones.shp', 'epsg:4326', lambda: None, cache_dir=tmp_path, zone_cells=6
+    )
+    pd.testing.assert_frame_equal(reread, cached)
+    assert reread['pruning_zone'].isna().any() and reread['pruning_zone'].notna().any()
@@ -0,0 +1,508 @@
+"""
+Reading and writing the trees dataset that flows between pipeline stages.
+
+The stages pass around the records described in "parse-trees.js", either
+as one JSON array or as newline-delimited JSON (one record per line).
+These helpers read either format in bounded chunks, so a stage can work
+through a large dataset without holding all of it in memory.
+
+The Python stages can also exchange the trees as Parquet or Arrow IPC,
+which are much faster to read and write than indented JSON. Both are
+written with TREE_SCHEMA, so the column types don't depend on what the
+values in a particular chunk happen to look like. While some stages still
+only speak JSON, files can be converted between the formats:
+
+```
+python tree_io.py trees.json trees.parquet
+python tree_io.py trees.parquet --to json > trees.json
+```
+"""
+
+import argparse
+import io
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import fetch
+
+
+DEFAULT_CHUNK_SIZE = 10000
+FORMATS = ('json', 'ndjson', 'parquet', 'arrow')
+EXTENSIONS = {
+    '.json': 'json',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.parquet': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+    '.ipc': 'arrow',
+}
+
+# The fields written by parse-trees.js, download-images.js and pruning_planting.py.
+# Columns that aren't listed here keep the type Arrow infers for them.
+TREE_SCHEMA = pa.schema([
+    ('tree_id', pa.int64()),
+    ('species_id', pa.int64()),
+    ('name_botanical', pa.string()),
+    ('name_common', pa.string()),
+    ('family_name_botanical', pa.string()),
+    ('family_name_common', pa.string()),
+    ('height_min_ft', pa.int64()),
+    ('height_max_ft', pa.int64()),
+    ('diameter_min_in', pa.int64()),
+    ('diameter_max_in', pa.int64()),
+    ('shade_production', pa.string()),
+    ('irrigation_requirements', pa.string()),
+    ('form', pa.string()),
+    ('type', pa.string()),
+    ('latitude', pa.float64()),
+    ('longitude', pa.float64()),
+    ('location_description', pa.string()),
+    ('nativity', pa.string()),
+    ('iucn_status', pa.string()),
+    ('ipc_rating', pa.string()),
+    ('ipc_url', pa.string()),
+    ('eol_id', pa.int64()),
+    ('eol_url', pa.string()),
+    ('address', pa.string()),
+    ('city', pa.string()),
+    ('state', pa.string()),
+    ('heritage', pa.bool_()),
+    ('heritageYear', pa.int64()),
+    ('heritageNumber', pa.int64()),
+    ('heritageText', pa.string()),
+    ('pruning_zone', pa.int64()),
+    ('segment', pa.string()),
+    ('planting_year', pa.float64()),
+    ('replacement_species', pa.string()),
+    ('pruning_year', pa.string()),
+    ('vacant_site_type', pa.string()),
+    ('vacant_site_latitude', pa.float64()),
+    ('vacant_site_longitude', pa.float64()),
+    ('vacant_site_distance_ft', pa.float64()),
+    ('images', pa.list_(pa.string())),
+])
+
+# How the Python stages hold the tree fields in memory (see `typed`). The
+# strings that repeat from tree to tree are categoricals, and sizes, years
+# and ids are nullable integers of the smallest width that holds them.
+# Coordinates stay float64: anything narrower would change the digits
+# written back out.
+CATEGORY_FIELDS = [
+    'name_botanical',
+    'name_common',
+    'family_name_botanical',
+    'family_name_common',
+    'shade_production',
+    'irrigation_requirements',
+    'form',
+    'type',
+    'location_description',
+    'nativity',
+    'iucn_status',
+    'ipc_rating',
+    'ipc_url',
+    'eol_url',
+    'city',
+    'state',
+    'segment',
+    'replacement_species',
+    'pruning_year',
+    'vacant_site_type',
+]
+INTEGER_DTYPES = {
+    'species_id': 'Int32',
+    'height_min_ft': 'Int16',
+    'height_max_ft': 'Int16',
+    'diameter_min_in': 'Int16',
+    'diameter_max_in': 'Int16',
+    'eol_id': 'Int64',
+    'heritageYear': 'Int16',
+    'heritageNumber': 'Int32',
+    'pruning_zone': 'Int16',
+}
+
+
+def typed(trees):
+    """
+    Give the tree fields of a dataframe read from JSON, Parquet or Arrow
+    their compact dtypes: CATEGORY_FIELDS become categoricals,
+    INTEGER_DTYPES nullable integers and heritage, when it has missing
+    values, a nullable bool. A column whose values don't fit its dtype is
+    left as it is.
+    """
+    columns = {}
+    for name in trees.columns:
+        values = trees[name]
+        if name in CATEGORY_FIELDS and values.dtype == object:
+            columns[name] = values.astype('category')
+        elif name in INTEGER_DTYPES and values.dtype.kind in 'iuf':
+            dtype = INTEGER_DTYPES[name]
+            limits = np.iinfo(dtype.lower())
+            present = values.dropna()
+            if ((present % 1 == 0) & (present >= limits.min) & (present <= limits.max)).all():
+                columns[name] = values.astype(dtype)
+        elif name == 'heritage' and values.dtype == object:
+            if values.dropna().map(type).eq(bool).all():
+                columns[name] = values.astype('boolean')
+    return trees.assign(**columns) if columns else trees
+
+
+def untyped(trees):
+    """
+    The reverse of `typed`: the dtypes `pd.read_json` gives the same
+    records, so the trees are written out exactly as they were read.
+    Nullable integers with missing values are floats, and categoricals
+    and nullable bools are objects.
+    """
+    columns = {}
+    for name in trees.columns:
+        values = trees[name]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            columns[name] = values.astype(object).where(values.notna(), None)
+        elif isinstance(values.dtype, pd.BooleanDtype):
+            if values.hasnans:
+                columns[name] = values.astype(object).where(values.notna(), None)
+            else:
+                columns[name] = values.astype(bool)
+        elif pd.api.types.is_extension_array_dtype(values.dtype) and values.dtype.kind in 'iu':
+            columns[name] = values.astype('float64') if values.hasnans else values.astype('int64')
+    return trees.assign(**columns) if columns else trees
+
+
+def _first_char(infile):
+    char = infile.read(1)
+    while char and char.isspace():
+        char = infile.read(1)
+    return char
+
+
+def iter_raw_array(infile, block_size=1 << 16, parse=False):
+    """
+    Yield the raw JSON text of each element of a JSON array, reading
+    `infile` a block at a time. The opening "[" must already have been read.
+    With `parse=True` the parsed elements are yielded instead, which saves
+    parsing them a second time.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+    while True:
+        while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] == ','):
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+        try:
+            if pos >= len(buffer):
+                raise json.JSONDecodeError('Ran out of data', buffer, pos)
+            value, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            block = infile.read(block_size)
+            eof = not block
+            buffer = buffer[pos:] + block
+            pos = 0
+            continue
+        yield value if parse else buffer[pos:end]
+        pos = end
+
+
+def iter_chunks(infile, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Read trees from a JSON array or newline-delimited JSON file and yield
+    them as dataframes of at most `chunk_size` records.
+
+    Each chunk is parsed with `pd.read_json`, so it gets the same type
+    inference as reading the whole file at once.
+    """
+    first = _first_char(infile)
+    if not first:
+        return
+    if first != '[':
+        # newline-delimited JSON: put the character we peeked at back
+        lines = io.StringIO(first + infile.readline())
+        yield from _chunk_lines([lines, infile], chunk_size)
+        return
+
+    records = []
+    for record in iter_raw_array(infile):
+        records.append(record)
+        if len(records) == chunk_size:
+            yield pd.read_json(io.StringIO('[' + ','.join(records) + ']'))
+            records = []
+    if records:
+        yield pd.read_json(io.StringIO('[' + ','.join(records) + ']'))
+
+
+def _chunk_lines(files, chunk_size):
+    lines = []
+    for f in files:
+        for line in f:
+            if line.strip():
+                lines.append(line if line.endswith('\n') else line + '\n')
+            if len(lines) == chunk_size:
+                yield pd.read_json(io.StringIO(''.join(lines)), lines=True)
+                lines = []
+    if lines:
+        yield pd.read_json(io.StringIO(''.join(lines)), lines=True)
+
+
+def write_ndjson(trees, outfile):
+    """
+    Write a dataframe of trees to `outfile` as newline-delimited JSON.
+    """
+    if len(trees) == 0:
+        return
+    text = untyped(pd.DataFrame(trees)).to_json(orient='records', lines=True)
+    outfile.write(text if text.endswith('\n') else text + '\n')
+    outfile.flush()
+
+
+def format_for(path, fmt=None, default='json'):
+    """
+    The format to use for `path`: `fmt` if given, otherwise the one its
+    extension implies, falling back to `default` for stdin/stdout ("-")
+    and unknown extensions.
+    """
+    if fmt:
+        if fmt not in FORMATS:
+            raise ValueError(f'unknown format {fmt}, expected one of {", ".join(FORMATS)}')
+        return fmt
+    if not path or path == '-':
+        return default
+    return EXTENSIONS.get(Path(path).suffix.lower(), default)
+
+
+def tree_schema(trees):
+    """
+    The schema for a dataframe of trees: TREE_SCHEMA's type for the known
+    columns and the inferred type for the rest, in the dataframe's order.
+    """
+    inferred = pa.Schema.from_pandas(trees, preserve_index=False)
+    return pa.schema([
+        TREE_SCHEMA.field(name) if name in TREE_SCHEMA.names else inferred.field(name)
+        for name in trees.columns
+    ])
+
+
+def to_arrow(trees, schema=None):
+    """
+    Convert a dataframe of trees to an Arrow table with `schema`, which
+    defaults to `tree_schema(trees)`. Columns of the schema the dataframe
+    doesn't have are filled with nulls.
+    """
+    schema = schema or tree_schema(trees)
+    arrays = []
+    for field in schema:
+        if field.name not in trees.columns:
+            arrays.append(pa.nulls(len(trees), field.type))
+            continue
+        values = trees[field.name]
+        if isinstance(values.dtype, pd.CategoricalDtype) and not pa.types.is_dictionary(field.type):
+            values = values.astype(object)
+        if pa.types.is_integer(field.type) and values.dtype.kind == 'f':
+            # pandas stores integers with missing values as floats
+            values = values.astype('Int64')
+        try:
+            arrays.append(pa.array(values, type=field.type, from_pandas=True))
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError) as e:
+            raise ValueError(f'column {field.name} does not fit the tree schema ({field.type}): {e}')
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def from_arrow(table):
+    """
+    Convert an Arrow table of trees back into a dataframe, with the same
+    dtypes `pd.read_json` would give the equivalent JSON.
+    """
+    return table.to_pandas()
+
+
+def _open_binary(path, mode):
+    if path == '-':
+        return sys.stdin.buffer if mode == 'rb' else sys.stdout.buffer
+    return open(path, mode)
+
+
+def _local(path):
+    # urls are downloaded through the fetch cache and read from there
+    return str(fetch.fetch(path)) if fetch.is_url(path) else path
+
+
+def iter_trees(path, chunk_size=DEFAULT_CHUNK_SIZE, fmt=None, compact=True):
+    """
+    Yield the trees in `path` ("-" for stdin, or a url) as dataframes of at
+    most `chunk_size` records, in whichever of FORMATS the file is in.
+
+    With `compact` the chunks have the dtypes `typed` gives them.
+    """
+    chunks = _iter_trees(path, chunk_size, fmt)
+    return (typed(chunk) for chunk in chunks) if compact else chunks
+
+
+def _iter_trees(path, chunk_size, fmt):
+    path = _local(path)
+    fmt = format_for(path, fmt)
+    if fmt in ('json', 'ndjson'):
+        infile = sys.stdin if path == '-' else open(path)
+        with infile:
+            yield from iter_chunks(infile, chunk_size)
+    elif fmt == 'parquet':
+        source = path
+        if path == '-':
+            # Parquet keeps its metadata at the end, so it needs a seekable file
+            source = pa.BufferReader(sys.stdin.buffer.read())
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_size):
+            yield from_arrow(pa.Table.from_batches([batch]))
+    else:
+        with _open_binary(path, 'rb') as f:
+            for batch in _arrow_batches(f):
+                for start in range(0, batch.num_rows, chunk_size):
+                    yield from_arrow(pa.Table.from_batches([batch.slice(start, chunk_size)]))
+
+
+def _arrow_reader(f):
+    # pipes carry the IPC stream format, but accept the file (Feather v2) format too
+    if f.seekable():
+        try:
+            return pa.ipc.open_file(f)
+        except pa.ArrowInvalid:
+            f.seek(0)
+    return pa.ipc.open_stream(f)
+
+
+def _arrow_batches(f):
+    reader = _arrow_reader(f)
+    if isinstance(reader, pa.ipc.RecordBatchFileReader):
+        return (reader.get_batch(i) for i in range(reader.num_record_batches))
+    return reader
+
+
+def read_trees(path, fmt=None, compact=True):
+    """
+    Read all the trees in `path` ("-" for stdin, or a url) into one
+    dataframe. With `compact` it has the dtypes `typed` gives it.
+    """
+    trees = _read_trees(path, fmt)
+    return typed(trees) if compact else trees
+
+
+def _read_trees(path, fmt):
+    path = _local(path)
+    fmt = format_for(path, fmt)
+    if fmt in ('json', 'ndjson'):
+        infile = sys.stdin if path == '-' else open(path)
+        with infile:
+            return pd.read_json(infile, lines=fmt == 'ndjson')
+    if fmt == 'parquet':
+        source = pa.BufferReader(sys.stdin.buffer.read()) if path == '-' else path
+        return from_arrow(pq.read_table(source))
+    with _open_binary(path, 'rb') as f:
+        return from_arrow(_arrow_reader(f).read_all())
+
+
+def write_trees(trees, path, fmt=None):
+    """
+    Write a dataframe of trees to `path` ("-" for stdout). JSON is written
+    the way the pipeline always has: one indented array of records.
+    """
+    fmt = format_for(path, fmt)
+    if fmt == 'json':
+        outfile = sys.stdout if path == '-' else open(path, 'w')
+        outfile.write(untyped(trees).to_json(orient='records', indent=2))
+        if outfile is not sys.stdout:
+            outfile.close()
+        return
+    with TreeWriter(path, fmt) as writer:
+        writer.write(trees)
+
+
+class TreeWriter(object):
+    """
+    Write trees to `path` ("-" for stdout) one chunk at a time.
+
+    The schema for the binary formats is fixed by the first chunk, and
+    later chunks are cast to it.
+    """
+
+    def __init__(self, path, fmt=None):
+        self.fmt = format_for(path, fmt)
+        self.binary = self.fmt in ('parquet', 'arrow')
+        if self.binary:
+            self.outfile = _open_binary(path, 'wb')
+        else:
+            self.outfile = sys.stdout if path == '-' else open(path, 'w')
+        self.schema = None
+        self.writer = None
+        self.count = 0
+
+    def write(self, trees):
+        if self.fmt == 'ndjson':
+            write_ndjson(trees, self.outfile)
+        elif self.fmt == 'json':
+            if len(trees):
+                text = untyped(pd.DataFrame(trees)).to_json(orient='records')
+                self.outfile.write(('[' if self.count == 0 else ',') + text[1:-1])
+        else:
+            if self.schema is None:
+                self.schema = tree_schema(trees)
+                if self.fmt == 'parquet':
+                    self.writer = pq.ParquetWriter(self.outfile, self.schema)
+                else:
+                    self.writer = pa.ipc.new_stream(self.outfile, self.schema)
+            self.writer.write_table(to_arrow(trees, self.schema))
+        self.count += len(trees)
+
+    def close(self):
+        if self.fmt == 'json':
+            self.outfile.write('[]' if self.count == 0 else ']')
+        elif self.binary and self.writer is None:
+            # nothing was written, but still leave a readable, empty file
+            self.write(pd.DataFrame({name: [] for name in TREE_SCHEMA.names}))
+        if self.writer is not None:
+            self.writer.close()
+        self.outfile.flush()
+        if self.outfile not in (sys.stdout, sys.stdout.buffer):
+            self.outfile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Convert the trees dataset between formats.')
+    parser.add_argument('infile', nargs='?', default='-',
+        help='trees file. if not specified read from stdin')
+    parser.add_argument('outfile', nargs='?', default='-',
+        help='output file. if not specified write to stdout')
+    parser.add_argument('-f', '--from', dest='input_format', choices=FORMATS,
+        help='format of infile. defaults to the one its extension implies, or json')
+    parser.add_argument('-t', '--to', dest='output_format', choices=FORMATS,
+        help='format of outfile. defaults to the one its extension implies, or json')
+    parser.add_argument('-c', '--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+        help=f'number of trees converted at a time. defaults to {DEFAULT_CHUNK_SIZE}')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    output_format = format_for(args.outfile, args.output_format)
+    if output_format == 'json':
+        # the indented array the JSON stages expect needs the whole dataset
+        write_trees(read_trees(args.infile, args.input_format), args.outfile, output_format)
+    else:
+        with TreeWriter(args.outfile, output_format) as writer:
+            for chunk in iter_trees(args.infile, args.chunk_size, args.input_format):
+                writer.write(chunk)
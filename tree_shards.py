@@ -0,0 +1,221 @@
+"""
+Writes the tree details as spatial shards instead of one file per tree.
+
+split-trees.js writes every tree to its own `trees/<tree_id>.json`, which
+means uploading (and setting metadata on) one object per tree. This
+instead groups the trees by the geohash cell (`precision` characters) they
+are in, and writes each cell as one shard: a JSON array of the trees'
+records, in tree_id order. Trees without coordinates share a shard of
+their own, "unlocated".
+
+Each shard is named after its cell and a hash of its contents
+(`9q5c2x.3f1a9c0b7d2e4f68.json`), so a shard whose trees didn't change is
+written with the same name and the same bytes on every run, and never has
+to be uploaded again. Next to the shards:
+
+- `index.json` maps tree_id to shard cell, in the columnar form of
+  map_encoding.py (tree ids delta encoded, cells dictionary encoded);
+- `manifest.json` maps each cell to its shard file and tree count, and
+  lists the shard files that were `changed` (not in the previous
+  manifest) and `removed` (in the previous manifest, but gone now).
+  Removed shards are deleted from the directory.
+
+The previous manifest is the one last written to the directory, or with
+`--previous` the one already uploaded, so that `changed` is exactly what
+the bucket is missing even on a fresh checkout. When nothing has been
+uploaded yet every shard is changed.
+
+```
+python tree_shards.py enriched_trees.json build/data/shards
+python tree_shards.py enriched_trees.json build/data/shards \
+  --previous https://storage.googleapis.com/public-tree-map/data/shards/manifest.json
+```
+"""
+
+import argparse
+import hashlib
+import json
+import urllib.error
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import fast_geohash
+import fetch
+import map_encoding
+import tree_io
+import util
+
+
+VERSION = 1
+PRECISION = 6
+HASH_LENGTH = 16
+UNLOCATED = 'unlocated'
+INDEX = 'index.json'
+MANIFEST = 'manifest.json'
+
+
+def shard_cells(trees, precision=PRECISION):
+    """
+    The cell of the shard each tree goes in.
+    """
+    lats = trees['latitude'].to_numpy(dtype=np.float64)
+    lons = trees['longitude'].to_numpy(dtype=np.float64)
+    located = np.isfinite(lats) & np.isfinite(lons)
+    cells = np.full(len(trees), UNLOCATED, dtype=object)
+    cells[located] = fast_geohash.encode(lats[located], lons[located], precision=precision)
+    return cells
+
+
+def build_shards(trees, precision=PRECISION):
+    """
+    Yield (cell, file name, contents, tree ids) for every shard, in cell
+    order.
+    """
+    if len(trees) == 0:
+        return
+    cells = shard_cells(trees, precision)
+    order = np.lexsort((trees['tree_id'].to_numpy(), cells))
+    trees, cells = trees.iloc[order], cells[order]
+
+    # serialize every record at once, then cut the lines up between shards;
+    # newlines within values are escaped, so each record is one line
+    lines = tree_io.untyped(trees).to_json(orient='records', lines=True).splitlines()
+    tree_ids = trees['tree_id'].to_numpy()
+    starts = np.concatenate([[0], np.flatnonzero(cells[1:] != cells[:-1]) + 1, [len(cells)]])
+    for start, end in zip(starts[:-1], starts[1:]):
+        contents = ('[' + ','.join(lines[start:end]) + ']').encode('utf-8')
+        digest = hashlib.sha256(contents).hexdigest()[:HASH_LENGTH]
+        cell = cells[start]
+        yield cell, f'{cell}.{digest}.json', contents, tree_ids[start:end]
+
+
+def read_manifest(directory):
+    """
+    The manifest of the shards last written to `directory`, or None.
+    """
+    path = Path(directory) / MANIFEST
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def read_previous_manifest(source):
+    """
+    The manifest at `source`, a url (such as the uploaded manifest's) or a
+    path, or an empty one if there is none there yet.
+    """
+    try:
+        path = fetch.fetch(source)
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
+    except urllib.error.HTTPError as e:
+        if e.code != 404:
+            raise
+    util.log(f'== No previous manifest at {source}, every shard is changed')
+    return {'shards': {}}
+
+
+def encode_index(tree_ids, cells):
+    """
+    The tree_id to shard cell index, sorted by tree_id. A tree listed more
+    than once (trees in overlapping pruning zones are) is indexed once.
+    """
+    index = pd.DataFrame({'tree_id': tree_ids, 'cell': cells}).drop_duplicates('tree_id').sort_values('tree_id')
+    return {
+        'version': VERSION,
+        'count': len(index),
+        'columns': {name: map_encoding.encode_column(index[name], name) for name in index.columns},
+    }
+
+
+def _write(path, contents):
+    # runs writing the same shard at once don't see each other's half
+    # written files
+    with util.atomic_write(path) as tmp, open(tmp, 'wb') as f:
+        f.write(contents)
+
+
+@util.stage(rows_in='trees')
+def write_shards(trees, directory, precision=PRECISION, previous=None):
+    """
+    Write the shards of `trees`, the index and the manifest to `directory`,
+    skipping shards that are already there. Returns the manifest.
+
+    `changed` and `removed` are listed against the `previous` manifest,
+    which defaults to the one last written to `directory`.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    local = read_manifest(directory)
+    local_files = {shard['file'] for shard in local['shards'].values()} if local else set()
+    if previous is None:
+        previous = local
+    previous_files = {shard['file'] for shard in previous['shards'].values()} if previous else set()
+
+    shards = {}
+    changed = []
+    tree_ids, cells = [], []
+    for cell, name, contents, ids in build_shards(trees, precision):
+        path = directory / name
+        if not path.exists():
+            _write(path, contents)
+        if name not in previous_files:
+            changed.append(name)
+        shards[cell] = {'file': name, 'count': len(ids)}
+        tree_ids.append(ids)
+        cells.append(np.full(len(ids), cell, dtype=object))
+
+    current_files = {shard['file'] for shard in shards.values()}
+    removed = sorted(previous_files - current_files)
+    for name in (local_files | previous_files) - current_files:
+        (directory / name).unlink(missing_ok=True)
+
+    index = encode_index(
+        np.concatenate(tree_ids) if tree_ids else np.zeros(0, dtype=np.int64),
+        np.concatenate(cells) if cells else np.zeros(0, dtype=object)
+    )
+    _write(directory / INDEX, json.dumps(index, separators=(',', ':')).encode('utf-8'))
+    manifest = {
+        'version': VERSION,
+        'precision': precision,
+        'count': len(trees),
+        'index': INDEX,
+        'shards': shards,
+        'changed': changed,
+        'removed': removed,
+    }
+    _write(directory / MANIFEST, json.dumps(manifest, separators=(',', ':')).encode('utf-8'))
+    util.log(
+        f'== Wrote {len(changed)} changed of {len(shards)} tree shards for {len(trees)} trees, '
+        f'{len(removed)} removed'
+    )
+    return manifest
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Writes the tree details as content-addressed spatial shards.')
+    parser.add_argument('infile', nargs='?', default='-',
+        help='enriched trees file. if not specified read JSON from stdin')
+    parser.add_argument('outdir', help='directory to write the shards, index.json and manifest.json to')
+    parser.add_argument('-i', '--input-format', choices=tree_io.FORMATS,
+        help='format of infile. defaults to the one its extension implies, or json')
+    parser.add_argument('-p', '--precision', type=int, default=PRECISION,
+        help=f'geohash length of the shard cells. defaults to {PRECISION}')
+    parser.add_argument('--previous',
+        help='url or path of the manifest to list the changed shards against, such as the uploaded one. '
+             'defaults to the manifest in outdir')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    # read before writing anything, so a failure to reach it leaves no shards
+    previous = read_previous_manifest(args.previous) if args.previous else None
+    trees = tree_io.read_trees(args.infile, args.input_format)
+    write_shards(trees, args.outdir, args.precision, previous)
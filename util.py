@@ -0,0 +1,144 @@
+"""
+Helpers shared by the Python stages of the pipeline.
+"""
+
+import functools
+import inspect
+import json
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+
+LOG_FILE = 'tmp/log.txt'
+# PIPELINE_PROFILE=1 logs the time and memory of every stage, and
+# PIPELINE_PROFILE=tracemalloc also traces each stage's peak allocations,
+# which is more precise than the peak RSS but slows the stages down
+PROFILE = os.environ.get('PIPELINE_PROFILE', '').lower()
+TRACE_MEMORY = PROFILE == 'tracemalloc'
+
+# peak traced memory of each open profiled block that a nested block's reset
+# hid from tracemalloc, innermost last
+_peaks = []
+
+
+def log(message):
+    """
+    Append a line to the pipeline's log file. Like the node scripts, the
+    Python stages keep stdout for data, so they log to tmp/log.txt.
+    """
+    os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+    with open(LOG_FILE, 'a') as f:
+        f.write(message + '\n')
+
+
+@contextmanager
+def atomic_write(path):
+    """
+    Yield the path of a new temporary file next to `path`, and move it over
+    `path` once the block finishes without an error:
+
+    ```
+    with util.atomic_write(entry) as tmp:
+        frame.to_parquet(tmp)
+    ```
+
+    Readers never see a half written file, and processes writing the same
+    path at once each write their own temporary file, the last one to
+    finish winning. The temporary file is removed if the block fails.
+    """
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f'{path.name}.', suffix='.tmp')
+    os.close(fd)
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        Path(tmp).unlink(missing_ok=True)
+
+
+def _rows(value):
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    return len(value) if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)) else None
+
+
+@contextmanager
+def profile(name, rows_in=None):
+    """
+    Log the wall time, CPU time, peak memory and rows in and out of the
+    block as one JSON line:
+
+    ```
+    with util.profile('load', rows_in=len(trees)) as record:
+        ...
+        record['rows_out'] = len(result)
+    ```
+
+    The peak RSS is the process's peak so far, not just the block's. Does
+    nothing but yield a dict when profiling is off.
+    """
+    record = {'stage': name, 'rows_in': rows_in, 'rows_out': None}
+    if not PROFILE:
+        yield record
+        return
+
+    if TRACE_MEMORY:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        # resetting the peak for this block loses the enclosing block's peak so far
+        if _peaks:
+            _peaks[-1] = max(_peaks[-1], tracemalloc.get_traced_memory()[1])
+        _peaks.append(0)
+        tracemalloc.reset_peak()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_s'] = round(time.perf_counter() - wall, 4)
+        record['cpu_s'] = round(time.process_time() - cpu, 4)
+        # ru_maxrss is in kilobytes on linux
+        record['max_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        if TRACE_MEMORY:
+            peak = max(tracemalloc.get_traced_memory()[1], _peaks.pop())
+            record['peak_traced_mb'] = round(peak / 2 ** 20, 2)
+            if _peaks:
+                _peaks[-1] = max(_peaks[-1], peak)
+            else:
+                tracemalloc.stop()
+        record['pid'] = os.getpid()
+        log(json.dumps({'event': 'stage', **record}))
+
+
+def stage(function=None, name=None, rows_in=None):
+    """
+    Decorator that profiles every call of a stage function (see
+    `profile`). Rows in is the length of the argument named `rows_in`, or
+    of the first dataframe argument; rows out the length of the returned
+    dataframe. When profiling is off the function is returned as is.
+    """
+    if function is None:
+        return functools.partial(stage, name=name, rows_in=rows_in)
+    if not PROFILE:
+        return function
+    name = name or function.__qualname__
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def profiled(*args, **kwargs):
+        if rows_in:
+            counted = [signature.bind(*args, **kwargs).arguments.get(rows_in)]
+        else:
+            counted = list(args) + list(kwargs.values())
+        rows = next((rows for rows in map(_rows, counted) if rows is not None), None)
+        with profile(name, rows) as record:
+            result = function(*args, **kwargs)
+            record['rows_out'] = _rows(result)
+        return result
+    return profiled
@@ -0,0 +1,149 @@
+"""
+Geohash cell index of the pruning zones.
+
+Assigning every tree its pruning zone with a spatial join tests each tree
+against the zone polygons. The zones are static, so this instead covers
+them with geohash cells once, quadtree style: a cell that lies entirely
+inside one zone, or outside all of them, is kept whole, and a cell that
+straddles a zone boundary is split into its 32 children, down to
+`max_precision`. Most trees are then resolved with a dictionary lookup of
+their geohash at each cell size, and only the trees in the boundary cells
+left at `max_precision` are tested against the polygons.
+
+The result is the same as
+`gpd.sjoin(zones, trees, how='right', op='contains')`: a tree on a zone's
+edge is in no zone, and a tree where zones overlap is in all of them.
+
+The cells are a plain dataframe, so they are kept in the reference cache
+next to the zones themselves (see `pruning_planting.load_reference_layers`).
+"""
+
+import numpy as np
+import pandas as pd
+import shapely
+
+import fast_geohash
+
+
+MAX_PRECISION = 8
+# cells are grown by this many degrees before they are tested, so a point that
+# geohashes into a cell is inside its box despite rounding at the edges
+CELL_MARGIN = 1e-9
+CHILDREN = np.array(list(fast_geohash.BASE32))
+
+
+def _cell_boxes(cells):
+    south, west, north, east = fast_geohash.bbox(cells)
+    return shapely.box(west - CELL_MARGIN, south - CELL_MARGIN, east + CELL_MARGIN, north + CELL_MARGIN)
+
+
+def build_cells(zones, zone_column='pruning_zone', max_precision=MAX_PRECISION):
+    """
+    Cover `zones` (a geodataframe in EPSG:4326) with geohash cells.
+
+    Returns a dataframe with a row for every cell that is inside exactly one
+    zone, holding its `zone_column` value, or outside all of them, holding
+    NA. Points in no listed cell have to be tested against the polygons.
+    """
+    geometries = zones.geometry.to_numpy()
+    shapely.prepare(geometries)
+    tree = shapely.STRtree(geometries)
+    values = zones[zone_column].to_numpy()
+
+    cells = CHILDREN
+    found, found_zones = [], []
+    for precision in range(1, max_precision + 1):
+        boxes = _cell_boxes(cells)
+        box_idx, zone_idx = tree.query(boxes, predicate='intersects')
+        hits = np.bincount(box_idx, minlength=len(cells))
+
+        zone_of = np.full(len(cells), -1)
+        zone_of[box_idx] = zone_idx
+        inside = hits == 1
+        inside[inside] = shapely.contains_properly(geometries[zone_of[inside]], boxes[inside])
+
+        outside = hits == 0
+        found.append(cells[outside | inside])
+        found_zones.append(np.where(inside, zone_of, -1)[outside | inside])
+
+        straddling = cells[(hits > 0) & ~inside]
+        if precision == max_precision or len(straddling) == 0:
+            break
+        cells = np.char.add(straddling[:, None], CHILDREN[None, :]).ravel()
+
+    positions = np.concatenate(found_zones)
+    zone_values = pd.array(values.take(np.maximum(positions, 0)), dtype='Int64')
+    zone_values[positions < 0] = pd.NA
+    return pd.DataFrame({'cell': np.concatenate(found).astype(object), zone_column: zone_values})
+
+
+class ZoneIndex(object):
+    """
+    Looks up the zones of points from the cells `build_cells` made, and
+    the zone polygons for the points in boundary cells.
+    """
+
+    def __init__(self, zones, cells, zone_column='pruning_zone'):
+        self.zone_column = zone_column
+        self.values = zones[zone_column].to_numpy()
+        self.geometries = zones.geometry.to_numpy()
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+
+        lengths = cells['cell'].str.len()
+        self.max_precision = int(lengths.max()) if len(cells) else 1
+        # one table per cell size, looked up from the coarsest, keyed on the
+        # integer geohash codes, which are quicker to hash than strings
+        self.levels = []
+        for precision, level in cells.groupby(lengths):
+            codes, _ = fast_geohash.to_codes(level['cell'].to_numpy(dtype=str))
+            self.levels.append((int(precision), pd.Index(codes.astype(np.int64)), level[zone_column].to_numpy()))
+
+    @classmethod
+    def build(cls, zones, zone_column='pruning_zone', max_precision=MAX_PRECISION):
+        return cls(zones, build_cells(zones, zone_column, max_precision), zone_column)
+
+    def lookup(self, latitudes, longitudes):
+        """
+        Find the zones that contain each point.
+
+        Returns (positions, zones): a point in one zone appears once with
+        that zone's value, a point in several zones once for each of them
+        and a point in no zone not at all. Points are in order, with the
+        zones of each point in the order of the zone layer.
+        """
+        lats = np.asarray(latitudes, dtype=np.float64)
+        lons = np.asarray(longitudes, dtype=np.float64)
+        valid = np.isfinite(lats) & np.isfinite(lons) & (np.abs(lats) <= 90.0)
+        unresolved = np.nonzero(valid)[0]
+        positions, zones, ranks = [], [], []
+
+        codes = fast_geohash.encode_codes(
+            lats[unresolved], lons[unresolved], precision=self.max_precision
+        ).astype(np.int64)
+        for precision, cells, cell_zones in self.levels:
+            found = cells.get_indexer(codes >> (5 * (self.max_precision - precision)))
+            hit = found >= 0
+            hit_zones = cell_zones[found[hit]]
+            inside = pd.notna(hit_zones)
+            positions.append(unresolved[hit][inside])
+            zones.append(hit_zones[inside].astype(np.int64))
+            ranks.append(np.zeros(inside.sum(), dtype=np.intp))
+            unresolved, codes = unresolved[~hit], codes[~hit]
+
+        # the rest are in boundary cells
+        points = shapely.points(lons[unresolved], lats[unresolved])
+        point_idx, zone_idx = self.tree.query(points)
+        contained = shapely.contains_xy(
+            self.geometries[zone_idx], lons[unresolved][point_idx], lats[unresolved][point_idx]
+        )
+        point_idx, zone_idx = point_idx[contained], zone_idx[contained]
+        positions.append(unresolved[point_idx])
+        zones.append(self.values[zone_idx].astype(np.int64))
+        ranks.append(zone_idx)
+
+        # a point resolved by its cell is in one zone, so only the points
+        # tested against the polygons need their zones put in layer order
+        positions = np.concatenate(positions)
+        order = np.lexsort((np.concatenate(ranks), positions))
+        return positions[order], np.concatenate(zones)[order]